@@ -0,0 +1,97 @@
+"""
+Derives NGRAM_THRESHOLDS in tooltalk.apis.utils from (prediction, ground truth) pairs of semantic parameters.
+
+Pairs are collected from every dataset or output folder given. Predictions of evaluated runs are paired with ground
+truths of the same API, like check_api_call_correctness compares them. Ground truths of the same API are also paired
+with each other, which adds mostly dissimilar pairs. Pairs are scored with the reference backend, sent2vec by default,
+and the n-gram cutoffs agreeing best with its decisions are printed together with their agreement.
+"""
+import argparse
+import json
+from typing import List, Tuple
+
+from tooltalk.apis import APIS_BY_NAME
+from tooltalk.apis.utils import (
+    NGRAM_THRESHOLDS, SIMILARITY_BACKENDS, _get_shortcut_score, _NgramVectorizer, calibrate_ngram_thresholds,
+    get_similarity_scores, get_threshold_agreement
+)
+from tooltalk.utils.file_utils import iter_conversations
+
+
+def get_api_semantic_pairs(prediction: dict, ground_truth: dict) -> List[Tuple[str, str]]:
+    api_name = ground_truth["request"]["api_name"]
+    return APIS_BY_NAME[api_name].get_semantic_pairs(prediction, ground_truth) if api_name in APIS_BY_NAME else list()
+
+
+def get_semantic_pairs(input_paths: List[str]) -> List[Tuple[str, str]]:
+    pairs = list()
+    for input_path in input_paths:
+        dataset_ground_truths = list()
+        for _, conversation in iter_conversations(input_path):
+            ground_truths = list()
+            predictions = list()
+            for turn in conversation["conversation"]:
+                ground_truths.extend(turn.get("apis", list()))
+                predictions.extend(
+                    prediction for prediction in turn.get("predictions", list())
+                    if prediction["role"] == "api" and isinstance(prediction["request"]["parameters"], dict)
+                )
+            for prediction in predictions:
+                for ground_truth in ground_truths:
+                    if ground_truth["request"]["api_name"] == prediction["request"]["api_name"]:
+                        pairs.extend(get_api_semantic_pairs(prediction, ground_truth))
+            dataset_ground_truths.extend(ground_truths)
+
+        for i, ground_truth in enumerate(dataset_ground_truths):
+            for other in dataset_ground_truths[i + 1:]:
+                if other["request"]["api_name"] == ground_truth["request"]["api_name"]:
+                    pairs.extend(get_api_semantic_pairs(other, ground_truth))
+
+    # pairs equal up to case and whitespace score 1 without embedding, with every backend
+    return [pair for pair in dict.fromkeys(pairs) if _get_shortcut_score(*pair) is None]
+
+
+def read_scored_pairs(scores_path: str) -> Tuple[List[Tuple[str, str]], List[float]]:
+    with open(scores_path, 'r', encoding='utf-8') as reader:
+        lines = [json.loads(line) for line in reader if line.strip()]
+    return [(line["prediction"], line["ground_truth"]) for line in lines], [line["score"] for line in lines]
+
+
+def write_scored_pairs(scores_path: str, pairs: List[Tuple[str, str]], scores: List[float]) -> None:
+    with open(scores_path, 'w', encoding='utf-8') as writer:
+        for (prediction, ground_truth), score in zip(pairs, scores):
+            writer.write(json.dumps({"prediction": prediction, "ground_truth": ground_truth, "score": score}) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_paths", nargs="*", type=str, help="Datasets or outputs of evaluated runs")
+    parser.add_argument("--reference_backend", type=str, default="sent2vec", choices=SIMILARITY_BACKENDS.keys(),
+                        help="Backend whose decisions n-gram thresholds should agree with")
+    parser.add_argument("--scores_path", type=str, default=None,
+                        help="JSONL file of scored pairs, written after scoring input_paths or read if none are given")
+    args = parser.parse_args()
+
+    if args.input_paths:
+        pairs = get_semantic_pairs(args.input_paths)
+        reference_backend = SIMILARITY_BACKENDS[args.reference_backend]()
+        if hasattr(reference_backend, "load_model"):
+            reference_backend.load_model()
+        reference_scores = get_similarity_scores(reference_backend, pairs).tolist()
+        if args.scores_path is not None:
+            write_scored_pairs(args.scores_path, pairs, reference_scores)
+    elif args.scores_path is not None:
+        # recalibrating from saved scores doesn't need the reference model
+        pairs, reference_scores = read_scored_pairs(args.scores_path)
+    else:
+        parser.error("Either input_paths or --scores_path is required")
+
+    ngram_thresholds = calibrate_ngram_thresholds(pairs, reference_scores)
+    print(f"Scored {len(pairs)} pairs")
+    for name, thresholds in (("current", NGRAM_THRESHOLDS), ("calibrated", ngram_thresholds)):
+        agreement = get_threshold_agreement(pairs, reference_scores, _NgramVectorizer(thresholds=thresholds))
+        print(f"{name}: {json.dumps(thresholds)}, agreement: {json.dumps(agreement)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,10 @@ Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
 from abc import ABC
-from typing import Optional
+from typing import List, Optional
 
 from .exceptions import APIException
-from .api import API, APISuite
+from .api import API, APISuite, DatabaseIndex
 from .utils import verify_phone_format, verify_email_format
 
 """
@@ -23,16 +23,69 @@ name: str
 ACCOUNT_DB_NAME = "Account"
 
 
+class AccountIndex(DatabaseIndex):
+    """
+    Email -> usernames index over the account database, used by QueryUser.
+    Copies share the index of the initial database and only copy emails modified since.
+    """
+    def __init__(self, database: dict = None) -> None:
+        # email -> {username: position}, position preserves database order of users
+        self.base_emails = dict()
+        # emails modified since index was built, these shadow base_emails
+        self.emails = dict()
+        self.next_position = 0
+        if database is not None:
+            for username, user_data in database.items():
+                self.base_emails.setdefault(user_data["email"], dict())[username] = self.next_position
+                self.next_position += 1
+
+    def copy(self) -> "AccountIndex":
+        account_index = AccountIndex()
+        account_index.base_emails = self.base_emails
+        account_index.emails = {email: users.copy() for email, users in self.emails.items()}
+        account_index.next_position = self.next_position
+        return account_index
+
+    def _get_owned_users(self, email: str) -> dict:
+        if email not in self.emails:
+            self.emails[email] = self.base_emails.get(email, dict()).copy()
+        return self.emails[email]
+
+    def add_user(self, username: str, email: str, position: int = None) -> None:
+        if position is None:
+            position = self.next_position
+            self.next_position += 1
+        self._get_owned_users(email)[username] = position
+
+    def remove_user(self, username: str, email: str) -> Optional[int]:
+        return self._get_owned_users(email).pop(username, None)
+
+    def update_email(self, username: str, old_email: str, new_email: str) -> None:
+        # user keeps its position in the database
+        self.add_user(username, new_email, self.remove_user(username, old_email))
+
+    def query(self, email: str) -> List[str]:
+        """
+        Returns usernames of users with email, in database order.
+        """
+        users = self.emails[email] if email in self.emails else self.base_emails.get(email, dict())
+        return sorted(users, key=users.__getitem__)
+
+
 class AccountAPI(API, ABC):
     database_name = ACCOUNT_DB_NAME
+    index_class = AccountIndex
 
     def __init__(
             self,
             account_database: dict,
             now_timestamp: str,
-            api_database: dict = None
+            api_database: dict = None,
+            session_index: dict = None,
+            api_index: DatabaseIndex = None
     ) -> None:
-        super().__init__(account_database, now_timestamp, api_database)
+        # account APIs always operate on the account database, index is built over it
+        super().__init__(account_database, now_timestamp, account_database, session_index, api_index)
         self.database = self.account_database
 
 
@@ -103,6 +156,8 @@ class DeleteAccount(AccountAPI):
         username = user_data['username']
         if user_data['password'] != password:
             raise APIException('The password is incorrect.')
+        self.set_session_token(username, None)
+        self.index.remove_user(username, user_data["email"])
         del self.database[username]
         return {"status": "success"}
 
@@ -162,7 +217,7 @@ class LogoutUser(AccountAPI):
         """
         # check session_token will fail if user is already logged out
         user_data = self.check_session_token(session_token)
-        user_data["session_token"] = None
+        self.set_session_token(user_data["username"], None)
         return {"status": "success"}
 
 
@@ -213,6 +268,7 @@ class QueryUser(AccountAPI):
         if username is None and email is None:
             raise APIException("You need to provide at least one of username and email.")
         if username is None:
+            matched_users = {username: self.database[username] for username in self.index.query(email)}
             return {
                 "users": [
                     {
@@ -221,8 +277,7 @@ class QueryUser(AccountAPI):
                         "phone": user_data["phone"],
                         "name": user_data["name"],
                     }
-                    for username, user_data in self.database.items()
-                    if user_data["email"] == email
+                    for username, user_data in matched_users.items()
                 ]
             }
         elif username in self.database:
@@ -308,6 +363,8 @@ class RegisterUser(AccountAPI):
             'phone': phone,
             "name": name,
         }
+        self.session_index[session_token] = username
+        self.index.add_user(username, email)
         return {
             "session_token": session_token,
             "user": {
@@ -464,6 +521,7 @@ class UpdateAccountInformation(AccountAPI):
         if new_email is not None:
             if not verify_email_format(new_email):
                 raise APIException("The email is invalid.")
+            self.index.update_email(username, self.database[username]["email"], new_email)
             self.database[username]["email"] = new_email
         if new_phone_number is not None:
             if not verify_phone_format(new_phone_number):
@@ -510,7 +568,7 @@ class UserLogin(AccountAPI):
             raise APIException('The user is already logged in.')
 
         session_token = f"{self.random.randint(0, 0xffffffff):08x}-{self.random.randint(0, 0xffff):04x}-{self.random.randint(0, 0xffff):04x}"
-        self.database[username]["session_token"] = session_token
+        self.set_session_token(username, session_token)
         return {"session_token": session_token}
 
 
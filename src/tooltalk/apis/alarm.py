@@ -2,11 +2,14 @@
 Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
-import copy
+import bisect
 from datetime import datetime
+from typing import List, Optional
 
-from .api import API, APISuite
+from .api import API, APISuite, DatabaseIndex
 from .exceptions import APIException
+from tooltalk.utils.database_utils import freeze_json
+from tooltalk.utils.timestamp_utils import TIME_FORMAT, parse_datetime
 
 
 ALARM_DB_NAME = "Alarm"
@@ -21,6 +24,112 @@ time: str
 """
 
 
+def get_seconds(alarm_time: datetime) -> int:
+    return alarm_time.hour * 3600 + alarm_time.minute * 60 + alarm_time.second
+
+
+class _UserAlarms:
+    """
+    Alarms of a single user sorted by seconds since midnight.
+    Entries are (seconds, position, alarm_id), position preserves database order of alarms.
+    """
+    __slots__ = ("seconds", "entries", "alarm_entries", "next_position")
+
+    def __init__(self) -> None:
+        self.seconds = list()
+        self.entries = list()
+        self.alarm_entries = dict()
+        self.next_position = 0
+
+    def clone(self) -> "_UserAlarms":
+        user_alarms = _UserAlarms()
+        user_alarms.seconds = self.seconds.copy()
+        user_alarms.entries = self.entries.copy()
+        user_alarms.alarm_entries = self.alarm_entries.copy()
+        user_alarms.next_position = self.next_position
+        return user_alarms
+
+    def add(self, alarm_id: str, seconds: int) -> None:
+        # overwriting an alarm keeps its position, like overwriting a dict key
+        entry = self.remove(alarm_id)
+        if entry is not None:
+            position = entry[1]
+        else:
+            position = self.next_position
+            self.next_position += 1
+        entry = (seconds, position, alarm_id)
+        index = bisect.bisect_right(self.entries, entry)
+        self.seconds.insert(index, seconds)
+        self.entries.insert(index, entry)
+        self.alarm_entries[alarm_id] = entry
+
+    def remove(self, alarm_id: str) -> Optional[tuple]:
+        entry = self.alarm_entries.pop(alarm_id, None)
+        if entry is None:
+            return None
+        index = bisect.bisect_left(self.entries, entry)
+        del self.seconds[index]
+        del self.entries[index]
+        return entry
+
+    def query(self, start_seconds: Optional[int], end_seconds: Optional[int]) -> List[str]:
+        first = 0 if start_seconds is None else bisect.bisect_left(self.seconds, start_seconds)
+        last = len(self.seconds) if end_seconds is None else bisect.bisect_right(self.seconds, end_seconds)
+        matches = sorted((position, alarm_id) for _, position, alarm_id in self.entries[first:last])
+        return [alarm_id for _, alarm_id in matches]
+
+
+class AlarmIndex(DatabaseIndex):
+    """
+    Per user sorted index over pre-parsed alarm times, used by FindAlarms.
+    Copies share per user indexes until they are modified.
+    """
+    def __init__(self, database: dict = None) -> None:
+        self.users = dict()
+        # users whose index is not shared with any copy
+        self.owned_users = set()
+        if database is not None:
+            for username, alarms in database.items():
+                user_alarms = _UserAlarms()
+                for alarm_id, alarm in alarms.items():
+                    user_alarms.add(alarm_id, get_seconds(parse_datetime(alarm["time"], TIME_FORMAT)))
+                self.users[username] = user_alarms
+                self.owned_users.add(username)
+
+    def copy(self) -> "AlarmIndex":
+        alarm_index = AlarmIndex()
+        alarm_index.users = self.users.copy()
+        # both indexes now share every user
+        self.owned_users = set()
+        return alarm_index
+
+    def _get_owned_user(self, username: str) -> _UserAlarms:
+        if username not in self.owned_users:
+            if username in self.users:
+                self.users[username] = self.users[username].clone()
+            else:
+                self.users[username] = _UserAlarms()
+            self.owned_users.add(username)
+        return self.users[username]
+
+    def add_alarm(self, username: str, alarm_id: str, alarm_time: datetime) -> None:
+        self._get_owned_user(username).add(alarm_id, get_seconds(alarm_time))
+
+    def delete_alarm(self, username: str, alarm_id: str) -> None:
+        self._get_owned_user(username).remove(alarm_id)
+
+    def query(self, username: str, start_range: datetime = None, end_range: datetime = None) -> List[str]:
+        """
+        Returns ids of alarms within the inclusive time range, in database order. Either bound may be omitted.
+        """
+        if username not in self.users:
+            return list()
+        return self.users[username].query(
+            None if start_range is None else get_seconds(start_range),
+            None if end_range is None else get_seconds(end_range),
+        )
+
+
 class AddAlarm(API):
     description = "Adds an alarm for a set time."
     parameters = {
@@ -35,8 +144,10 @@ class AddAlarm(API):
     }
 
     database_name = ALARM_DB_NAME
+    index_class = AlarmIndex
     is_action = True
     requires_auth = True
+    match_fields = ("exception",)
 
     def call(self, session_token: str, time: str) -> dict:
         """
@@ -46,16 +157,17 @@ class AddAlarm(API):
             session_token: User's session_token. Handled by ToolExecutor.
             time: The time for alarm. Format: %H:%M:%S
         """
-        datetime.strptime(time, '%H:%M:%S')
+        alarm_time = parse_datetime(time, TIME_FORMAT)
         user_info = self.check_session_token(session_token)
         username = user_info['username']
         if username not in self.database:
             self.database[username] = dict()
         alarm_id = f"{self.random.randint(0, 0xffff):04x}-{self.random.randint(0, 0xffff):04x}"
-        self.database[username][alarm_id] = {
+        self.database[username][alarm_id] = freeze_json({
             "alarm_id": alarm_id,
             "time": time,
-        }
+        })
+        self.index.add_alarm(username, alarm_id, alarm_time)
         return {"alarm_id": alarm_id}
 
     @staticmethod
@@ -89,6 +201,7 @@ class DeleteAlarm(API):
     }
 
     database_name = ALARM_DB_NAME
+    index_class = AlarmIndex
     is_action = True
     requires_auth = True
 
@@ -107,6 +220,7 @@ class DeleteAlarm(API):
         if alarm_id not in self.database[username]:
             raise APIException(f"Alarm {alarm_id} not found.")
         del self.database[username][alarm_id]
+        self.index.delete_alarm(username, alarm_id)
         return {"status": "success"}
 
 
@@ -139,8 +253,10 @@ class FindAlarms(API):
     }
 
     database_name = ALARM_DB_NAME
+    index_class = AlarmIndex
     is_action = False
     requires_auth = True
+    match_fields = ("exception",)
 
     def call(self, session_token: str, start_range: str = None, end_range: str = None) -> dict:
         """
@@ -156,20 +272,17 @@ class FindAlarms(API):
         if username not in self.database:
             return {"alarms": []}
         if start_range is not None:
-            start_range = datetime.strptime(start_range, '%H:%M:%S')
+            start_range = parse_datetime(start_range, TIME_FORMAT)
         if end_range is not None:
-            end_range = datetime.strptime(end_range, '%H:%M:%S')
+            end_range = parse_datetime(end_range, TIME_FORMAT)
         if start_range is not None and end_range is not None and start_range > end_range:
             raise APIException('Start range must be earlier than end range.')
 
-        alarms = []
-        for alarm in self.database[username].values():
-            alarm_time = datetime.strptime(alarm['time'], '%H:%M:%S')
-            if start_range is not None and alarm_time < start_range:
-                continue
-            if end_range is not None and alarm_time > end_range:
-                continue
-            alarms.append(copy.deepcopy(alarm))
+        user_alarms = self.database[username]
+        alarms = [
+            freeze_json(user_alarms[alarm_id])
+            for alarm_id in self.index.query(username, start_range, end_range)
+        ]
         return {"alarms": alarms}
 
     @staticmethod
@@ -3,13 +3,14 @@ Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
 import os
-from typing import List, Optional
+from typing import List, Optional, Tuple, Type
 from random import Random
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from datetime import datetime
 
 from .exceptions import APIException
+from tooltalk.utils.timestamp_utils import parse_datetime
 
 
 class API(ABC):
@@ -19,23 +20,44 @@ class API(ABC):
     is_action: bool
     requires_auth: bool = False
     database_name: Optional[str] = None
+    index_class: Optional[Type["DatabaseIndex"]] = None
+    # fields of calls that check_api_call_correctness requires to be equal, used to prefilter ground truths cheaply
+    match_fields: Tuple[str, ...] = ("exception", "response")
+    # parameters that check_api_call_correctness compares with semantic_str_compare
+    semantic_parameters: Tuple[str, ...] = tuple()
 
     def __init__(
             self,
             account_database: dict,
             now_timestamp: str,
-            api_database: dict = None
+            api_database: dict = None,
+            session_index: dict = None,
+            api_index: "DatabaseIndex" = None
     ) -> None:
         self.account_database = account_database
+        # session_token -> username, ToolExecutor shares one index between all tools. Tools constructed directly on
+        # the same account database must be given the same index to see each other's logins.
+        if session_index is not None:
+            self.session_index = session_index
+        else:
+            self.session_index = build_session_index(account_database)
         if api_database is not None:
             self.database = api_database
         else:
             self.database = dict()
 
+        # APIs using the same database must share index for it to stay in sync, ToolExecutor passes its own indexes
+        if api_index is not None:
+            self.index = api_index
+        elif self.index_class is not None:
+            self.index = self.index_class(self.database)
+        else:
+            self.index = None
+
         self.random = Random(489)  # TODO is seeded random enough for simulation and reproducibility?
 
         if isinstance(now_timestamp, str):
-            self.now_timestamp = datetime.strptime(now_timestamp, "%Y-%m-%d %H:%M:%S")
+            self.now_timestamp = parse_datetime(now_timestamp)
         elif isinstance(now_timestamp, datetime):
             self.now_timestamp = now_timestamp
         else:
@@ -68,6 +90,21 @@ class API(ABC):
                 return False
         return True
 
+    @classmethod
+    def get_semantic_pairs(cls, prediction: dict, ground_truth: dict) -> List[Tuple[str, str]]:
+        """
+        Returns (prediction, ground truth) text pairs check_api_call_correctness may compare semantically.
+        """
+        predict_params = prediction["request"]["parameters"]
+        ground_truth_params = ground_truth["request"]["parameters"]
+        pairs = list()
+        for key in cls.semantic_parameters:
+            predict_value = predict_params.get(key)
+            value = ground_truth_params.get(key)
+            if isinstance(predict_value, str) and isinstance(value, str):
+                pairs.append((predict_value, value))
+        return pairs
+
     @abstractmethod
     def call(self, **kwargs) -> dict:
         raise NotImplementedError
@@ -150,10 +187,66 @@ class API(ABC):
         """
         Retrieves a user from the database by session_token.
         """
-        for username, user_data in self.account_database.items():
-            if session_token == user_data['session_token']:
-                return user_data
-        raise APIException('Invalid session_token.')
+        # session index is authoritative, tokens must be set through set_session_token
+        username = self.session_index.get(session_token)
+        if username is None or username not in self.account_database:
+            raise APIException('Invalid session_token.')
+        user_data = self.account_database[username]
+        if session_token != user_data['session_token']:
+            raise APIException('Invalid session_token.')
+        return user_data
+
+    def set_session_token(self, username: str, session_token: Optional[str]) -> None:
+        """
+        Sets session_token of a user, keeping session index in sync.
+        """
+        set_session_token(self.account_database, self.session_index, username, session_token)
+
+
+def build_session_index(account_database: dict) -> dict:
+    """
+    Builds session_token -> username index of logged in users.
+    """
+    session_index = dict()
+    for username, user_data in account_database.items():
+        session_token = user_data.get("session_token")
+        if session_token is not None:
+            session_index.setdefault(session_token, username)
+    return session_index
+
+
+def set_session_token(
+        account_database: dict,
+        session_index: dict,
+        username: str,
+        session_token: Optional[str]
+) -> None:
+    """
+    Sets session_token of a user in account database and session index.
+    """
+    user_data = account_database[username]
+    old_session_token = user_data.get("session_token")
+    if old_session_token is not None and session_index.get(old_session_token) == username:
+        del session_index[old_session_token]
+    user_data["session_token"] = session_token
+    if session_token is not None:
+        session_index[session_token] = username
+
+
+class DatabaseIndex(ABC):
+    """
+    Lookup structure derived from an API database, kept in sync by the APIs that modify the database.
+    """
+    @abstractmethod
+    def __init__(self, database: dict) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def copy(self) -> "DatabaseIndex":
+        """
+        Returns an independent copy, should be cheap since it happens every time executor state is reset.
+        """
+        raise NotImplementedError
 
 
 @dataclass
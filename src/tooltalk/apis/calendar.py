@@ -2,15 +2,17 @@
 Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
-import copy
+import bisect
 import logging
 from dataclasses import dataclass, asdict
-from datetime import datetime
-from typing import List
+from datetime import datetime, timedelta
+from typing import List, Optional
 
 from .exceptions import APIException
-from .api import API, APISuite
+from .api import API, APISuite, DatabaseIndex
 from .utils import semantic_str_compare
+from tooltalk.utils.database_utils import freeze_json
+from tooltalk.utils.timestamp_utils import parse_datetime
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +45,136 @@ class _EventTypes:
 EventTypes = _EventTypes()
 
 
+def _get_duration_bucket(duration: timedelta) -> int:
+    """
+    Events are bucketed by duration in powers of two seconds, events in bucket b last less than 2 ** b seconds.
+    """
+    return int(duration.total_seconds()).bit_length()
+
+
+class _UserEvents:
+    """
+    Events of a single user bucketed by duration, each bucket sorted by the earlier of their start and end time.
+    Entries are (lo, hi, start, end, position, event_id), position preserves database order of events.
+
+    A query only looks back as far as the longest possible event of each bucket, so long events don't widen the
+    search for short ones. Events scanned without matching must end within half a bucket width before the range,
+    which bounds a query by O(b log n + k) for b buckets and k matches unless events of a bucket pile up there.
+    """
+    __slots__ = ("buckets", "event_entries", "next_position")
+
+    def __init__(self) -> None:
+        # bucket -> (los, entries) sorted by entry
+        self.buckets = dict()
+        self.event_entries = dict()
+        self.next_position = 0
+
+    def clone(self) -> "_UserEvents":
+        user_events = _UserEvents()
+        user_events.buckets = {bucket: (los.copy(), entries.copy()) for bucket, (los, entries) in self.buckets.items()}
+        user_events.event_entries = self.event_entries.copy()
+        user_events.next_position = self.next_position
+        return user_events
+
+    def add(self, event_id: str, start: datetime, end: datetime, position: int = None) -> None:
+        if position is None:
+            position = self.next_position
+        self.next_position = max(self.next_position, position + 1)
+        lo, hi = min(start, end), max(start, end)
+        entry = (lo, hi, start, end, position, event_id)
+        los, entries = self.buckets.setdefault(_get_duration_bucket(hi - lo), (list(), list()))
+        index = bisect.bisect_right(entries, entry)
+        los.insert(index, lo)
+        entries.insert(index, entry)
+        self.event_entries[event_id] = entry
+
+    def remove(self, event_id: str) -> Optional[tuple]:
+        entry = self.event_entries.pop(event_id, None)
+        if entry is None:
+            return None
+        bucket = _get_duration_bucket(entry[1] - entry[0])
+        los, entries = self.buckets[bucket]
+        index = bisect.bisect_left(entries, entry)
+        del los[index]
+        del entries[index]
+        if not entries:
+            del self.buckets[bucket]
+        return entry
+
+    def query(self, start_time: datetime, end_time: datetime) -> List[str]:
+        matches = list()
+        for bucket, (los, entries) in self.buckets.items():
+            # any event of bucket overlapping range has lo <= end_time and lo > start_time - 2 ** bucket seconds
+            lookback = timedelta(seconds=2 ** bucket)
+            first = 0 if lookback > start_time - datetime.min else bisect.bisect_left(los, start_time - lookback)
+            last = bisect.bisect_right(los, end_time)
+            for i in range(first, last):
+                _, _, event_start, event_end, position, event_id = entries[i]
+                if start_time <= event_start <= end_time or start_time <= event_end <= end_time \
+                        or (event_start <= start_time and event_end >= end_time):
+                    matches.append((position, event_id))
+        matches.sort()
+        return [event_id for _, event_id in matches]
+
+
+class CalendarIndex(DatabaseIndex):
+    """
+    Per user interval index over pre-parsed event times, used by QueryCalendar.
+    Copies share per user indexes until they are modified.
+    """
+    def __init__(self, database: dict = None) -> None:
+        self.users = dict()
+        # users whose index is not shared with any copy
+        self.owned_users = set()
+        if database is not None:
+            for username, events in database.items():
+                user_events = _UserEvents()
+                for event in events.values():
+                    user_events.add(
+                        event["event_id"],
+                        parse_datetime(event["start_time"]),
+                        parse_datetime(event["end_time"]),
+                    )
+                self.users[username] = user_events
+                self.owned_users.add(username)
+
+    def copy(self) -> "CalendarIndex":
+        calendar_index = CalendarIndex()
+        calendar_index.users = self.users.copy()
+        # both indexes now share every user
+        self.owned_users = set()
+        return calendar_index
+
+    def _get_owned_user(self, username: str) -> _UserEvents:
+        if username not in self.owned_users:
+            if username in self.users:
+                self.users[username] = self.users[username].clone()
+            else:
+                self.users[username] = _UserEvents()
+            self.owned_users.add(username)
+        return self.users[username]
+
+    def add_event(self, username: str, event_id: str, start: datetime, end: datetime) -> None:
+        self._get_owned_user(username).add(event_id, start, end)
+
+    def update_event(self, username: str, event_id: str, start: datetime, end: datetime) -> None:
+        user_events = self._get_owned_user(username)
+        entry = user_events.remove(event_id)
+        position = entry[4] if entry is not None else None
+        user_events.add(event_id, start, end, position)
+
+    def delete_event(self, username: str, event_id: str) -> None:
+        self._get_owned_user(username).remove(event_id)
+
+    def query(self, username: str, start_time: datetime, end_time: datetime) -> List[str]:
+        """
+        Returns ids of events starting or ending in the time range, in database order.
+        """
+        if username not in self.users:
+            return list()
+        return self.users[username].query(start_time, end_time)
+
+
 class CreateEvent(API):
     description = "Adds events to a user's calendar."
     parameters = {
@@ -92,8 +224,11 @@ class CreateEvent(API):
     }
 
     database_name = CALENDAR_DB_NAME
+    index_class = CalendarIndex
     is_action = True
     requires_auth = True
+    match_fields = ("exception",)
+    semantic_parameters = ("name", "description", "location")
 
     def call(
             self,
@@ -128,8 +263,8 @@ class CreateEvent(API):
         username = user_info["username"]
 
         # validate dates
-        start_datetime = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
-        end_datetime = datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S")
+        start_datetime = parse_datetime(start_time)
+        end_datetime = parse_datetime(end_time)
         if start_datetime > end_datetime:
             raise APIException("Start time must be before end time.")
         if start_datetime < self.now_timestamp or end_datetime < self.now_timestamp:
@@ -153,7 +288,8 @@ class CreateEvent(API):
         }
         if username not in self.database:
             self.database[username] = dict()
-        self.database[username][event_id] = event
+        self.database[username][event_id] = freeze_json(event)
+        self.index.add_event(username, event_id, start_datetime, end_datetime)
         return {"event_id": event["event_id"]}
 
     @staticmethod
@@ -204,6 +340,7 @@ class DeleteEvent(API):
     }
 
     database_name = CALENDAR_DB_NAME
+    index_class = CalendarIndex
     is_action = True
     requires_auth = True
 
@@ -222,6 +359,7 @@ class DeleteEvent(API):
         if event_id not in self.database[username]:
             raise APIException(f"Event {event_id} not found.")
         del self.database[username][event_id]
+        self.index.delete_event(username, event_id)
         return {"status": "success"}
 
 
@@ -270,8 +408,10 @@ class ModifyEvent(API):
     }
 
     database_name = CALENDAR_DB_NAME
+    index_class = CalendarIndex
     is_action = True
     requires_auth = True
+    semantic_parameters = ("new_name", "new_description", "new_location")
 
     def call(
             self,
@@ -303,34 +443,40 @@ class ModifyEvent(API):
             raise APIException(f"Event {event_id} not found.")
         if event_id not in self.database[username]:
             raise APIException(f"Event {event_id} not found.")
-        event = self.database[username][event_id]
-        if new_name is not None:
-            event["name"] = new_name
-        if new_start_time is not None:
-            if new_end_time is None:
-                raise APIException("new_end_time must be provided if new_start_time is provided.")
-            # validate new start and end times
-            new_start_datetime = datetime.strptime(new_start_time, '%Y-%m-%d %H:%M:%S')
-            new_end_datetime = datetime.strptime(new_end_time, "%Y-%m-%d %H:%M:%S")
-            if new_start_datetime > new_end_datetime:
-                raise APIException("Start time must be before end time.")
-            if new_start_datetime < self.now_timestamp or new_end_datetime < self.now_timestamp:
-                raise APIException("Start time and end time must be in the future.")
-
-            event["start_time"] = new_start_time
-        if new_end_time is not None:
-            if new_start_time is None:
-                raise APIException("new_start_time must be provided if new_end_time is provided.")
-            event["end_time"] = new_end_time
-        if new_description is not None:
-            event["description"] = new_description
-        if new_location is not None:
-            event["location"] = new_location
-        if new_attendees is not None:
-            if username not in new_attendees:
-                # add self, don't modify list externally
-                new_attendees = new_attendees + [username]
-            event["attendees"] = new_attendees
+        # stored events are frozen, modify a copy and store it back
+        event = dict(self.database[username][event_id])
+        try:
+            if new_name is not None:
+                event["name"] = new_name
+            if new_start_time is not None:
+                if new_end_time is None:
+                    raise APIException("new_end_time must be provided if new_start_time is provided.")
+                # validate new start and end times
+                new_start_datetime = parse_datetime(new_start_time)
+                new_end_datetime = parse_datetime(new_end_time)
+                if new_start_datetime > new_end_datetime:
+                    raise APIException("Start time must be before end time.")
+                if new_start_datetime < self.now_timestamp or new_end_datetime < self.now_timestamp:
+                    raise APIException("Start time and end time must be in the future.")
+
+                event["start_time"] = new_start_time
+            if new_end_time is not None:
+                if new_start_time is None:
+                    raise APIException("new_start_time must be provided if new_end_time is provided.")
+                event["end_time"] = new_end_time
+                self.index.update_event(username, event_id, new_start_datetime, new_end_datetime)
+            if new_description is not None:
+                event["description"] = new_description
+            if new_location is not None:
+                event["location"] = new_location
+            if new_attendees is not None:
+                if username not in new_attendees:
+                    # add self, don't modify list externally
+                    new_attendees = new_attendees + [username]
+                event["attendees"] = new_attendees
+        finally:
+            # changes made before an exception persist, as they did when events were modified in place
+            self.database[username][event_id] = freeze_json(event)
         return {"status": "success"}
 
     @staticmethod
@@ -400,8 +546,10 @@ class QueryCalendar(API):
     }
 
     database_name = CALENDAR_DB_NAME
+    index_class = CalendarIndex
     is_action = False
     requires_auth = True
+    match_fields = ("exception",)
 
     def call(self, session_token: str, start_time: str, end_time: str) -> dict:
         """
@@ -417,19 +565,16 @@ class QueryCalendar(API):
         if username not in self.database:
             raise APIException(f"User {username} has no events.")
 
-        start_time = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
-        end_time = datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S")
+        start_time = parse_datetime(start_time)
+        end_time = parse_datetime(end_time)
         if start_time > end_time:
             raise APIException("Start time must be before end time.")
 
-        events = []
-        for event in self.database[username].values():
-            # TODO would be faster if these were pre-sorted and pre-converted to datetime objects
-            event_start = datetime.strptime(event["start_time"], '%Y-%m-%d %H:%M:%S')
-            event_end = datetime.strptime(event["end_time"], '%Y-%m-%d %H:%M:%S')
-            if start_time <= event_start <= end_time or start_time <= event_end <= end_time \
-                    or (event_start <= start_time and event_end >= end_time):
-                events.append(copy.deepcopy(event))
+        user_events = self.database[username]
+        events = [
+            freeze_json(user_events[event_id])
+            for event_id in self.index.query(username, start_time, end_time)
+        ]
         return {"events": events}
 
     @staticmethod
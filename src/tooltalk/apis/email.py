@@ -2,13 +2,14 @@
 Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
-import copy
-from datetime import datetime
 from typing import List, Optional
 
 from .exceptions import APIException
 from .api import API, APISuite
+from .search_index import SearchIndex
 from .utils import semantic_str_compare, verify_email_format
+from tooltalk.utils.database_utils import freeze_json
+from tooltalk.utils.timestamp_utils import parse_datetime
 
 EMAIL_DB_NAME = "Email"
 """
@@ -25,6 +26,10 @@ emails: List[dict]
 """
 
 
+class EmailIndex(SearchIndex):
+    text_fields = ("body", "subject")
+
+
 class SearchInbox(API):
     description = "Searches for emails matching filters returning 5 most recent results."
     parameters = {
@@ -76,7 +81,9 @@ class SearchInbox(API):
     }
     is_action = False
     database_name = EMAIL_DB_NAME
+    index_class = EmailIndex
     requires_auth = True
+    match_fields = ("exception",)
 
     def call(
             self,
@@ -103,7 +110,7 @@ class SearchInbox(API):
         if username not in self.database:
             return {"emails": []}
 
-        user_emails = list(self.database[username].values())
+        user_emails = self.database[username]
         if not user_emails:
             return {"emails": []}
 
@@ -114,35 +121,25 @@ class SearchInbox(API):
             raise APIException('match_type must be either "any" or "all".')
 
         if start_date is not None:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S')
+            start_date = parse_datetime(start_date)
         if end_date is not None:
-            end_date = datetime.strptime(end_date, '%Y-%m-%d %H:%M:%S')
+            end_date = parse_datetime(end_date)
         if start_date is not None and end_date is not None and start_date > end_date:
             raise APIException('Start date must be earlier than end date.')
 
         keywords = query.lower().split() if query else None
-        matched_emails = []
-        for email in user_emails:
-            email_date = datetime.strptime(email['date'], '%Y-%m-%d %H:%M:%S')
-            if self.now_timestamp < email_date:
-                # ignore "future" emails
-                continue
-            if sender is not None and sender != email['sender']:
-                continue
-            if start_date is not None and start_date > email_date:
-                continue
-            if end_date is not None and end_date < email_date:
-                continue
-            if keywords is not None:
-                keyword_matches = [keyword in email["body"].lower() or keyword in email["subject"].lower() for keyword in keywords]
-                matches_keyword = any(keyword_matches) if match_type == "any" else all(keyword_matches)
-                if not matches_keyword:
-                    continue
-            matched_emails.append(email)
-
-        matched_emails.sort(key=lambda x: datetime.strptime(x['date'], '%Y-%m-%d %H:%M:%S'), reverse=True)
-        matched_emails = matched_emails[:5]
-        matched_emails = copy.deepcopy(matched_emails)
+        # index walks emails from newest to oldest within date range, stopping at 5 matches
+        keys = self.index.search(
+            username,
+            self.now_timestamp,
+            keywords=keywords,
+            match_type=match_type,
+            sender=sender,
+            start_date=start_date,
+            end_date=end_date,
+            limit=5
+        )
+        matched_emails = [freeze_json(user_emails[key]) for key in keys]
         return {"emails": matched_emails}
 
     @staticmethod
@@ -194,6 +191,8 @@ class SendEmail(API):
     }
     is_action = True
     requires_auth = True
+    match_fields = ("exception",)
+    semantic_parameters = ("subject", "body")
 
     def call(self, session_token: str, to: List[str], subject: str, body: str) -> dict:
         """
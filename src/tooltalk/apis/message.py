@@ -2,14 +2,15 @@
 Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
-import copy
 import re
-from datetime import datetime
 from typing import Optional
 
 from .exceptions import APIException
 from .api import API, APISuite
+from .search_index import SearchIndex
 from .utils import semantic_str_compare
+from tooltalk.utils.database_utils import freeze_json
+from tooltalk.utils.timestamp_utils import parse_datetime
 
 MESSAGE_DB_NAME = "Message"
 """
@@ -24,6 +25,11 @@ messages: List[dict]
 """
 
 
+class MessageIndex(SearchIndex):
+    text_fields = ("message",)
+    date_field = "timestamp"
+
+
 class SearchMessages(API):
     description = "Searches messages matching filters returning 5 most recent results."
     parameters = {
@@ -71,7 +77,9 @@ class SearchMessages(API):
     }
     is_action = False
     database_name = MESSAGE_DB_NAME
+    index_class = MessageIndex
     requires_auth = True
+    match_fields = ("exception",)
 
     def call(
             self,
@@ -106,36 +114,25 @@ class SearchMessages(API):
             raise APIException('match_type must be either "any" or "all".')
 
         if start_date is not None:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S')
+            start_date = parse_datetime(start_date)
         if end_date is not None:
-            end_date = datetime.strptime(end_date, '%Y-%m-%d %H:%M:%S')
+            end_date = parse_datetime(end_date)
         if start_date is not None and end_date is not None and start_date > end_date:
             raise APIException('Start date must be earlier than end date.')
 
         keywords = query.lower().split() if query else None
-        matched_messages = []
-        for message in user_messages.values():
-            message_date = datetime.strptime(message['timestamp'], '%Y-%m-%d %H:%M:%S')
-            if self.now_timestamp < message_date:
-                # ignore "future" messages
-                continue
-            if sender is not None and sender != message['sender']:
-                continue
-            if start_date is not None and start_date > message_date:
-                continue
-            if end_date is not None and end_date < message_date:
-                continue
-            # skip if doesn't match any keywords
-            if keywords is not None:
-                keyword_matches = [keyword in message['message'].lower() for keyword in keywords]
-                matches_keyword = any(keyword_matches) if match_type == "any" else all(keyword_matches)
-                if not matches_keyword:
-                    continue
-            matched_messages.append(message)
-
-        matched_messages.sort(key=lambda x: datetime.strptime(x['timestamp'], '%Y-%m-%d %H:%M:%S'), reverse=True)
-        matched_messages = matched_messages[:5]
-        matched_messages = copy.deepcopy(matched_messages)
+        # index walks messages from newest to oldest within date range, stopping at 5 matches
+        keys = self.index.search(
+            username,
+            self.now_timestamp,
+            keywords=keywords,
+            match_type=match_type,
+            sender=sender,
+            start_date=start_date,
+            end_date=end_date,
+            limit=5
+        )
+        matched_messages = [freeze_json(user_messages[key]) for key in keys]
         return {"messages": matched_messages}
 
     @staticmethod
@@ -178,6 +175,8 @@ class SendMessage(API):
     }
     is_action = True
     requires_auth = True
+    match_fields = ("exception",)
+    semantic_parameters = ("message",)
 
     def call(self, session_token: str, receiver: str, message: str) -> dict:
         """
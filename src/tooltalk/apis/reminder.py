@@ -2,13 +2,13 @@
 Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
-import copy
-from datetime import datetime
 from typing import Optional
 
 from .api import API, APISuite
 from .exceptions import APIException
 from .utils import semantic_str_compare
+from tooltalk.utils.database_utils import freeze_json
+from tooltalk.utils.timestamp_utils import parse_datetime
 
 REMINDER_DB_NAME = "Reminder"
 """
@@ -39,6 +39,8 @@ class AddReminder(API):
     is_action = True
     database_name = REMINDER_DB_NAME
     requires_auth = True
+    match_fields = ("exception",)
+    semantic_parameters = ("task",)
 
     def call(self, session_token: str, task: str, due_date: Optional[str] = None) -> dict:
         """
@@ -55,16 +57,16 @@ class AddReminder(API):
             self.database[username] = dict()
         if due_date is not None:
             try:
-                datetime.strptime(due_date, "%Y-%m-%d %H:%M:%S")
+                parse_datetime(due_date)
             except ValueError:
                 raise APIException(f"Invalid due_date: {due_date}")
         reminder_id = f"{self.random.randint(0, 0xff):02x}-{self.random.randint(0, 0xffff):04x}"
-        self.database[username][reminder_id] = {
+        self.database[username][reminder_id] = freeze_json({
             "reminder_id": reminder_id,
             "task": task,
             "due_date": due_date,
             "status": "pending"
-        }
+        })
         return {"reminder_id": reminder_id}
 
     @staticmethod
@@ -91,8 +93,8 @@ class AddReminder(API):
             predict_value = prediction["request"]["parameters"][key]
             if key == "due_date":
                 # just check if date is valid, ignore time
-                predict_date = datetime.strptime(predict_value, "%Y-%m-%d %H:%M:%S")
-                true_date = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+                predict_date = parse_datetime(predict_value)
+                true_date = parse_datetime(value)
                 if predict_date.date() != true_date.date():
                     return False
             elif key == "task":
@@ -129,9 +131,11 @@ class CompleteReminder(API):
         username = user_info["username"]
         if reminder_id not in self.database[username]:
             raise APIException(f"Reminder {reminder_id} not found in database")
-        if self.database[username][reminder_id]["status"] == "complete":
+        reminder = self.database[username][reminder_id]
+        if reminder["status"] == "complete":
             raise APIException(f"Reminder {reminder_id} already completed")
-        self.database[username][reminder_id]["status"] = "complete"
+        # stored reminders are frozen, store an updated copy
+        self.database[username][reminder_id] = freeze_json({**reminder, "status": "complete"})
         return {"status": "success"}
 
 
@@ -193,6 +197,7 @@ class GetReminders(API):
     is_action = False
     database_name = REMINDER_DB_NAME
     requires_auth = True
+    match_fields = ("exception", "request")
 
     def call(self, session_token: str) -> dict:
         """
@@ -205,8 +210,7 @@ class GetReminders(API):
         username = user_info["username"]
         if username not in self.database:
             return {"reminders": []}
-        reminders = list(self.database[username].values())
-        reminders = copy.deepcopy(reminders)
+        reminders = [freeze_json(reminder) for reminder in self.database[username].values()]
         return {"reminders": reminders}
 
     @staticmethod
@@ -0,0 +1,163 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+
+Search index shared by mailbox style APIs (SearchInbox, SearchMessages).
+"""
+import bisect
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from .api import DatabaseIndex
+from tooltalk.utils.timestamp_utils import parse_datetime
+
+NGRAM_SIZE = 3
+
+
+def get_ngrams(text: str) -> Set[str]:
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class _UserRecords:
+    """
+    Records of a single user ordered by date, with lower cased text and an n-gram inverted index over it.
+    """
+    __slots__ = ("sort_keys", "order", "dates", "senders", "texts", "postings")
+
+    def __init__(self, records: List[Tuple[str, datetime, str, Tuple[str, ...]]]) -> None:
+        # record key -> (date, -position), newest first with ties in database order when walked backwards
+        self.sort_keys = dict()
+        # record key -> sender
+        self.senders = dict()
+        # record key -> lower cased text fields
+        self.texts = dict()
+        # n-gram -> record keys containing n-gram in any text field
+        self.postings = dict()
+        for position, (key, date, sender, texts) in enumerate(records):
+            self.sort_keys[key] = (date, -position)
+            self.senders[key] = sender
+            self.texts[key] = texts
+            for text in texts:
+                for ngram in get_ngrams(text):
+                    self.postings.setdefault(ngram, set()).add(key)
+        self.order = sorted(self.sort_keys, key=self.sort_keys.__getitem__)
+        self.dates = [self.sort_keys[key][0] for key in self.order]
+
+    def keyword_candidates(self, keyword: str) -> Optional[Set[str]]:
+        """
+        Superset of records containing keyword, None if keyword is too short to be looked up.
+        """
+        if len(keyword) < NGRAM_SIZE:
+            return None
+        candidates = None
+        for ngram in sorted(get_ngrams(keyword), key=lambda ngram: len(self.postings.get(ngram, ()))):
+            postings = self.postings.get(ngram)
+            if not postings:
+                return set()
+            candidates = postings.copy() if candidates is None else candidates & postings
+            if not candidates:
+                break
+        return candidates
+
+    def search_candidates(self, keywords: List[str], match_type: str) -> Optional[Set[str]]:
+        """
+        Superset of records matching keywords, None if every record is a candidate.
+        """
+        candidates = None
+        for keyword in keywords:
+            keyword_candidates = self.keyword_candidates(keyword)
+            if match_type == "any":
+                if keyword_candidates is None:
+                    # keyword too short, every record is a candidate
+                    return None
+                candidates = keyword_candidates if candidates is None else candidates | keyword_candidates
+            elif keyword_candidates is not None:
+                candidates = keyword_candidates if candidates is None else candidates & keyword_candidates
+        return candidates
+
+    def matches(self, key: str, keywords: List[str], match_type: str) -> bool:
+        texts = self.texts[key]
+        keyword_matches = (any(keyword in text for text in texts) for keyword in keywords)
+        return any(keyword_matches) if match_type == "any" else all(keyword_matches)
+
+
+class SearchIndex(DatabaseIndex):
+    """
+    Per user index of records ordered by date, with an inverted n-gram index over their text fields.
+    Keywords match as substrings like a plain `keyword in text` check would.
+    """
+    text_fields: Tuple[str, ...] = tuple()
+    date_field: str = "date"
+    sender_field: str = "sender"
+
+    def __init__(self, database: dict = None) -> None:
+        self.users: Dict[str, _UserRecords] = dict()
+        if database is not None:
+            for username, records in database.items():
+                self.users[username] = _UserRecords([
+                    (
+                        key,
+                        parse_datetime(record[self.date_field]),
+                        record[self.sender_field],
+                        tuple(record[field].lower() for field in self.text_fields),
+                    )
+                    for key, record in records.items()
+                ])
+
+    def copy(self) -> "SearchIndex":
+        # records are never modified by APIs, so index can be shared
+        return self
+
+    def search(
+            self,
+            username: str,
+            now_timestamp: datetime,
+            keywords: Optional[List[str]] = None,
+            match_type: str = "any",
+            sender: Optional[str] = None,
+            start_date: Optional[datetime] = None,
+            end_date: Optional[datetime] = None,
+            limit: int = 5,
+    ) -> List[str]:
+        """
+        Returns keys of the most recent records matching all filters, newest first and ties in database order.
+        Records dated after now_timestamp are ignored.
+        """
+        if username not in self.users:
+            return list()
+        user_records = self.users[username]
+
+        # bound date range by bisection
+        latest = now_timestamp if end_date is None else min(now_timestamp, end_date)
+        first = 0 if start_date is None else bisect.bisect_left(user_records.dates, start_date)
+        last = bisect.bisect_right(user_records.dates, latest)
+        if first >= last:
+            return list()
+
+        candidates = None
+        if keywords is not None:
+            candidates = user_records.search_candidates(keywords, match_type)
+        if candidates is not None and len(candidates) < last - first:
+            # fewer keyword candidates than records in range, only order candidates
+            sort_keys = user_records.sort_keys
+            earliest = user_records.dates[first]
+            keys = sorted(
+                (key for key in candidates if earliest <= sort_keys[key][0] <= latest),
+                key=sort_keys.__getitem__,
+                reverse=True
+            )
+        else:
+            keys = (user_records.order[i] for i in range(last - 1, first - 1, -1))
+
+        results = list()
+        for key in keys:
+            if candidates is not None and key not in candidates:
+                continue
+            if sender is not None and sender != user_records.senders[key]:
+                continue
+            if keywords is not None and not user_records.matches(key, keywords, match_type):
+                continue
+            results.append(key)
+            if len(results) >= limit:
+                break
+        return results
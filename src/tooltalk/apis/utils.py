@@ -3,11 +3,20 @@ Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
 import re
-from functools import lru_cache
-from typing import Optional
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple, Type
 
-import numpy as np
-from sent2vec.vectorizer import Vectorizer
+# numpy, sent2vec (transformers, torch) and the embedding cache are imported on first semantic comparison,
+# so importing APIs for their schemas or ToolExecutor stays cheap
+if TYPE_CHECKING:
+    import numpy as np
+    from sent2vec.vectorizer import Vectorizer
+
+    from tooltalk.utils.cache_utils import EmbeddingCache
+
+MODEL_NAME = "distilbert-base-uncased"
 
 
 def verify_phone_format(phone_number: str) -> bool:
@@ -20,39 +29,371 @@ def verify_email_format(email: str) -> bool:
     return match is not None
 
 
-# lru cache should help when running a bunch of comparisons against the same sentence
-class _TextVectorizer:
+class SimilarityBackend(ABC):
+    """
+    Embeds texts for semantic_str_compare. Cosine similarities of embeddings are calibrated onto the scale of the
+    default sent2vec backend, so thresholds in check_api_call_correctness apply to every backend.
+    """
+    @abstractmethod
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        """
+        Embeds texts into a matrix with one row per text.
+        """
+        raise NotImplementedError
+
+    def calibrate(self, scores: "np.ndarray") -> "np.ndarray":
+        return scores
+
+    def __call__(self, text: str) -> "np.ndarray":
+        return self.embed([text])[0]
+
+
+class _TextVectorizer(SimilarityBackend):
+    """
+    Mocks sent2vec vectorizer API into a function, caching vectors of recently embedded texts.
+    Vectors can also be persisted in an EmbeddingCache, the model is only loaded once a text misses both caches.
+    """
+    def __init__(self, batch_size: int = 64, cache_size: int = 4096, embedding_cache: "EmbeddingCache" = None):
+        self.vectorizer = None
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.embedding_cache = embedding_cache
+
+    def load_model(self) -> "Vectorizer":
+        if self.vectorizer is None:
+            from sent2vec.vectorizer import Vectorizer
+            self.vectorizer = Vectorizer(pretrained_weights=MODEL_NAME)
+        return self.vectorizer
+
+    def get_batches(self, texts: List[str]) -> List[List[str]]:
+        """
+        Splits texts into batches. Bert inputs are padded without an attention mask, which changes their vectors, so
+        texts are grouped by token count and batches never need padding.
+        """
+        tokenizer = getattr(self.load_model().vectorizer, "tokenizer", None)
+        groups = dict()
+        for text in texts:
+            length = 0
+            if tokenizer is not None and isinstance(text, str):
+                length = len(tokenizer.encode(text, add_special_tokens=True))
+            groups.setdefault(length, list()).append(text)
+        return [
+            group[i:i + self.batch_size]
+            for group in groups.values()
+            for i in range(0, len(group), self.batch_size)
+        ]
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        """
+        Embeds texts into a matrix with one row per text, only texts missing from the caches are run through the model.
+        """
+        import numpy as np
+
+        missing = [text for text in dict.fromkeys(texts) if text not in self.cache]
+        vectors = {text: self.cache[text] for text in texts if text in self.cache}
+        if missing and self.embedding_cache is not None:
+            vectors.update(self.embedding_cache.get_many(text for text in missing if isinstance(text, str)))
+            missing = [text for text in missing if text not in vectors]
+        if missing:
+            computed = dict()
+            for batch in self.get_batches(missing):
+                self.vectorizer.run(batch)
+                computed.update(zip(batch, self.vectorizer.vectors))
+                self.vectorizer.vectors = list()  # don't care, please clear
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many(computed)
+            vectors.update(computed)
+        for text, vector in vectors.items():
+            self.cache[text] = vector
+            self.cache.move_to_end(text)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return np.stack([vectors[text] for text in texts])
+
+
+# cosine similarities of hashed n-gram vectors matching sent2vec similarities used as thresholds by APIs.
+# UNCALIBRATED: these were picked by hand on a few pairs, their agreement with sent2vec has not been measured. To
+# calibrate them, run src/scripts/calibrate_ngram_thresholds.py on the datasets and outputs of evaluated runs with
+# --scores_path tests/data/sent2vec_pair_scores.jsonl, which needs the sent2vec model. Commit the printed thresholds
+# here with their agreement rates, along with the scores file, which test_ngram_thresholds_are_calibrated checks.
+NGRAM_THRESHOLDS = {0.8: 0.5, 0.9: 0.7}
+
+
+class _NgramVectorizer(SimilarityBackend):
+    """
+    Fast local backend without a model, embeds lower cased texts as counts of hashed character n-grams.
+    Much cheaper than sent2vec but only measures surface similarity.
+    """
+    def __init__(self, ngram_size: int = 3, dimensions: int = 4096, thresholds: Dict[float, float] = None):
+        self.ngram_size = ngram_size
+        self.dimensions = dimensions
+        thresholds = thresholds if thresholds is not None else NGRAM_THRESHOLDS
+        # piecewise linear map from n-gram similarity onto sent2vec similarity
+        self.raw_points = [0.0] + [thresholds[key] for key in sorted(thresholds)] + [1.0]
+        self.calibrated_points = [0.0] + sorted(thresholds) + [1.0]
+
+    def embed(self, texts: List[str]) -> "np.ndarray":
+        import numpy as np
+
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            if not isinstance(text, str):
+                raise TypeError(f"All items must be string type but {text} is type {type(text)}.")
+            padded = f" {text.lower()} "
+            ngrams = [padded[i:i + self.ngram_size] for i in range(len(padded) - self.ngram_size + 1)] or [padded]
+            # crc32 is stable across processes unlike hash()
+            columns = [zlib.crc32(ngram.encode("utf-8")) % self.dimensions for ngram in ngrams]
+            np.add.at(vectors[row], columns, 1)
+        return vectors
+
+    def calibrate(self, scores: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+
+        return np.interp(scores, self.raw_points, self.calibrated_points)
+
+
+SIMILARITY_BACKENDS: Dict[str, Type[SimilarityBackend]] = {
+    "sent2vec": _TextVectorizer,
+    "ngram": _NgramVectorizer,
+}
+
+
+class ScoreCache:
     """
-    Mocks sent2vec vectorizer API into a function.
+    Bounded LRU cache of similarity scores keyed by unordered text pairs, counting lookups for hit rate stats.
     """
-    def __init__(self):
-        self.vectorizer = Vectorizer()
+    def __init__(self, max_size: int = 65536) -> None:
+        self.max_size = max_size
+        self.scores = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.shortcuts = 0
+
+    @staticmethod
+    def get_key(text_a: str, text_b: str) -> Tuple[str, str]:
+        # cosine similarity is symmetric, callers pass texts in either order
+        if isinstance(text_a, str) and isinstance(text_b, str) and text_b < text_a:
+            return text_b, text_a
+        return text_a, text_b
+
+    def __contains__(self, pair: Tuple[str, str]) -> bool:
+        return self.get_key(*pair) in self.scores
 
-    @lru_cache()
-    def __call__(self, text: str) -> np.ndarray:
-        self.vectorizer.run([text])
-        return_vec = self.vectorizer.vectors[0]
-        self.vectorizer.vectors = list()  # don't care, please clear
-        return return_vec
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def get(self, text_a: str, text_b: str) -> Optional[float]:
+        key = self.get_key(text_a, text_b)
+        score = self.scores.get(key)
+        if score is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.scores.move_to_end(key)
+        return score
+
+    def put(self, text_a: str, text_b: str, score: float) -> None:
+        key = self.get_key(text_a, text_b)
+        self.scores[key] = score
+        self.scores.move_to_end(key)
+        while len(self.scores) > self.max_size:
+            self.scores.popitem(last=False)
+
+    def clear(self) -> None:
+        self.scores.clear()
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.scores),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shortcuts": self.shortcuts,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
 
 
 # TODO this is a hacky way to do this, but it works for now
-_vectorize_text: callable = None
+_vectorize_text: Optional[SimilarityBackend] = None
+_similarity_backend: str = "sent2vec"
+_embedding_cache: Optional["EmbeddingCache"] = None
+# filled in batches by precompute_semantic_scores
+_semantic_scores = ScoreCache()
+
+
+def load_vectorizer() -> SimilarityBackend:
+    """
+    Loads backend used by semantic_str_compare once per process.
+    """
+    global _vectorize_text
+    if _vectorize_text is None:
+        if _similarity_backend == "sent2vec":
+            _vectorize_text = _TextVectorizer(embedding_cache=_embedding_cache)
+        else:
+            _vectorize_text = SIMILARITY_BACKENDS[_similarity_backend]()
+    return _vectorize_text
+
+
+def set_similarity_backend(name: str) -> None:
+    """
+    Selects backend of semantic_str_compare by name from SIMILARITY_BACKENDS.
+    """
+    global _vectorize_text, _similarity_backend
+    if name not in SIMILARITY_BACKENDS:
+        raise ValueError(f"Unknown similarity backend {name}, choose from {list(SIMILARITY_BACKENDS)}")
+    if name != _similarity_backend:
+        _similarity_backend = name
+        _vectorize_text = None
+        # scores of previous backend are not comparable
+        _semantic_scores.clear()
+
+
+def set_embedding_cache(path: Optional[str], max_entries: int = 1_000_000) -> None:
+    """
+    Persists vectors used by semantic_str_compare in a SQLite file at path, shared between runs and processes.
+    None disables the on-disk cache.
+    """
+    global _embedding_cache
+    if path is None:
+        _embedding_cache = None
+    else:
+        from tooltalk.utils.cache_utils import EmbeddingCache
+        _embedding_cache = EmbeddingCache(path, f"sent2vec/{MODEL_NAME}", max_entries)
+    if isinstance(_vectorize_text, _TextVectorizer):
+        _vectorize_text.embedding_cache = _embedding_cache
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _get_shortcut_score(prediction_text: str, ground_truth_text: str) -> Optional[float]:
+    """
+    Scores texts equal up to case and whitespace without embedding them. Bert tokens of such texts are the same
+    with uncased models, so their cosine similarity is 1 anyway.
+    """
+    if not isinstance(prediction_text, str) or not isinstance(ground_truth_text, str):
+        return None
+    if prediction_text == ground_truth_text or normalize_text(prediction_text) == normalize_text(ground_truth_text):
+        return 1.0
+    return None
+
+
+def get_semantic_cache_stats() -> dict:
+    """
+    Returns size and hit rate of scores cached by semantic_str_compare in this process.
+    """
+    return _semantic_scores.get_stats()
+
+
+def get_similarity_scores(
+        backend: SimilarityBackend,
+        pairs: List[Tuple[str, str]],
+        calibrate: bool = True
+) -> "np.ndarray":
+    """
+    Computes cosine similarities of all pairs at once, embedding every unique text once.
+    """
+    import numpy as np
+
+    texts = list(dict.fromkeys(text for pair in pairs for text in pair))
+    text_indexes = {text: i for i, text in enumerate(texts)}
+    vectors = backend.embed(texts)
+    norms = np.linalg.norm(vectors, axis=1)
+    left = np.array([text_indexes[prediction_text] for prediction_text, _ in pairs], dtype=int)
+    right = np.array([text_indexes[ground_truth_text] for _, ground_truth_text in pairs], dtype=int)
+    scores = np.einsum("ij,ij->i", vectors[left], vectors[right]) / (norms[left] * norms[right])
+    return backend.calibrate(scores) if calibrate else scores
+
+
+def precompute_semantic_scores(pairs: Iterable[Tuple[str, str]]) -> None:
+    """
+    Scores (prediction_text, ground_truth_text) pairs for semantic_str_compare, embedding all unique texts in batches
+    and computing cosine similarities of all pairs at once.
+    """
+    pairs = [
+        pair for pair in dict.fromkeys(ScoreCache.get_key(*pair) for pair in pairs)
+        if pair not in _semantic_scores and _get_shortcut_score(*pair) is None
+    ]
+    if not pairs:
+        return
+    scores = get_similarity_scores(load_vectorizer(), pairs)
+    for (prediction_text, ground_truth_text), score in zip(pairs, scores):
+        _semantic_scores.put(prediction_text, ground_truth_text, score)
+
+
+def calibrate_ngram_thresholds(
+        pairs: List[Tuple[str, str]],
+        reference_scores: Iterable[float],
+        thresholds: Iterable[float] = tuple(NGRAM_THRESHOLDS),
+        backend: "_NgramVectorizer" = None
+) -> Dict[float, float]:
+    """
+    Derives NGRAM_THRESHOLDS from text pairs and their similarities under the reference backend, usually sent2vec.
+    Each n-gram cutoff lies halfway between the two n-gram scores that split the pairs so that most of them are
+    accepted or rejected like by the reference threshold.
+    """
+    import numpy as np
+
+    backend = backend if backend is not None else _NgramVectorizer()
+    raw_scores = get_similarity_scores(backend, pairs, calibrate=False)
+    order = np.argsort(raw_scores, kind="stable")
+    raw_scores = raw_scores[order]
+    reference_scores = np.asarray(list(reference_scores), dtype=float)[order]
+    # cut k rejects raw_scores[:k] and accepts the rest, pairs with equal n-gram scores can't be split
+    bounds = np.concatenate([[0.0], raw_scores, [1.0]])
+    cuts = [k for k in range(len(raw_scores) + 1) if k in (0, len(raw_scores)) or raw_scores[k - 1] < raw_scores[k]]
+
+    ngram_thresholds = dict()
+    for threshold in sorted(thresholds):
+        accepted = reference_scores >= threshold
+        agreements = (
+            np.concatenate([[0], np.cumsum(~accepted)])
+            + np.concatenate([np.cumsum(accepted[::-1])[::-1], [0]])
+        )
+        # higher thresholds never cut below lower ones, so the map onto the reference scale stays monotonic
+        cut = max(cuts, key=lambda k: agreements[k])
+        cuts = [k for k in cuts if k >= cut]
+        ngram_thresholds[threshold] = float((bounds[cut] + bounds[cut + 1]) / 2)
+    return ngram_thresholds
+
+
+def get_threshold_agreement(
+        pairs: List[Tuple[str, str]],
+        reference_scores: Iterable[float],
+        backend: SimilarityBackend,
+        thresholds: Iterable[float] = tuple(NGRAM_THRESHOLDS)
+) -> Dict[float, float]:
+    """
+    Returns the fraction of pairs backend accepts or rejects like the reference backend, for each threshold.
+    """
+    import numpy as np
+
+    scores = get_similarity_scores(backend, pairs)
+    reference_scores = np.asarray(list(reference_scores), dtype=float)
+    return {
+        threshold: float(np.mean((scores >= threshold) == (reference_scores >= threshold)))
+        for threshold in thresholds
+    }
 
 
 def semantic_str_compare(prediction_text: Optional[str], ground_truth_text: str) -> float:
     """
-    Compares two strings semantically.
+    Compares two strings semantically, see set_similarity_backend.
     """
     if prediction_text is None:
         return 0.0
 
-    global _vectorize_text
-    if _vectorize_text is None:
-        # initialize vectorizer only when needed
-        _vectorize_text = _TextVectorizer()
+    score = _get_shortcut_score(prediction_text, ground_truth_text)
+    if score is not None:
+        _semantic_scores.shortcuts += 1
+        return score
 
-    prediction_vec = _vectorize_text(prediction_text)
-    ground_truth_vec = _vectorize_text(ground_truth_text)
-    cosine_similarity = np.dot(prediction_vec, ground_truth_vec) / (np.linalg.norm(prediction_vec) * np.linalg.norm(ground_truth_vec))
-    return cosine_similarity
+    score = _semantic_scores.get(prediction_text, ground_truth_text)
+    if score is None:
+        # evicted or never precomputed
+        precompute_semantic_scores([(prediction_text, ground_truth_text)])
+        score = _semantic_scores.scores[ScoreCache.get_key(prediction_text, ground_truth_text)]
+    return score
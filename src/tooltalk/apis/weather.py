@@ -3,10 +3,12 @@ Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
 from abc import ABC
-from datetime import datetime, timedelta
+from datetime import date, timedelta
 
 from .exceptions import APIException
-from .api import API, APISuite
+from .api import API, APISuite, DatabaseIndex
+from tooltalk.utils.database_utils import freeze_json
+from tooltalk.utils.timestamp_utils import DATE_FORMAT, parse_datetime
 
 
 WEATHER_DB_NAME = "Weather"
@@ -31,26 +33,55 @@ months: list of historic weather by month
 """
 
 
+class _LocationWeather:
+    """
+    Weather of a single location indexed by day offset from its earliest date.
+    """
+    __slots__ = ("first_ordinal", "days")
+
+    def __init__(self, weather: dict) -> None:
+        dates = {parse_datetime(date, DATE_FORMAT).date(): value for date, value in weather.items()}
+        ordinals = [day.toordinal() for day in dates]
+        self.first_ordinal = min(ordinals, default=0)
+        self.days = [None] * (max(ordinals, default=-1) - self.first_ordinal + 1)
+        for day, value in dates.items():
+            self.days[day.toordinal() - self.first_ordinal] = freeze_json(value)
+
+    def __getitem__(self, day: date) -> dict:
+        offset = day.toordinal() - self.first_ordinal
+        if 0 <= offset < len(self.days) and self.days[offset] is not None:
+            return self.days[offset]
+        raise KeyError(day)
+
+
+class WeatherIndex(DatabaseIndex):
+    """
+    Weather decoded once into per location arrays indexed by day, records are frozen.
+    """
+    def __init__(self, database: dict) -> None:
+        self.locations = {location: _LocationWeather(weather) for location, weather in database.items()}
+
+    def copy(self) -> "WeatherIndex":
+        # weather is never modified by APIs, so index can be shared
+        return self
+
+
+class HistoricWeatherIndex(DatabaseIndex):
+    """
+    Historic weather by location and month, records are frozen.
+    """
+    def __init__(self, database: dict) -> None:
+        self.locations = freeze_json(database)
+
+    def copy(self) -> "HistoricWeatherIndex":
+        # historic weather is never modified by APIs, so index can be shared
+        return self
+
+
 class WeatherAPI(API, ABC):
     database_name = WEATHER_DB_NAME
-
-    def __init__(
-            self,
-            account_database: dict,
-            now_timestamp: str,
-            api_database: dict = None
-    ) -> None:
-        super().__init__(account_database, now_timestamp, api_database)
-        # retrieval APIs so modifying dates is fine
-        new_database = dict()
-        for location, weather in self.database.items():
-            weather = {
-                datetime.strptime(date, "%Y-%m-%d").date(): value
-                for date, value in weather.items()
-            }
-            # sort from oldest to newest
-            new_database[location] = weather
-        self.database = new_database
+    # retrieval APIs, so all instances serve from the same decoded weather
+    index_class = WeatherIndex
 
 
 class CurrentWeather(WeatherAPI):
@@ -86,9 +117,9 @@ class CurrentWeather(WeatherAPI):
         """
         # find occurrence of date in database
         location = location.lower().strip()
-        if location not in self.database:
+        if location not in self.index.locations:
             raise APIException(f"Location {location} not found in database")
-        location_weather = self.database[location]
+        location_weather = self.index.locations[location]
         now_date = self.now_timestamp.date()
         location_weather = location_weather[now_date]
         return {"weather": location_weather}
@@ -130,9 +161,9 @@ class ForecastWeather(WeatherAPI):
         """
         # find occurrence of date in database
         location = location.lower().strip()
-        if location not in self.database:
+        if location not in self.index.locations:
             raise APIException(f"Location {location} not found in database")
-        location_weather = self.database[location]
+        location_weather = self.index.locations[location]
         now_date = self.now_timestamp.date()
         forecast = list()
         for i in range(3):
@@ -170,6 +201,7 @@ class HistoricWeather(API):
     }
     is_action = False
     database_name = "HistoricWeather"
+    index_class = HistoricWeatherIndex
 
     def call(self, location: str, month: str) -> dict:
         """
@@ -180,13 +212,13 @@ class HistoricWeather(API):
             month: The month to get weather of as a full name.
         """
         location = location.lower().strip()
-        if location not in self.database:
+        if location not in self.index.locations:
             raise APIException(f"Location {location} not found in database")
 
         month = month.lower()
-        if month not in self.database[location]:
+        if month not in self.index.locations[location]:
             raise APIException(f"Historic weather data for {location} missing for month {month}")
-        return {"weather": self.database[location][month]}
+        return {"weather": self.index.locations[location][month]}
 
 
 class WeatherSuite(APISuite):
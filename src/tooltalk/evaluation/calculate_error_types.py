@@ -7,7 +7,7 @@ import logging
 import argparse
 from collections import Counter
 
-from tooltalk.utils.file_utils import get_names_and_paths
+from tooltalk.utils.file_utils import iter_conversations
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,7 +15,7 @@ logger = logging.getLogger(__name__)
 
 def get_arg_parser():
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument("--dataset", type=str, help="Path to input file")
+    parser.add_argument("--dataset", type=str, help="Path to evaluated conversations, JSON files or JSONL shards")
     parser.add_argument("--metrics", type=str, help="Path to metrics file")
     return parser
 
@@ -30,10 +30,7 @@ def main():
     over_trigger_count = 0
     bad_planning_count = 0
     bad_call_count = 0
-    for _, path in get_names_and_paths(args.dataset):
-        with open(path, "r", encoding='utf-8') as reader:
-            conversation = json.load(reader)
-
+    for _, conversation in iter_conversations(args.dataset):
         if conversation["metrics"]["success"]:
             continue
 
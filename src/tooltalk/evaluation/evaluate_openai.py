@@ -6,19 +6,27 @@ Evaluate Tool LLM on API-Talk dataset.
 """
 import os
 import json
+import asyncio
 import logging
 import argparse
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor
 from enum import Enum
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from collections import Counter
 
 import openai
 from tqdm import tqdm
 
 from tooltalk.apis import APIS_BY_NAME, ALL_APIS, SUITES_BY_NAME
-from tooltalk.evaluation.tool_executor import ToolExecutor, BaseAPIPredictor
-from tooltalk.utils.file_utils import get_names_and_paths
-from tooltalk.utils.openai_utils import openai_chat_completion
+from tooltalk.apis.utils import (
+    SIMILARITY_BACKENDS, get_semantic_cache_stats, load_vectorizer, set_embedding_cache, set_similarity_backend
+)
+from tooltalk.evaluation.tool_executor import ToolExecutor, BaseAPIPredictor, AsyncBaseAPIPredictor
+from tooltalk.utils.file_utils import JSONL_OPENERS, ShardedJsonlWriter, iter_chunks, iter_conversations
+from tooltalk.utils.manifest_utils import RunManifest
+from tooltalk.utils.openai_utils import openai_chat_completion, openai_chat_completion_async
+from tooltalk.utils.store_utils import ContentStore, ResponseCache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,7 +42,10 @@ class OpenAIPredictor(BaseAPIPredictor):
         self.model = model
         self.api_docs = [api.to_openai_doc(disable_docs) for api in apis_used]
 
-    def predict(self, metadata: dict, conversation_history: dict) -> dict:
+    def get_openai_request(self, metadata: dict, conversation_history: dict) -> dict:
+        """
+        Converts conversation history into chat completion arguments.
+        """
         system_prompt = self.system_prompt.format(
             location=metadata["location"],
             timestamp=metadata["timestamp"],
@@ -70,19 +81,21 @@ class OpenAIPredictor(BaseAPIPredictor):
                     "content": json.dumps(response_content)
                 })
 
-        openai_response = openai_chat_completion(
-            model=self.model,
-            messages=openai_history,
-            functions=self.api_docs,
-        )
+        return {
+            "model": self.model,
+            "messages": openai_history,
+            "functions": self.api_docs,
+        }
+
+    @staticmethod
+    def parse_openai_response(openai_request: dict, openai_response: dict) -> dict:
+        """
+        Converts chat completion response into a prediction.
+        """
         logger.debug(f"OpenAI full response: {openai_response}")
         openai_message = openai_response["choices"][0]["message"]
         metadata = {
-            "openai_request": {
-                "model": self.model,
-                "messages": openai_history,
-                "functions": self.api_docs,
-            },
+            "openai_request": openai_request,
             "openai_response": openai_response
         }
         if "function_call" in openai_message:
@@ -111,6 +124,109 @@ class OpenAIPredictor(BaseAPIPredictor):
                 "metadata": metadata,
             }
 
+    def predict(self, metadata: dict, conversation_history: dict) -> dict:
+        openai_request = self.get_openai_request(metadata, conversation_history)
+        openai_response = openai_chat_completion(**openai_request)
+        return self.parse_openai_response(openai_request, openai_response)
+
+    @staticmethod
+    def compact_metadata(metadata: dict, store: ContentStore) -> dict:
+        """
+        Replaces messages and functions of the request in metadata with keys into store. Functions are the same for
+        most requests and messages of consecutive requests share their prefix, so each is only stored once.
+        """
+        openai_request = metadata.get("openai_request")
+        if openai_request is None or "messages" not in openai_request:
+            return metadata
+        compact_request = {key: value for key, value in openai_request.items() if key not in {"messages", "functions"}}
+        compact_request["messages_key"] = store.put_list(openai_request["messages"])
+        compact_request["functions_key"] = store.put(openai_request["functions"])
+        return {**metadata, "openai_request": compact_request}
+
+    @staticmethod
+    def expand_metadata(metadata: dict, store: ContentStore) -> dict:
+        """
+        Inverse of compact_metadata, metadata that isn't compact is returned as is.
+        """
+        compact_request = metadata.get("openai_request")
+        if compact_request is None or "messages_key" not in compact_request:
+            return metadata
+        openai_request = {
+            key: value for key, value in compact_request.items() if key not in {"messages_key", "functions_key"}
+        }
+        openai_request["messages"] = store.get_list(compact_request["messages_key"])
+        openai_request["functions"] = store.get(compact_request["functions_key"])
+        return {**metadata, "openai_request": openai_request}
+
+
+class AsyncOpenAIPredictor(AsyncBaseAPIPredictor):
+    """
+    Same as OpenAIPredictor, but awaits chat completions so many requests can be in flight at once.
+    """
+    def __init__(self, model, apis_used, disable_docs=False):
+        self.predictor = OpenAIPredictor(model, apis_used, disable_docs)
+
+    async def predict(self, metadata: dict, conversation_history: dict) -> dict:
+        openai_request = self.predictor.get_openai_request(metadata, conversation_history)
+        openai_response = await openai_chat_completion_async(**openai_request)
+        return self.predictor.parse_openai_response(openai_request, openai_response)
+
+
+class CacheModes(str, Enum):
+    RECORD = "record"
+    REPLAY = "replay"
+    RECORD_MISSING = "record_missing"
+
+
+def get_recorded_response(cache: ResponseCache, mode: CacheModes, openai_request: dict) -> Optional[dict]:
+    """
+    Returns response recorded for request, None if the model has to be called. Replay never calls the model.
+    """
+    if mode == CacheModes.RECORD:
+        return None
+    openai_response = cache.get(openai_request)
+    if openai_response is None and mode == CacheModes.REPLAY:
+        raise KeyError(f"No response recorded for request {ResponseCache.get_key(openai_request)}")
+    return openai_response
+
+
+class CachedOpenAIPredictor(BaseAPIPredictor):
+    """
+    Wraps OpenAIPredictor with responses recorded in a ResponseCache, keyed by chat completion arguments.
+    Record calls the model and records every response, replay only uses recorded responses and record_missing calls
+    the model for requests without a recorded response.
+    """
+    def __init__(self, predictor: OpenAIPredictor, cache: ResponseCache, mode: CacheModes = CacheModes.RECORD_MISSING):
+        self.predictor = predictor
+        self.cache = cache
+        self.mode = mode
+
+    def predict(self, metadata: dict, conversation_history: dict) -> dict:
+        openai_request = self.predictor.get_openai_request(metadata, conversation_history)
+        openai_response = get_recorded_response(self.cache, self.mode, openai_request)
+        if openai_response is None:
+            openai_response = openai_chat_completion(**openai_request)
+            self.cache.put(openai_request, openai_response)
+        return self.predictor.parse_openai_response(openai_request, openai_response)
+
+
+class AsyncCachedOpenAIPredictor(AsyncBaseAPIPredictor):
+    """
+    Same as CachedOpenAIPredictor, but awaits chat completions of requests without a recorded response.
+    """
+    def __init__(self, predictor: OpenAIPredictor, cache: ResponseCache, mode: CacheModes = CacheModes.RECORD_MISSING):
+        self.predictor = predictor
+        self.cache = cache
+        self.mode = mode
+
+    async def predict(self, metadata: dict, conversation_history: dict) -> dict:
+        openai_request = self.predictor.get_openai_request(metadata, conversation_history)
+        openai_response = get_recorded_response(self.cache, self.mode, openai_request)
+        if openai_response is None:
+            openai_response = await openai_chat_completion_async(**openai_request)
+            self.cache.put(openai_request, openai_response)
+        return self.predictor.parse_openai_response(openai_request, openai_response)
+
 
 class EvalModes(str, Enum):
     PREDICT = "predict"
@@ -130,81 +246,383 @@ def get_arg_parser():
     parser.add_argument("--reset", action="store_true", help="reset evaluation writing over any cached results")
     parser.add_argument("--disable_documentation", action="store_true",
                         help="disabled documentation sent to GPT-4 replacing with empty strings")
+    parser.add_argument("--turn_workers", type=int, default=1,
+                        help="Number of turns in a conversation to predict concurrently")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes to evaluate conversations with")
+    parser.add_argument("--async_concurrency", type=int, default=0,
+                        help="Number of conversations in flight under one asyncio event loop, 0 disables async")
+    parser.add_argument("--embedding_cache", type=str, default=None,
+                        help="Path to SQLite file persisting text embeddings used in evaluation across runs")
+    parser.add_argument("--similarity_backend", choices=list(SIMILARITY_BACKENDS), default="sent2vec",
+                        help="Backend for semantic comparisons, ngram is much faster but less faithful than sent2vec")
+    parser.add_argument("--output_format", choices=["json"] + [suffix[1:] for suffix in JSONL_OPENERS],
+                        default="json", help="One JSON file per conversation or JSONL shards, optionally compressed")
+    parser.add_argument("--shard_size", type=int, default=1000,
+                        help="Number of conversations per JSONL shard")
+    parser.add_argument("--inline_metadata", action="store_true",
+                        help="Write full OpenAI requests into outputs instead of keys into the metadata store")
+    parser.add_argument("--response_cache", type=str, default=None,
+                        help="Path to SQLite file of recorded chat completions, see --cache_mode")
+    parser.add_argument("--cache_mode", choices=list(CacheModes), type=str, default=CacheModes.RECORD_MISSING,
+                        help="Record every response, only replay recorded ones or record missing ones")
     parser.add_argument("--modes", choices=list(EvalModes), type=str, nargs='+', default=list(EvalModes),
                         help="Evaluation modes")
 
     return parser
 
 
+# conversations read from dataset at once, bounds memory when streaming large datasets
+TASK_CHUNK_SIZE = 1000
+
+# each worker process keeps its own tool executor between conversations
+_worker_tool_executor: Optional[ToolExecutor] = None
+
+# prediction metadata of outputs is kept next to them, see OpenAIPredictor.compact_metadata
+METADATA_STORE_FILE_NAME = ".metadata.sqlite"
+# output_dir -> store, per process
+_metadata_stores: Dict[str, ContentStore] = dict()
+
+
+def get_metadata_store(output_dir: str) -> ContentStore:
+    if output_dir not in _metadata_stores:
+        _metadata_stores[output_dir] = ContentStore(os.path.join(output_dir, METADATA_STORE_FILE_NAME))
+    return _metadata_stores[output_dir]
+
+
+# path -> recorded responses, per process
+_response_caches: Dict[str, ResponseCache] = dict()
+
+
+def get_response_cache(path: str) -> ResponseCache:
+    if path not in _response_caches:
+        _response_caches[path] = ResponseCache(path)
+    return _response_caches[path]
+
+
+def map_prediction_metadata(conversation: dict, func: callable) -> dict:
+    """
+    Replaces metadata of every prediction in conversation with func(metadata), in place.
+    """
+    for turn in conversation["conversation"]:
+        for prediction in turn.get("predictions", list()):
+            if prediction.get("metadata") is not None:
+                prediction["metadata"] = func(prediction["metadata"])
+    return conversation
+
+
+def compact_conversation_metadata(conversation: dict, store: ContentStore) -> dict:
+    conversation = map_prediction_metadata(
+        conversation, lambda metadata: OpenAIPredictor.compact_metadata(metadata, store)
+    )
+    # outputs must only reference stored metadata
+    store.flush()
+    return conversation
+
+
+def expand_conversation_metadata(conversation: dict, store: ContentStore) -> dict:
+    """
+    Restores full OpenAI requests in an output written with compact metadata.
+    """
+    return map_prediction_metadata(conversation, lambda metadata: OpenAIPredictor.expand_metadata(metadata, store))
+
+
+def init_worker(
+        database_dir: str,
+        openai_key: str,
+        warm_vectorizer: bool = False,
+        embedding_cache: Optional[str] = None,
+        similarity_backend: str = "sent2vec"
+) -> None:
+    global _worker_tool_executor
+    openai.api_key = openai_key
+    _worker_tool_executor = ToolExecutor(init_database_dir=database_dir)
+    set_similarity_backend(similarity_backend)
+    set_embedding_cache(embedding_cache)
+    if warm_vectorizer and embedding_cache is None and similarity_backend == "sent2vec":
+        # load model before first conversation instead of during it, with a cache it may not be needed at all
+        try:
+            load_vectorizer().load_model()
+        except Exception as error:
+            # raising in a pool initializer respawns workers forever, fail on first comparison instead
+            logger.warning(f"Failed to load vectorizer: {error}")
+
+
+def get_apis_used(api_mode: str, conversation: dict) -> list:
+    if api_mode == "exact":
+        apis_used = [APIS_BY_NAME[api_name] for api_name in conversation["apis_used"]]
+    elif api_mode == "suite":
+        apis_used = [
+            api for suite_name in conversation["suites_used"] for api in SUITES_BY_NAME[suite_name].apis
+        ]
+    elif api_mode == "all":
+        apis_used = ALL_APIS
+    else:
+        raise ValueError(f"Invalid api mode: {api_mode}")
+    return apis_used
+
+
+def is_finished(args: argparse.Namespace, manifest: RunManifest, entries: Dict[str, dict], file_name: str) -> bool:
+    """
+    Checks if a previous run already wrote the output of file_name, using its manifest entry.
+    Outputs of runs from before the manifest existed are parsed once and added to it.
+    """
+    if args.reset:
+        return False
+    entry = entries.get(file_name)
+    if entry is not None and manifest.is_current(entry):
+        return True
+
+    output_file_path = os.path.join(args.output_dir, file_name)
+    if not os.path.exists(output_file_path):
+        return False
+    with open(output_file_path, 'rb') as reader:
+        content = reader.read()
+    try:
+        metrics = json.loads(content).get("metrics")
+    except json.JSONDecodeError:
+        logger.warning(f"Rerunning {file_name} because its output is incomplete")
+        return False
+    entries[file_name] = manifest.append(file_name, content, metrics)
+    return True
+
+
+def reset_outputs(manifest: RunManifest) -> None:
+    """
+    Removes outputs logged in the manifest and the manifest itself. JSON outputs of earlier runs are overwritten
+    anyway, but shards are never written again, so they would be read twice.
+    """
+    for entry in manifest.load().values():
+        output_name = entry.get("shard", entry["file_name"])
+        output_path = os.path.join(manifest.output_dir, output_name)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    manifest.clear()
+
+
+def finish_conversation(
+        args: argparse.Namespace,
+        tool_executor: ToolExecutor,
+        file_name: str,
+        conversation: dict
+) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Evaluates and writes a conversation with predictions, returning its metrics if they were calculated.
+    Conversations written to JSONL shards are returned as a line instead, for the main process to write.
+    """
+    metrics = None
+    if EvalModes.EVALUATE in args.modes:
+        logger.info("Running evaluation...")
+        conversation = tool_executor.evaluate_predictions(conversation)
+        logger.info(f"Conversation {file_name} pass: {conversation['metrics']['success']}")
+        metrics = conversation["metrics"]
+
+        if EvalModes.VALIDATE in args.modes:
+            logger.info("Validating evaluation...")
+            for turn in conversation["conversation"]:
+                if "predictions" not in turn:
+                    continue
+                for prediction in turn["predictions"]:
+                    if prediction["role"] == "api":
+                        assert "match" in prediction
+                        assert "bad_action" in prediction
+
+    if not args.inline_metadata:
+        conversation = compact_conversation_metadata(conversation, get_metadata_store(args.output_dir))
+    if args.output_format != "json":
+        return metrics, json.dumps(conversation)
+
+    output_file_path = os.path.join(args.output_dir, file_name)
+    content = json.dumps(conversation, indent=4).encode("utf-8")
+    with open(output_file_path, 'wb') as writer:
+        writer.write(content)
+    # logged after the output is complete, so an interrupted write is rerun on resume
+    RunManifest.from_output_dir(args.output_dir).append(file_name, content, metrics)
+    return metrics, None
+
+
+def evaluate_file(
+        args: argparse.Namespace,
+        file_name: str,
+        conversation: dict
+) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Predicts, evaluates and writes a single conversation, see finish_conversation.
+    """
+    tool_executor = _worker_tool_executor
+    logger.info(f"Running {file_name}")
+    if EvalModes.PREDICT in args.modes:
+        logger.info("Running prediction...")
+        predictor_func = OpenAIPredictor(
+            model=args.model,
+            apis_used=get_apis_used(args.api_mode, conversation),
+            disable_docs=args.disable_documentation
+        )
+        if args.response_cache is not None:
+            predictor_func = CachedOpenAIPredictor(
+                predictor_func, get_response_cache(args.response_cache), args.cache_mode
+            )
+        conversation = tool_executor.run_conversation(conversation, predictor_func, args.turn_workers)
+
+    return finish_conversation(args, tool_executor, file_name, conversation)
+
+
+async def evaluate_file_async(
+        args: argparse.Namespace,
+        tool_executor: ToolExecutor,
+        file_name: str,
+        conversation: dict,
+        finish_executor: Executor
+) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Same as evaluate_file, but awaits predictions so other conversations can run in the meantime.
+    Evaluation and writing run in finish_executor instead of blocking the event loop.
+    """
+    logger.info(f"Running {file_name}")
+    if EvalModes.PREDICT in args.modes:
+        logger.info("Running prediction...")
+        if args.response_cache is not None:
+            predictor_func = AsyncCachedOpenAIPredictor(
+                OpenAIPredictor(args.model, get_apis_used(args.api_mode, conversation), args.disable_documentation),
+                get_response_cache(args.response_cache),
+                args.cache_mode
+            )
+        else:
+            predictor_func = AsyncOpenAIPredictor(
+                model=args.model,
+                apis_used=get_apis_used(args.api_mode, conversation),
+                disable_docs=args.disable_documentation
+            )
+        conversation = await tool_executor.run_conversation_async(
+            conversation, predictor_func, parallel_turns=args.turn_workers > 1
+        )
+
+    return await asyncio.get_running_loop().run_in_executor(
+        finish_executor, finish_conversation, args, tool_executor, file_name, conversation
+    )
+
+
+async def evaluate_files_async(
+        args: argparse.Namespace,
+        tasks: List[tuple],
+        progress: tqdm
+) -> List[Tuple[Optional[dict], Optional[str]]]:
+    """
+    Keeps up to args.async_concurrency conversations in flight, returning results in dataset order.
+    """
+    semaphore = asyncio.Semaphore(args.async_concurrency)
+    # one thread finishes conversations in turn, semantic score caches and metadata stores aren't shared between threads
+    finish_executor = ThreadPoolExecutor(max_workers=1)
+
+    async def run_task(file_name: str, conversation: dict) -> Tuple[Optional[dict], Optional[str]]:
+        async with semaphore:
+            # concurrent conversations each need their own executor state
+            tool_executor = _worker_tool_executor.fork()
+            result = await evaluate_file_async(args, tool_executor, file_name, conversation, finish_executor)
+        progress.update()
+        return result
+
+    try:
+        return await asyncio.gather(*[run_task(file_name, conversation) for _, file_name, conversation in tasks])
+    finally:
+        finish_executor.shutdown(wait=True)
+
+
+def _evaluate_file_task(task: tuple) -> Tuple[Optional[dict], Optional[str]]:
+    return evaluate_file(*task)
+
+
 def main(flags: List[str] = None):
     parser = get_arg_parser()
     args = parser.parse_args(flags)
 
     # get api key
     openai_key = os.environ.get("OPENAI_KEY", None)
-    if openai_key is None:
+    # replaying recorded responses doesn't need a key
+    replaying = args.response_cache is not None and args.cache_mode == CacheModes.REPLAY
+    if openai_key is None and not replaying:
         with open(args.api_key, "r") as f:
             openai_key = f.read().strip()
     openai.api_key = openai_key
 
     total_metrics = Counter()
     os.makedirs(args.output_dir, exist_ok=True)
-    tool_executor = ToolExecutor(init_database_dir=args.database)
-    for file_name, file_path in tqdm(get_names_and_paths(args.dataset)):
-        output_file_path = os.path.join(args.output_dir, file_name)
-        if os.path.exists(output_file_path) and not args.reset:
-            logger.info(f"Skipping {file_name} because it already exists")
-            with open(output_file_path, 'r', encoding='utf-8') as reader:
-                conversation_with_metrics = json.load(reader)
-            total_metrics += conversation_with_metrics["metrics"]
-            total_metrics["num_conversations"] += 1
-            continue
-
-        logger.info(f"Running {file_name}")
-        with open(file_path, 'r', encoding='utf-8') as reader:
-            conversation = json.load(reader)
-
-        if EvalModes.PREDICT in args.modes:
-            logger.info("Running prediction...")
-            if args.api_mode == "exact":
-                apis_used = [APIS_BY_NAME[api_name] for api_name in conversation["apis_used"]]
-            elif args.api_mode == "suite":
-                apis_used = [
-                    api for suite_name in conversation["suites_used"] for api in SUITES_BY_NAME[suite_name].apis
-                ]
-            elif args.api_mode == "all":
-                apis_used = ALL_APIS
+    manifest = RunManifest.from_output_dir(args.output_dir)
+    if args.reset:
+        reset_outputs(manifest)
+    entries = manifest.load()
+
+    output_writer = None
+    if args.output_format != "json":
+        # shards are written by this process, conversations are logged in the manifest once their shard is complete
+        # and before it's renamed into place. Entries of a shard that never appeared aren't current, so an
+        # interrupted commit reruns its conversations instead of writing them into a second shard.
+        pending_outputs = dict()
+
+        def log_shard(shard_name: str, file_names: List[str]) -> None:
+            for file_name in file_names:
+                content, metrics = pending_outputs.pop(file_name)
+                entries[file_name] = manifest.append(file_name, content, metrics, shard=shard_name)
+
+        output_writer = ShardedJsonlWriter(args.output_dir, args.shard_size, f".{args.output_format}", log_shard)
+
+    loop = None
+    pool = None
+    if args.async_concurrency > 0:
+        loop = asyncio.new_event_loop()
+        init_worker(args.database, openai_key, False, args.embedding_cache, args.similarity_backend)
+    elif args.workers > 1:
+        init_args = (
+            args.database, openai_key, EvalModes.EVALUATE in args.modes, args.embedding_cache, args.similarity_backend
+        )
+        pool = multiprocessing.Pool(args.workers, initializer=init_worker, initargs=init_args)
+    else:
+        init_worker(args.database, openai_key, False, args.embedding_cache, args.similarity_backend)
+
+    # conversations are streamed in chunks, results come back in dataset order so aggregation matches a serial run
+    skipped_count = 0
+    progress = tqdm()
+    try:
+        for chunk in iter_chunks(iter_conversations(args.dataset), TASK_CHUNK_SIZE):
+            finished = {file_name for file_name, _ in chunk if is_finished(args, manifest, entries, file_name)}
+            tasks = [(args, file_name, conversation) for file_name, conversation in chunk if file_name not in finished]
+            if loop is not None:
+                results = loop.run_until_complete(evaluate_files_async(args, tasks, progress))
+            elif pool is not None:
+                results = pool.imap(_evaluate_file_task, tasks)
             else:
-                raise ValueError(f"Invalid api mode: {args.api_mode}")
+                results = map(_evaluate_file_task, tasks)
 
-            predictor_func = OpenAIPredictor(
-                model=args.model,
-                apis_used=apis_used,
-                disable_docs=args.disable_documentation
-            )
-            conversation = tool_executor.run_conversation(conversation, predictor_func)
-
-        if EvalModes.EVALUATE in args.modes:
-            logger.info("Running evaluation...")
-            conversation = tool_executor.evaluate_predictions(conversation)
-            logger.info(f"Conversation {file_name} pass: {conversation['metrics']['success']}")
-            total_metrics += conversation["metrics"]
-            total_metrics["num_conversations"] += 1
-
-            if EvalModes.VALIDATE in args.modes:
-                logger.info("Validating evaluation...")
-                for turn in conversation["conversation"]:
-                    if "predictions" not in turn:
-                        continue
-                    for prediction in turn["predictions"]:
-                        if prediction["role"] == "api":
-                            assert "match" in prediction
-                            assert "bad_action" in prediction
-
-        with open(output_file_path, 'w', encoding='utf-8') as writer:
-            json.dump(conversation, writer, indent=4)
-
-    logger.info("Finished processing conversations")
+            results = iter(results)
+            for file_name, _ in chunk:
+                if file_name in finished:
+                    skipped_count += 1
+                    metrics = entries[file_name]["metrics"]
+                else:
+                    metrics, line = next(results)
+                    if line is not None:
+                        pending_outputs[file_name] = (line.encode("utf-8"), metrics)
+                        output_writer.write(file_name, line)
+                if loop is None or file_name in finished:
+                    progress.update()
+                if metrics is not None:
+                    total_metrics += metrics
+                    total_metrics["num_conversations"] += 1
+    finally:
+        progress.close()
+        if output_writer is not None:
+            output_writer.close()
+        if pool is not None:
+            pool.terminate()
+        if loop is not None:
+            loop.close()
+        for store in list(_metadata_stores.values()) + list(_response_caches.values()):
+            store.close()
+
+    logger.info(f"Finished processing conversations, skipped {skipped_count} finished by a previous run")
+    if pool is None:
+        # workers keep their own caches, stats are only available for in process runs
+        logger.debug(f"Semantic score cache: {get_semantic_cache_stats()}")
     if EvalModes.EVALUATE in args.modes:
         metrics = {
             "num_conversations": total_metrics["num_conversations"],
@@ -0,0 +1,352 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+
+Local stand-in for OpenAI chat and completion endpoints, answering chat completions of OpenAIPredictor with oracle
+predictions from a dataset. Latency, rate limit errors and malformed function call arguments can be injected to
+benchmark and test the evaluation harness offline.
+
+Point the harness at it with OPENAI_API_BASE=http://127.0.0.1:<port>/v1 and any API key.
+"""
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tooltalk.evaluation.evaluate_openai import OpenAIPredictor
+from tooltalk.evaluation.oracle_predictor import OraclePredictor
+from tooltalk.utils.file_utils import iter_conversations
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StubConfig:
+    # seconds added to every response, plus up to jitter seconds drawn uniformly
+    latency: float = 0.0
+    jitter: float = 0.0
+    # probability of answering with a 429 rate limit error
+    rate_limit_rate: float = 0.0
+    # probability of truncating function call arguments so they aren't valid JSON
+    malformed_rate: float = 0.0
+    # text of every choice returned by the completion endpoint
+    completion_text: str = ""
+    seed: int = 0
+
+
+class OracleChatResponder:
+    """
+    Finds the dataset conversation a chat completion request of OpenAIPredictor was made for, by its system prompt and
+    user messages, and answers with the next oracle prediction.
+    """
+    def __init__(self, conversations: Iterable[dict]):
+        # (system prompt, first user message) -> conversations
+        self.conversations: Dict[Tuple[str, str], List[dict]] = dict()
+        for conversation in conversations:
+            user_texts = self.get_user_texts(conversation)
+            if user_texts:
+                key = (self.get_system_prompt(conversation["metadata"]), user_texts[0])
+                self.conversations.setdefault(key, list()).append(conversation)
+
+    @staticmethod
+    def get_system_prompt(metadata: dict) -> str:
+        return OpenAIPredictor.system_prompt.format(
+            location=metadata["location"],
+            timestamp=metadata["timestamp"],
+            username=metadata.get("username")
+        )
+
+    @staticmethod
+    def get_user_texts(conversation: dict) -> List[str]:
+        return [turn["text"] for turn in conversation["conversation"] if turn["role"] == "user"]
+
+    @staticmethod
+    def get_conversation_history(messages: List[dict]) -> List[dict]:
+        """
+        Converts chat messages back into the conversation history OraclePredictor expects.
+        """
+        history = list()
+        for message in messages:
+            if message["role"] == "user":
+                history.append({"role": "user", "text": message["content"]})
+            elif message["role"] == "assistant" and message.get("function_call") is not None:
+                history.append({"role": "api", "request": {"api_name": message["function_call"]["name"]}})
+            elif message["role"] == "assistant":
+                history.append({"role": "assistant", "text": message["content"]})
+            # system prompt is matched separately and function messages only carry responses of api calls
+        return history
+
+    def get_conversation(self, messages: List[dict]) -> dict:
+        history = self.get_conversation_history(messages)
+        user_texts = [turn["text"] for turn in history if turn["role"] == "user"]
+        if not messages or messages[0]["role"] != "system" or not user_texts:
+            raise ValueError("Request must start with a system prompt followed by a user message")
+        for conversation in self.conversations.get((messages[0]["content"], user_texts[0]), list()):
+            if self.get_user_texts(conversation)[:len(user_texts)] == user_texts:
+                return conversation
+        raise ValueError("No conversation in dataset matches request")
+
+    def get_message(self, messages: List[dict]) -> dict:
+        """
+        Returns next oracle prediction as an assistant message.
+        """
+        conversation = self.get_conversation(messages)
+        prediction = OraclePredictor(conversation).predict(
+            conversation["metadata"], self.get_conversation_history(messages)
+        )
+        if prediction["role"] == "api":
+            return {
+                "role": "assistant",
+                "content": None,
+                "function_call": {
+                    "name": prediction["request"]["api_name"],
+                    "arguments": json.dumps(prediction["request"]["parameters"])
+                }
+            }
+        return {"role": "assistant", "content": prediction["text"]}
+
+
+class StubStats:
+    """
+    Thread safe request counters and latencies of served responses.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.latencies = list()
+
+    def increment(self, name: str) -> None:
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def start_request(self) -> None:
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def finish_request(self, latency: float) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            self.latencies.append(latency)
+
+    def get_latency_percentile(self, percentile: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(percentile / 100 * len(latencies)))]
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            stats = {
+                "counts": dict(self.counts),
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+            }
+        stats["latency"] = {f"p{percentile}": self.get_latency_percentile(percentile) for percentile in (50, 95, 99)}
+        return stats
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counts = dict()
+            self.max_in_flight = self.in_flight
+            self.latencies = list()
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    server: "StubOpenAIServer"
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+    def send_json(self, status: int, body: dict) -> None:
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_error_json(self, status: int, message: str, error_type: str, code: Optional[str] = None) -> None:
+        self.send_json(status, {"error": {"message": message, "type": error_type, "param": None, "code": code}})
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") in {"/stats", "/v1/stats"}:
+            self.send_json(200, self.server.stats.to_dict())
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}", "invalid_request_error")
+
+    def do_POST(self) -> None:
+        path = self.path.rstrip("/")
+        if path in {"/stats/reset", "/v1/stats/reset"}:
+            self.server.stats.reset()
+            self.send_json(200, self.server.stats.to_dict())
+            return
+        if path not in {"/v1/chat/completions", "/v1/completions"}:
+            self.send_error_json(404, f"Unknown path {self.path}", "invalid_request_error")
+            return
+
+        stats = self.server.stats
+        config = self.server.config
+        start_time = time.perf_counter()
+        stats.start_request()
+        try:
+            stats.increment("requests")
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if self.server.draw() < config.rate_limit_rate:
+                stats.increment("rate_limited")
+                self.send_error_json(429, "Rate limit reached for requests", "requests", "rate_limit_exceeded")
+                return
+
+            time.sleep(config.latency + config.jitter * self.server.draw())
+            if path == "/v1/chat/completions":
+                stats.increment("chat_completions")
+                body = self.get_chat_completion(request)
+            else:
+                stats.increment("completions")
+                body = self.get_completion(request)
+        except ValueError as error:
+            stats.increment("errors")
+            self.send_error_json(400, str(error), "invalid_request_error")
+        else:
+            self.send_json(200, body)
+        finally:
+            stats.finish_request(time.perf_counter() - start_time)
+
+    def get_chat_completion(self, request: dict) -> dict:
+        message = self.server.responder.get_message(request["messages"])
+        if "function_call" in message and self.server.draw() < self.server.config.malformed_rate:
+            self.server.stats.increment("malformed")
+            message["function_call"]["arguments"] = message["function_call"]["arguments"][:-1]
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": message,
+                "finish_reason": "function_call" if "function_call" in message else "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    def get_completion(self, request: dict) -> dict:
+        prompts = request.get("prompt", "")
+        prompts = prompts if isinstance(prompts, list) else [prompts]
+        return {
+            "id": f"cmpl-{uuid.uuid4().hex}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [
+                {"index": i, "text": self.server.config.completion_text, "logprobs": None, "finish_reason": "stop"}
+                for i in range(len(prompts))
+            ],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    """
+    Serves requests on a thread each, so latency of concurrent requests overlaps like with the real endpoint.
+    """
+    daemon_threads = True
+
+    def __init__(
+            self,
+            responder: OracleChatResponder,
+            config: StubConfig = None,
+            host: str = "127.0.0.1",
+            port: int = 0
+    ) -> None:
+        super().__init__((host, port), StubRequestHandler)
+        self.responder = responder
+        self.config = config if config is not None else StubConfig()
+        self.stats = StubStats()
+        self.random = random.Random(self.config.seed)
+        self.random_lock = threading.Lock()
+        self.thread = None
+
+    @classmethod
+    def from_dataset(cls, dataset_path: str, config: StubConfig = None, **kwargs) -> "StubOpenAIServer":
+        return cls(OracleChatResponder(conversation for _, conversation in iter_conversations(dataset_path)), config,
+                   **kwargs)
+
+    @property
+    def api_base(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def draw(self) -> float:
+        with self.random_lock:
+            return self.random.random()
+
+    def start(self) -> "StubOpenAIServer":
+        """
+        Serves requests on a background thread until stop.
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self) -> "StubOpenAIServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.stop()
+
+
+def get_arg_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", type=str, help="Path to dataset to answer chat completions from")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to serve on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to serve on")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many seconds added at random")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="Probability of a rate limit error")
+    parser.add_argument("--malformed_rate", type=float, default=0.0,
+                        help="Probability of malformed function call arguments")
+    parser.add_argument("--completion_text", type=str, default="", help="Text returned by completion endpoint")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of injected latency and errors")
+    return parser
+
+
+def main(flags: List[str] = None):
+    parser = get_arg_parser()
+    args = parser.parse_args(flags)
+    config = StubConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit_rate=args.rate_limit_rate,
+        malformed_rate=args.malformed_rate,
+        completion_text=args.completion_text,
+        seed=args.seed
+    )
+    server = StubOpenAIServer.from_dataset(args.dataset, config, host=args.host, port=args.port)
+    logger.info(f"Serving {args.dataset} at {server.api_base}, counters at {server.api_base}/stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"Stats: {json.dumps(server.stats.to_dict(), indent=4)}")
+
+
+if __name__ == "__main__":
+    main()
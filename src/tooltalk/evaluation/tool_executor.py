@@ -2,17 +2,22 @@
 Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
+import asyncio
+import copy
 import json
 import logging
 import os
 from typing import List
-from datetime import datetime
-from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from abc import ABC, abstractmethod
 
 from tooltalk.apis import ALL_APIS
+from tooltalk.apis.api import build_session_index, set_session_token
+from tooltalk.apis.utils import precompute_semantic_scores
 from tooltalk.apis.account import ACCOUNT_DB_NAME, DeleteAccount, UserLogin, LogoutUser, RegisterUser
+from tooltalk.utils.database_utils import CopyOnWriteDict, fingerprint_json, freeze_json
 from tooltalk.utils.file_utils import get_names_and_paths
+from tooltalk.utils.timestamp_utils import parse_datetime
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +33,7 @@ class ToolExecutor:
             account_database: str = ACCOUNT_DB_NAME,
     ) -> None:
         self.databases = dict()
+        self.init_databases = dict()
         self.database_files = dict()
         self.account_database = account_database
         self.ignore_list = ignore_list if ignore_list is not None else list()
@@ -37,23 +43,35 @@ class ToolExecutor:
             database_name, ext = os.path.splitext(file_name)
             if ext == ".json":
                 self.database_files[database_name] = file_path
+                # frozen so records can be handed out by APIs without copying
                 with open(file_path, 'r', encoding='utf-8') as reader:
-                    self.databases[database_name] = json.load(reader)
-        if self.account_database not in self.databases:
+                    self.init_databases[database_name] = freeze_json(json.load(reader))
+        if self.account_database not in self.init_databases:
             raise ValueError(f"Account database {self.account_database} not found")
+        self.init_session_index = build_session_index(self.init_databases[self.account_database])
 
         self.apis = {api.__name__: api for api in ALL_APIS if api.__name__ not in self.ignore_list}
+        # indexes are built once, then copied every reset like databases
+        self.init_indexes = dict()
+        for api in self.apis.values():
+            if api.index_class is not None and api.index_class not in self.init_indexes:
+                database = self.init_databases.get(api.database_name, dict())
+                self.init_indexes[api.index_class] = api.index_class(database)
         self.inited_tools = dict()
         self.now_timestamp = None
+        self.reset_executor()
 
     def reset_executor(self):
         """
         Reset all tools and databases to their initial state.
+        Initial databases are never modified, instead each reset hands out copy-on-write views of them.
         """
-        self.databases = dict()
-        for database_name, file_path in self.database_files.items():
-            with open(file_path, 'r', encoding='utf-8') as reader:
-                self.databases[database_name] = json.load(reader)
+        self.databases = {
+            database_name: CopyOnWriteDict(database)
+            for database_name, database in self.init_databases.items()
+        }
+        self.session_index = self.init_session_index.copy()
+        self.indexes = {index_class: index.copy() for index_class, index in self.init_indexes.items()}
         self.inited_tools = dict()
         self.now_timestamp = None
         self.session_token = None
@@ -69,11 +87,14 @@ class ToolExecutor:
                 account_database=account_db,
                 now_timestamp=self.now_timestamp,
                 api_database=database,
+                session_index=self.session_index,
+                api_index=self.indexes.get(cls.index_class),
             )
         else:
             tool = cls(
                 account_database=account_db,
                 now_timestamp=self.now_timestamp,
+                session_index=self.session_index,
             )
 
         self.inited_tools[tool_name] = tool
@@ -126,6 +147,15 @@ class ToolExecutor:
         # TODO add session_token if ground truth needs it
         return self.apis[api_name].check_api_call_correctness(prediction, ground_truth)
 
+    def get_match_key(self, api_call: dict) -> tuple:
+        """
+        Key that is equal for a prediction and ground truth whenever compare_api_calls could match them.
+        """
+        api_name = api_call["request"]["api_name"]
+        if api_name not in self.apis:
+            return api_name,
+        return (api_name,) + tuple(fingerprint_json(api_call[field]) for field in self.apis[api_name].match_fields)
+
     def is_action(self, api_name: str) -> bool:
         if api_name not in self.apis:
             return False
@@ -164,24 +194,37 @@ class ToolExecutor:
             if "apis" in turn:
                 ground_truths.extend(turn["apis"])
 
+        # bucket ground truths by match key, only ground truths in the same bucket can match a prediction
+        ground_truth_buckets = dict()
+        for ground_truth in ground_truths:
+            ground_truth_buckets.setdefault(self.get_match_key(ground_truth), list()).append(ground_truth)
+
+        # score every text pair that may be compared semantically at once, instead of one pair at a time
+        semantic_pairs = list()
+        for prediction in predictions:
+            api_name = prediction["request"]["api_name"]
+            if api_name in self.apis and self.apis[api_name].semantic_parameters:
+                for ground_truth in ground_truth_buckets.get(self.get_match_key(prediction), list()):
+                    semantic_pairs.extend(self.apis[api_name].get_semantic_pairs(prediction, ground_truth))
+        if semantic_pairs:
+            precompute_semantic_scores(semantic_pairs)
+
         # remove ground truth as they get matched to predictions
         match_count = 0
         action_count = 0
         valid_action_count = 0
         bad_action_count = 0
-        current_ground_truths = deque(ground_truths)
         for prediction in predictions:
             is_match = False
-            new_ground_truths = deque()
-            while current_ground_truths:
-                ground_truth = current_ground_truths.popleft()
+            # buckets keep ground truth order, so first remaining match is the same as in a scan over all of them
+            bucket = ground_truth_buckets.get(self.get_match_key(prediction), list())
+            for i, ground_truth in enumerate(bucket):
                 if self.compare_api_calls(prediction, ground_truth):
-                    # don't add back in ground truth that matches
+                    # don't match ground truth again
                     is_match = True
                     ground_truth["match"] = True
+                    del bucket[i]
                     break
-                else:
-                    new_ground_truths.append(ground_truth)
             else:
                 logger.debug(f"Failed {json.dumps(prediction, indent=4)}")
 
@@ -192,19 +235,15 @@ class ToolExecutor:
             prediction["match"] = is_match
             prediction["bad_action"] = is_bad_action
 
-            # add back in ground truths that don't match
-            while current_ground_truths:
-                new_ground_truths.append(current_ground_truths.popleft())
-            current_ground_truths = new_ground_truths
-
             # update counters
             match_count += is_match
             action_count += is_action
             valid_action_count += is_action and is_match
             bad_action_count += is_bad_action
 
-        for ground_truth in current_ground_truths:
-            ground_truth["match"] = False
+        for bucket in ground_truth_buckets.values():
+            for ground_truth in bucket:
+                ground_truth["match"] = False
 
         precision = match_count / len(predictions) if len(predictions) > 0 else 0
         recall = match_count / len(ground_truths)
@@ -233,13 +272,14 @@ class ToolExecutor:
 
     def init_conversation_state(self, metadata: dict, api_history: list, user_data: dict = None) -> None:
         self.reset_executor()
-        self.now_timestamp = datetime.strptime(metadata["timestamp"], "%Y-%m-%d %H:%M:%S")
+        self.now_timestamp = parse_datetime(metadata["timestamp"])
 
         # setting these should never fail, if it does it's a bug in the dataset
         if "session_token" in user_data:
             username = user_data["username"]
             self.session_token = user_data["session_token"]
-            self.databases[self.account_database][username]["session_token"] = user_data["session_token"]
+            account_database = self.databases[self.account_database]
+            set_session_token(account_database, self.session_index, username, user_data["session_token"])
         if "verification_code" in user_data:
             username = user_data["username"]
             self.databases[self.account_database][username]["verification_code"] = user_data["verification_code"]
@@ -248,14 +288,117 @@ class ToolExecutor:
             # this should also never fail, if it does it's a bug in dataset
             self.execute_tool(**api["request"])
 
-    def run_conversation(self, conversation: dict, predict_func: callable):
+    def save_checkpoint(self) -> dict:
         """
-        Simulates a conversation, calling prediction function
+        Captures current state of databases, session and tool random generators.
+        """
+        return {
+            "databases": {name: database.copy() for name, database in self.databases.items()},
+            "session_index": self.session_index.copy(),
+            "indexes": {index_class: index.copy() for index_class, index in self.indexes.items()},
+            "session_token": self.session_token,
+            "now_timestamp": self.now_timestamp,
+            "random_states": {name: tool.random.getstate() for name, tool in self.inited_tools.items()},
+        }
+
+    def restore_checkpoint(self, checkpoint: dict) -> None:
+        """
+        Restores state captured by save_checkpoint, checkpoint can be restored multiple times.
+        """
+        self.databases = {name: database.copy() for name, database in checkpoint["databases"].items()}
+        self.session_index = checkpoint["session_index"].copy()
+        self.indexes = {index_class: index.copy() for index_class, index in checkpoint["indexes"].items()}
+        self.session_token = checkpoint["session_token"]
+        self.now_timestamp = checkpoint["now_timestamp"]
+        self.inited_tools = dict()
+        for tool_name, random_state in checkpoint["random_states"].items():
+            self.get_init_tool(tool_name).random.setstate(random_state)
+
+    def fork(self, checkpoint: dict = None) -> "ToolExecutor":
+        """
+        Creates an executor sharing initial databases, with its own state reset or restored from checkpoint.
+        Forked executors can simulate conversations concurrently with this one.
+        """
+        # shallow copy shares read-only initial databases, resetting replaces all per conversation state
+        tool_executor = copy.copy(self)
+        if checkpoint is None:
+            tool_executor.reset_executor()
+        else:
+            tool_executor.restore_checkpoint(checkpoint)
+        return tool_executor
+
+    def execute_prediction(self, prediction: dict) -> dict:
+        """
+        Executes predicted api call, returning prediction with response.
+        """
+        if prediction["request"]["parameters"] is None:
+            request = prediction["request"]
+            response = {
+                "response": None,
+                "exception": "Failed to parse API call"
+            }
+        else:
+            request, response = self.execute_tool(**prediction["request"])
+        return {
+            "request": request,
+            "response": response["response"],
+            "exception": response["exception"],
+            "metadata": prediction.get("metadata"),
+            "role": "api"
+        }
+
+    def predict_turn(self, metadata: dict, conversation_history: list, predict_func: callable) -> list:
+        """
+        Calls prediction function until it responds as the assistant, executing predicted API calls from current state.
+        """
+        predictions = list()
+        current_history = conversation_history.copy()
+        while True:
+            prediction = predict_func(metadata, current_history)
+            if prediction["role"] == "assistant":
+                # done with predicting apis
+                predictions.append(prediction)
+                break
+            elif prediction["role"] == "api":
+                prediction_and_response = self.execute_prediction(prediction)
+                predictions.append(prediction_and_response)
+                current_history.append(prediction_and_response)
+            else:
+                raise ValueError(f"prediction role should be api or assistant, instead got {prediction['role']}")
+        return predictions
+
+    async def predict_turn_async(self, metadata: dict, conversation_history: list, predict_func: callable) -> list:
+        """
+        Same as predict_turn, but awaits an async prediction function.
+        """
+        predictions = list()
+        current_history = conversation_history.copy()
+        while True:
+            prediction = await predict_func(metadata, current_history)
+            if prediction["role"] == "assistant":
+                # done with predicting apis
+                predictions.append(prediction)
+                break
+            elif prediction["role"] == "api":
+                prediction_and_response = self.execute_prediction(prediction)
+                predictions.append(prediction_and_response)
+                current_history.append(prediction_and_response)
+            else:
+                raise ValueError(f"prediction role should be api or assistant, instead got {prediction['role']}")
+        return predictions
+
+    def _iter_assistant_turns(self, conversation: dict):
+        """
+        Yields assistant turns with ground truth history and checkpoint of the state before each turn.
+        Executor state matches the checkpoint when a turn is yielded, predictions made in between are undone.
         """
         metadata = conversation["metadata"]
         user_data = conversation.get("user")
         ground_truth_history = list()
-        api_history = list()
+
+        # checkpoint ground truth state after each turn instead of replaying whole api history
+        self.init_conversation_state(metadata, list(), user_data)
+        checkpoint = self.save_checkpoint()
 
         for turn in conversation["conversation"]:
             if turn["role"] == "user":
@@ -269,42 +412,13 @@ class ToolExecutor:
                 raise ValueError(f"turn role must be user or assistant, instead got {turn['role']}")
 
             # other turns should be the assistant and could contain API calls
-            self.init_conversation_state(metadata, api_history, user_data)
-            predictions = list()
-            current_history = ground_truth_history.copy()
-            while True:
-                prediction = predict_func(metadata, current_history)
-                if prediction["role"] == "assistant":
-                    # done with predicting apis
-                    predictions.append(prediction)
-                    break
-                elif prediction["role"] == "api":
-                    # execute api call
-                    if prediction["request"]["parameters"] is None:
-                        request = prediction["request"]
-                        response = {
-                            "response": None,
-                            "exception": "Failed to parse API call"
-                        }
-                    else:
-                        request, response = self.execute_tool(**prediction["request"])
-                    prediction_and_response = {
-                        "request": request,
-                        "response": response["response"],
-                        "exception": response["exception"],
-                        "metadata": prediction.get("metadata")
-                    }
-                    predictions.append(prediction_and_response)
-                    prediction_and_response["role"] = "api"
-                    current_history.append(prediction_and_response)
-                else:
-                    raise ValueError(f"prediction role should be api or assistant, instead got {prediction['role']}")
-
-            # add predictions to original conversation object
-            turn["predictions"] = predictions
+            yield turn, ground_truth_history.copy(), checkpoint
+
+            self.restore_checkpoint(checkpoint)
             if "apis" in turn:
                 for api in turn["apis"]:
-                    api_history.append(api)
+                    # this should also never fail, if it does it's a bug in dataset
+                    self.execute_tool(**api["request"])
                     ground_truth_history.append({
                         "role": "api",
                         "request": api["request"],
@@ -315,6 +429,58 @@ class ToolExecutor:
                 "role": "assistant",
                 "text": turn["text"]
             })
+            checkpoint = self.save_checkpoint()
+
+    def run_conversation(self, conversation: dict, predict_func: callable, num_workers: int = 1):
+        """
+        Simulates a conversation, calling prediction function
+
+        Turns only depend on ground truth history, so with num_workers > 1 the starting state of every turn is
+        prepared up front and turns are predicted concurrently in a thread pool, predict_func must be thread safe.
+        """
+        metadata = conversation["metadata"]
+        turn_jobs = list()
+        for turn, history, checkpoint in self._iter_assistant_turns(conversation):
+            if num_workers > 1:
+                turn_jobs.append((turn, self.fork(checkpoint), history))
+            else:
+                # add predictions to original conversation object
+                turn["predictions"] = self.predict_turn(metadata, history, predict_func)
+
+        if turn_jobs:
+            with ThreadPoolExecutor(max_workers=num_workers) as pool:
+                futures = [
+                    pool.submit(tool_executor.predict_turn, metadata, history, predict_func)
+                    for _, tool_executor, history in turn_jobs
+                ]
+                for (turn, _, _), future in zip(turn_jobs, futures):
+                    turn["predictions"] = future.result()
+
+        return conversation
+
+    async def run_conversation_async(self, conversation: dict, predict_func: callable, parallel_turns: bool = False):
+        """
+        Simulates a conversation, awaiting an async prediction function such as AsyncBaseAPIPredictor.
+        Concurrent conversations must each use their own executor, see fork.
+
+        With parallel_turns all turns of the conversation are predicted concurrently.
+        """
+        metadata = conversation["metadata"]
+        turn_jobs = list()
+        for turn, history, checkpoint in self._iter_assistant_turns(conversation):
+            if parallel_turns:
+                turn_jobs.append((turn, self.fork(checkpoint), history))
+            else:
+                # add predictions to original conversation object
+                turn["predictions"] = await self.predict_turn_async(metadata, history, predict_func)
+
+        if turn_jobs:
+            turn_predictions = await asyncio.gather(*[
+                tool_executor.predict_turn_async(metadata, history, predict_func)
+                for _, tool_executor, history in turn_jobs
+            ])
+            for (turn, _, _), predictions in zip(turn_jobs, turn_predictions):
+                turn["predictions"] = predictions
 
         return conversation
 
@@ -331,3 +497,20 @@ class BaseAPIPredictor(ABC):
     def __call__(self, metadata: dict, conversation_history: dict) -> dict:
         """Simple wrapper for convenience."""
         return self.predict(metadata, conversation_history)
+
+
+class AsyncBaseAPIPredictor(ABC):
+    """
+    Predictor that awaits its predictions, use with ToolExecutor.run_conversation_async.
+    """
+    @abstractmethod
+    def __init__(self, function_docs: List[dict], *args, **kwargs):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def predict(self, metadata: dict, conversation_history: dict) -> dict:
+        raise NotImplementedError
+
+    async def __call__(self, metadata: dict, conversation_history: dict) -> dict:
+        """Simple wrapper for convenience."""
+        return await self.predict(metadata, conversation_history)
@@ -0,0 +1,123 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import hashlib
+import sqlite3
+import time
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from tooltalk.utils.store_utils import SQLiteStore
+
+# stays below SQLite's limit on variables in a single statement
+_CHUNK_SIZE = 500
+
+
+def _chunk_list(items: list, size: int = _CHUNK_SIZE) -> List[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class EmbeddingCache(SQLiteStore):
+    """
+    Persistent text -> vector store in a SQLite file, keyed by a hash of namespace (e.g. model name) and text.
+
+    Worker processes can read and write it concurrently, see SQLiteStore. Once it grows beyond max_entries, the least
+    recently accessed entries are evicted. Access times are only refreshed once they are older than refresh_interval
+    seconds, so reads of recently used vectors don't need to write.
+    """
+    schema = [
+        "CREATE TABLE IF NOT EXISTS embeddings "
+        "(key TEXT PRIMARY KEY, dtype TEXT NOT NULL, vector BLOB NOT NULL, accessed REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)",
+        # number of entries kept up to date by triggers, counting rows on every put would scan the table
+        "CREATE TABLE IF NOT EXISTS embeddings_count (count INTEGER NOT NULL)",
+        "CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON embeddings "
+        "BEGIN UPDATE embeddings_count SET count = count + 1; END",
+        "CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON embeddings "
+        "BEGIN UPDATE embeddings_count SET count = count - 1; END",
+        # caches written before the count existed are counted once
+        "INSERT INTO embeddings_count SELECT COUNT(*) FROM embeddings "
+        "WHERE NOT EXISTS (SELECT 1 FROM embeddings_count)",
+    ]
+
+    def __init__(
+            self,
+            path: str,
+            namespace: str = "",
+            max_entries: int = 1_000_000,
+            timeout: float = 30.0,
+            refresh_interval: float = 3600.0
+    ) -> None:
+        super().__init__(path, timeout)
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.refresh_interval = refresh_interval
+
+    def get_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        Returns vectors of texts found in the cache, marking them as recently accessed.
+        """
+        keys = {self.get_key(text): text for text in texts}
+        vectors = dict()
+        if not keys:
+            return vectors
+        now = time.time()
+        stale = list()
+        with self.lock:
+            connection = self.get_connection()
+            for chunk in _chunk_list(list(keys)):
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    f"SELECT key, dtype, vector, accessed FROM embeddings WHERE key IN ({placeholders})", chunk
+                )
+                for key, dtype, vector, accessed in rows:
+                    vectors[keys[key]] = np.frombuffer(vector, dtype=dtype)
+                    if now - accessed >= self.refresh_interval:
+                        stale.append(key)
+            if stale:
+                with connection:
+                    for chunk in _chunk_list(stale):
+                        placeholders = ",".join("?" * len(chunk))
+                        connection.execute(
+                            f"UPDATE embeddings SET accessed = ? WHERE key IN ({placeholders})", [now] + chunk
+                        )
+        return vectors
+
+    def put_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        """
+        Stores vectors of texts, evicting least recently accessed entries beyond max_entries.
+        """
+        if not vectors:
+            return
+        now = time.time()
+        rows = [
+            (self.get_key(text), vector.dtype.str, np.ascontiguousarray(vector).tobytes(), now)
+            for text, vector in vectors.items()
+        ]
+        with self.lock:
+            connection = self.get_connection()
+            with connection:
+                # updating existing entries in place keeps the count triggers exact, REPLACE would skip them
+                connection.executemany(
+                    "INSERT INTO embeddings VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                    "dtype = excluded.dtype, vector = excluded.vector, accessed = excluded.accessed", rows
+                )
+                excess = self._count(connection) - self.max_entries
+                if excess > 0:
+                    connection.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY accessed LIMIT ?)", (excess,)
+                    )
+
+    @staticmethod
+    def _count(connection: sqlite3.Connection) -> int:
+        return connection.execute("SELECT count FROM embeddings_count").fetchone()[0]
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self._count(self.get_connection())
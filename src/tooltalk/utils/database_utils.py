@@ -0,0 +1,188 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+from collections.abc import MutableMapping
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError(f"{self.__class__.__name__} is immutable")
+
+
+class FrozenDict(dict):
+    """
+    Immutable dict that still serializes and compares like a plain dict.
+    """
+    __slots__ = tuple()
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self) -> "FrozenDict":
+        return self
+
+    def __deepcopy__(self, memo) -> "FrozenDict":
+        return self
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+
+class FrozenList(list):
+    """
+    Immutable list that still serializes and compares like a plain list.
+    """
+    __slots__ = tuple()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = clear = sort = reverse = _immutable
+
+    def __copy__(self) -> "FrozenList":
+        return self
+
+    def __deepcopy__(self, memo) -> "FrozenList":
+        return self
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+
+def freeze_json(value):
+    """
+    Converts a json-like object into frozen dicts and lists, already frozen objects are returned as is.
+    """
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    elif isinstance(value, dict):
+        return FrozenDict((key, freeze_json(item)) for key, item in value.items())
+    elif isinstance(value, list):
+        return FrozenList(freeze_json(item) for item in value)
+    return value
+
+
+def copy_json(value):
+    """
+    Copies a json-like object (dicts, lists and scalars), much faster than copy.deepcopy.
+    Frozen objects are immutable so they are shared instead of copied.
+    """
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    elif isinstance(value, dict):
+        return {key: copy_json(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [copy_json(item) for item in value]
+    return value
+
+
+def fingerprint_json(value):
+    """
+    Hashable fingerprint of a json-like object, fingerprints of equal objects are equal.
+    """
+    if isinstance(value, dict):
+        return frozenset((key, fingerprint_json(item)) for key, item in value.items())
+    elif isinstance(value, list):
+        return tuple(fingerprint_json(item) for item in value)
+    return value
+
+
+class CopyOnWriteDict(MutableMapping):
+    """
+    Mutable view over a read-only baseline dict.
+
+    Writes and deletes are recorded in overlays, so the baseline is never modified and creating a view is O(1).
+    Nested dicts up to `depth` levels are wrapped in views of their own as they are accessed, deeper containers are
+    copied the first time they are read unless they are frozen. Iteration order matches what a plain dict copy of the
+    baseline would have.
+    """
+
+    __slots__ = ("_base", "_depth", "_cache", "_deleted", "_added")
+
+    def __init__(self, base: dict, depth: int = 2) -> None:
+        self._base = base
+        self._depth = depth
+        # base keys that were accessed or overwritten, these keep their position in iteration
+        self._cache = dict()
+        # base keys that were deleted
+        self._deleted = set()
+        # new keys, or base keys that were deleted and then re-inserted, iterated after base keys
+        self._added = dict()
+
+    def _materialize(self, value):
+        if isinstance(value, dict):
+            if self._depth > 1:
+                return CopyOnWriteDict(value, self._depth - 1)
+            return copy_json(value)
+        elif isinstance(value, list):
+            return copy_json(value)
+        return value
+
+    def __getitem__(self, key):
+        if key in self._added:
+            return self._added[key]
+        if key in self._deleted:
+            raise KeyError(key)
+        if key in self._cache:
+            return self._cache[key]
+        value = self._base[key]
+        if isinstance(value, (dict, list)):
+            value = self._materialize(value)
+            self._cache[key] = value
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        if key in self._added or key in self._deleted or key not in self._base:
+            self._added[key] = value
+        else:
+            self._cache[key] = value
+
+    def __delitem__(self, key) -> None:
+        if key in self._added:
+            del self._added[key]
+        elif key in self._base and key not in self._deleted:
+            self._deleted.add(key)
+            self._cache.pop(key, None)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        if key in self._added:
+            return True
+        return key in self._base and key not in self._deleted
+
+    def __iter__(self):
+        for key in self._base:
+            if key not in self._deleted:
+                yield key
+        yield from self._added
+
+    def __len__(self) -> int:
+        return len(self._base) - len(self._deleted) + len(self._added)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.to_dict()!r})"
+
+    def __deepcopy__(self, memo) -> dict:
+        return self.to_dict()
+
+    def copy(self) -> "CopyOnWriteDict":
+        """
+        Forks view, copying only accessed and modified entries. Baseline stays shared.
+        """
+        view = CopyOnWriteDict(self._base, self._depth)
+        view._cache = {key: self._fork(value) for key, value in self._cache.items()}
+        view._deleted = set(self._deleted)
+        view._added = {key: self._fork(value) for key, value in self._added.items()}
+        return view
+
+    @staticmethod
+    def _fork(value):
+        if isinstance(value, CopyOnWriteDict):
+            return value.copy()
+        return copy_json(value)
+
+    def to_dict(self) -> dict:
+        """
+        Materializes view into a plain dict.
+        """
+        return {
+            key: value.to_dict() if isinstance(value, CopyOnWriteDict) else copy_json(value)
+            for key, value in self.items()
+        }
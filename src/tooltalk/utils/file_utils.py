@@ -2,12 +2,28 @@
 Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
+import gzip
+import itertools
+import json
+import lzma
 import os
+import time
+import uuid
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+# suffixes of JSONL shards, one conversation per line, and how to open them
+JSONL_OPENERS = {
+    ".jsonl": open,
+    ".jsonl.gz": gzip.open,
+    ".jsonl.xz": lzma.open,
+}
+SHARD_PREFIX = "part-"
 
 
 def get_names_and_paths(input_path: str):
     if os.path.isdir(input_path):
-        files = os.listdir(input_path)
+        # skips hidden files, e.g. run manifests kept next to outputs
+        files = [name for name in os.listdir(input_path) if not name.startswith(".")]
         file_paths = [os.path.join(input_path, name) for name in files]
         file_names_and_paths = [(name, path) for name, path in zip(files, file_paths)]
         return file_names_and_paths
@@ -22,3 +38,120 @@ def chunkify(lst, n):
     for i in range(0, len(lst), n):
         chunks.append(lst[i:i + n])
     return chunks
+
+
+def iter_chunks(items: Iterable, n: int) -> Iterator[list]:
+    """
+    Same as chunkify, but for iterables that shouldn't be loaded into memory at once.
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, n))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_jsonl_suffix(path: str) -> Optional[str]:
+    for suffix in JSONL_OPENERS:
+        if path.endswith(suffix):
+            return suffix
+    return None
+
+
+def open_jsonl(path: str, mode: str = "rt"):
+    """
+    Opens JSONL shard in text mode, compressed according to its suffix.
+    """
+    opener = JSONL_OPENERS[get_jsonl_suffix(path) or ".jsonl"]
+    return opener(path, mode, encoding="utf-8")
+
+
+def get_conversation_file_name(conversation: dict) -> str:
+    # same name conversation would have as a single JSON file, so outputs of both formats can be matched up
+    return f"{conversation['name']}.json"
+
+
+def iter_conversations(input_path: str) -> Iterator[Tuple[str, dict]]:
+    """
+    Streams (file_name, conversation) pairs from a JSON file, a JSONL shard or a directory of either.
+    Shards are read line by line, conversations in them are named by get_conversation_file_name.
+    """
+    for name, path in get_names_and_paths(input_path):
+        if get_jsonl_suffix(path) is None:
+            with open(path, 'r', encoding='utf-8') as reader:
+                yield name, json.load(reader)
+            continue
+        with open_jsonl(path) as reader:
+            for line in reader:
+                if line.strip():
+                    conversation = json.loads(line)
+                    yield get_conversation_file_name(conversation), conversation
+
+
+class ShardedJsonlWriter:
+    """
+    Writes JSON lines into shards of at most shard_size lines in output_dir, compressed according to suffix.
+
+    Shards are written under a hidden name and renamed once complete, so readers never see partial shards.
+    on_commit is called with the shard name and the keys of lines written to it right before each rename, so lines
+    logged by it are never in a visible shard without their log entry, even if the process dies in between. Every writer
+    uses new shard names, so resumed runs never append to shards of earlier runs.
+    """
+    def __init__(
+            self,
+            output_dir: str,
+            shard_size: int = 1000,
+            suffix: str = ".jsonl",
+            on_commit: Callable[[str, List[str]], None] = None
+    ) -> None:
+        if suffix not in JSONL_OPENERS:
+            raise ValueError(f"Unknown JSONL suffix {suffix}, choose from {list(JSONL_OPENERS)}")
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.suffix = suffix
+        self.on_commit = on_commit
+        self.run_id = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.shard_index = 0
+        self.writer = None
+        self.keys = list()
+
+    def get_shard_name(self) -> str:
+        return f"{SHARD_PREFIX}{self.run_id}-{self.shard_index:05d}{self.suffix}"
+
+    def write(self, key: str, line: str) -> None:
+        if self.writer is None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self.writer = open_jsonl(os.path.join(self.output_dir, f".{self.get_shard_name()}"), "wt")
+        self.writer.write(line.rstrip("\n") + "\n")
+        self.keys.append(key)
+        if len(self.keys) >= self.shard_size:
+            self.commit()
+
+    def commit(self) -> None:
+        """
+        Completes current shard, if any lines were written to it.
+        """
+        if self.writer is None:
+            return
+        self.writer.close()
+        shard_name = self.get_shard_name()
+        keys = self.keys
+        self.writer = None
+        self.keys = list()
+        self.shard_index += 1
+        if self.on_commit is not None:
+            self.on_commit(shard_name, keys)
+        os.replace(
+            os.path.join(self.output_dir, f".{shard_name}"),
+            os.path.join(self.output_dir, shard_name)
+        )
+
+    def close(self) -> None:
+        self.commit()
+
+    def __enter__(self) -> "ShardedJsonlWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
@@ -0,0 +1,99 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE_NAME = ".manifest.jsonl"
+
+
+def hash_bytes(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class RunManifest:
+    """
+    Append-only JSONL log of finished conversations in an output directory, one line with file name, size,
+    content hash and metrics per written output file. Conversations written to JSONL shards also record the shard.
+    Resuming a run only needs to read this file instead of parsing every output.
+
+    Each entry is appended with a single write to a file opened in append mode, so worker processes can log to the same
+    manifest. Later entries for a file name replace earlier ones.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.output_dir = os.path.dirname(path)
+
+    @classmethod
+    def from_output_dir(cls, output_dir: str) -> "RunManifest":
+        return cls(os.path.join(output_dir, MANIFEST_FILE_NAME))
+
+    def load(self) -> Dict[str, dict]:
+        """
+        Returns latest entry of each file name, ignoring a partial last line left by an interrupted run.
+        """
+        entries = dict()
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'rb+') as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    # terminate partial line, so it doesn't swallow the next entry
+                    file.write(b"\n")
+        with open(self.path, 'r', encoding='utf-8') as reader:
+            for line_number, line in enumerate(reader, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping malformed line {line_number} of manifest {self.path}")
+                    continue
+                entries[entry["file_name"]] = entry
+        return entries
+
+    def append(self, file_name: str, content: bytes, metrics: Optional[dict], shard: Optional[str] = None) -> dict:
+        """
+        Logs output content written for file_name, returning the new entry.
+        """
+        entry = {
+            "file_name": file_name,
+            "size": len(content),
+            "sha256": hash_bytes(content),
+            "metrics": metrics,
+        }
+        if shard is not None:
+            entry["shard"] = shard
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        return entry
+
+    def clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def is_current(self, entry: dict) -> bool:
+        """
+        Checks entry still describes its output without reading it. Output files must have the logged size,
+        shards are only renamed into place once complete so they just have to exist.
+        """
+        if "shard" in entry:
+            return os.path.exists(os.path.join(self.output_dir, entry["shard"]))
+        try:
+            return os.path.getsize(os.path.join(self.output_dir, entry["file_name"])) == entry["size"]
+        except OSError:
+            return False
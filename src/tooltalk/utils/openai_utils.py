@@ -2,6 +2,7 @@
 Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
+import asyncio
 import logging
 import time
 from functools import wraps
@@ -24,5 +25,19 @@ def retry_on_limit(func, retries=5, wait=60):
     return wrapper
 
 
+def async_retry_on_limit(func, retries=5, wait=60):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        for i in range(retries):
+            try:
+                return await func(*args, **kwargs)
+            except openai.error.RateLimitError as error:
+                logger.info(str(error))
+                await asyncio.sleep(wait)
+        raise openai.error.RateLimitError
+    return wrapper
+
+
 openai_chat_completion = retry_on_limit(openai.ChatCompletion.create)
 openai_completion = retry_on_limit(openai.Completion.create)
+openai_chat_completion_async = async_retry_on_limit(openai.ChatCompletion.acreate)
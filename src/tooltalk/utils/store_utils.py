@@ -0,0 +1,189 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+
+def dump_canonical_json(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+class SQLiteStore:
+    """
+    Base of stores kept in a SQLite file with a write-ahead log, so worker processes can read and write it concurrently.
+    Subclasses set schema, a list of statements creating their tables.
+    """
+    schema: List[str] = list()
+
+    def __init__(self, path: str, timeout: float = 30.0) -> None:
+        self.path = path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connection_pid = None
+
+    def get_connection(self) -> sqlite3.Connection:
+        # connections can't be shared with forked processes, each process opens its own
+        if self.connection is None or self.connection_pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                for statement in self.schema:
+                    connection.execute(statement)
+            self.connection = connection
+            self.connection_pid = os.getpid()
+        return self.connection
+
+    def close(self) -> None:
+        if self.connection is not None and self.connection_pid == os.getpid():
+            self.connection.close()
+        self.connection = None
+
+
+class ContentStore(SQLiteStore):
+    """
+    Content-addressed store of JSON values in a SQLite file. Values are keyed by a hash of their canonical JSON,
+    so every distinct value is only stored once however often it is put.
+
+    Lists that grow by appending, e.g. chat histories, can be stored as chains of nodes each referencing the key of
+    its prefix, so storing the next version of a list only adds nodes for the new items.
+
+    Puts are buffered until flush, which writes them in one transaction. Worker processes can share a store.
+    """
+    schema = ["CREATE TABLE IF NOT EXISTS objects (key TEXT PRIMARY KEY, value TEXT NOT NULL)"]
+
+    def __init__(self, path: str, timeout: float = 30.0, known_size: int = 65536) -> None:
+        super().__init__(path, timeout)
+        self.known_size = known_size
+        # keys recently flushed by this process, skipped by put
+        self.known = OrderedDict()
+        self.pending = dict()
+
+    @staticmethod
+    def get_key(canonical_json: str) -> str:
+        return hashlib.sha256(canonical_json.encode("utf-8")).hexdigest()
+
+    def put(self, value: Any) -> str:
+        """
+        Queues value to be stored, returning its key.
+        """
+        canonical_json = dump_canonical_json(value)
+        key = self.get_key(canonical_json)
+        with self.lock:
+            if key in self.known:
+                self.known.move_to_end(key)
+            else:
+                self.pending[key] = canonical_json
+        return key
+
+    def put_list(self, items: List[Any]) -> Optional[str]:
+        """
+        Queues items to be stored as a chain, returning key of its last node or None if there are no items.
+        """
+        key = None
+        for item in items:
+            key = self.put({"prefix": key, "item": item})
+        return key
+
+    def flush(self) -> None:
+        """
+        Writes queued values, keys returned by put can be read from other processes afterward.
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            connection = self.get_connection()
+            with connection:
+                connection.executemany("INSERT OR IGNORE INTO objects VALUES (?, ?)", self.pending.items())
+            for key in self.pending:
+                self.known[key] = None
+            self.pending = dict()
+            while len(self.known) > self.known_size:
+                self.known.popitem(last=False)
+
+    def get(self, key: str) -> Any:
+        with self.lock:
+            canonical_json = self.pending.get(key)
+            if canonical_json is None:
+                row = self.get_connection().execute("SELECT value FROM objects WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    raise KeyError(key)
+                canonical_json = row[0]
+        return json.loads(canonical_json)
+
+    def get_list(self, key: Optional[str]) -> List[Any]:
+        """
+        Reads items of chain ending in node with key.
+        """
+        items = list()
+        while key is not None:
+            node = self.get(key)
+            items.append(node["item"])
+            key = node["prefix"]
+        items.reverse()
+        return items
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            if key in self.pending:
+                return True
+            return self.get_connection().execute("SELECT 1 FROM objects WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.get_connection().execute("SELECT COUNT(*) FROM objects").fetchone()[0]
+
+    def close(self) -> None:
+        self.flush()
+        super().close()
+
+
+class ResponseCache(SQLiteStore):
+    """
+    Recorded responses keyed by a hash of the canonical JSON of their request, e.g. chat completion arguments
+    including model, messages, functions and sampling parameters.
+    """
+    schema = [
+        "CREATE TABLE IF NOT EXISTS responses "
+        "(key TEXT PRIMARY KEY, request TEXT NOT NULL, response TEXT NOT NULL, recorded REAL NOT NULL)"
+    ]
+
+    @staticmethod
+    def get_key(request: dict) -> str:
+        return ContentStore.get_key(dump_canonical_json(request))
+
+    def get(self, request: dict) -> Optional[Any]:
+        """
+        Returns response recorded for request, None if there is none.
+        """
+        with self.lock:
+            row = self.get_connection().execute(
+                "SELECT response FROM responses WHERE key = ?", (self.get_key(request),)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, request: dict, response: Any) -> None:
+        """
+        Records response of request, replacing any recorded before.
+        """
+        row = (self.get_key(request), dump_canonical_json(request), json.dumps(response), time.time())
+        with self.lock:
+            connection = self.get_connection()
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", row)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.get_connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
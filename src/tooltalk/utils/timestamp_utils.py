@@ -0,0 +1,48 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+
+Fast parsing of the fixed timestamp formats used by APIs and the ToolExecutor.
+"""
+import re
+from datetime import datetime
+from functools import lru_cache
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATE_FORMAT = "%Y-%m-%d"
+TIME_FORMAT = "%H:%M:%S"
+
+_LAYOUTS = {
+    TIMESTAMP_FORMAT: re.compile(r"(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})", re.ASCII),
+    DATE_FORMAT: re.compile(r"(\d{4})-(\d{2})-(\d{2})", re.ASCII),
+    TIME_FORMAT: re.compile(r"(\d{2}):(\d{2}):(\d{2})", re.ASCII),
+}
+
+
+def parse_datetime(value: str, date_format: str = TIMESTAMP_FORMAT) -> datetime:
+    """
+    Same as datetime.strptime(value, date_format), including error messages, but much faster for zero padded values
+    of the supported formats. Results are memoized, datetimes are immutable so they can be shared.
+    """
+    if not isinstance(value, str) or not isinstance(date_format, str):
+        # invalid arguments, e.g. from model predictions, raise the same errors as strptime
+        return datetime.strptime(value, date_format)
+    return _parse_datetime(value, date_format)
+
+
+@lru_cache(maxsize=8192)
+def _parse_datetime(value: str, date_format: str) -> datetime:
+    layout = _LAYOUTS.get(date_format)
+    match = layout.fullmatch(value) if layout is not None else None
+    if match is not None:
+        fields = [int(field) for field in match.groups()]
+        if date_format == TIME_FORMAT:
+            # strptime defaults to 1900-01-01 when only time is given
+            fields = [1900, 1, 1] + fields
+        try:
+            return datetime(*fields)
+        except ValueError:
+            # out of range fields, let strptime raise its own error
+            pass
+    return datetime.strptime(value, date_format)
+
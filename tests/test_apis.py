@@ -0,0 +1,392 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import gc
+import itertools
+import json
+import os
+import weakref
+from datetime import date, datetime, timedelta
+from random import Random
+
+import pytest
+
+from tooltalk.apis.account import GetAccountInformation, LogoutUser, QueryUser, UpdateAccountInformation, UserLogin
+from tooltalk.apis.api import build_session_index
+from tooltalk.apis.calendar import CreateEvent, DeleteEvent, QueryCalendar
+from tooltalk.apis.email import EmailIndex
+from tooltalk.evaluation.tool_executor import ToolExecutor
+
+DATABASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "databases")
+TIMESTAMP = "2023-09-10 09:00:00"
+
+
+@pytest.fixture
+def tool_executor():
+    tool_executor = ToolExecutor(init_database_dir=DATABASE_DIR)
+    tool_executor.init_conversation_state({"timestamp": TIMESTAMP}, list(), dict())
+    return tool_executor
+
+
+def test_session_index(tool_executor):
+    account_database = tool_executor.databases["Account"]
+
+    def assert_index_in_sync():
+        assert tool_executor.session_index == build_session_index(account_database)
+
+    _, response = tool_executor.execute_tool("UserLogin", {"username": "justinkool", "password": "justforkicks123"})
+    session_token = response["response"]["session_token"]
+    assert tool_executor.session_index == {session_token: "justinkool"}
+    assert_index_in_sync()
+    _, response = tool_executor.execute_tool("GetAccountInformation", {})
+    assert response["response"]["user"]["username"] == "justinkool"
+
+    tool_executor.execute_tool("LogoutUser", {})
+    assert tool_executor.session_index == dict()
+    assert_index_in_sync()
+    tool = tool_executor.get_init_tool("GetAccountInformation")
+    assert tool(session_token=session_token)["exception"] == "Invalid session_token."
+    # logged out users have no token, missing tokens don't match them
+    assert tool(session_token=None)["exception"] == "Invalid session_token."
+
+    _, response = tool_executor.execute_tool("RegisterUser", {
+        "username": "newuser", "password": "password", "email": "new@fmail.com"
+    })
+    session_token = response["response"]["session_token"]
+    assert tool_executor.session_index == {session_token: "newuser"}
+    assert_index_in_sync()
+    tool_executor.execute_tool("DeleteAccount", {"password": "password"})
+    assert tool_executor.session_index == dict()
+    assert_index_in_sync()
+    assert tool(session_token=session_token)["exception"] == "Invalid session_token."
+
+    # conversations starting logged in set the token through the index
+    tool_executor.init_conversation_state(
+        {"timestamp": TIMESTAMP}, list(), {"username": "decture", "session_token": "token"}
+    )
+    account_database = tool_executor.databases["Account"]
+    assert tool_executor.session_index == {"token": "decture"}
+    assert_index_in_sync()
+    _, response = tool_executor.execute_tool("GetAccountInformation", {})
+    assert response["response"]["user"]["username"] == "decture"
+
+    # only the index is consulted, tokens written to the database directly are not picked up
+    account_database["justinkool"]["session_token"] = "direct"
+    tool = tool_executor.get_init_tool("GetAccountInformation")
+    assert tool(session_token="direct")["exception"] == "Invalid session_token."
+
+
+def load_database(name: str) -> dict:
+    with open(os.path.join(DATABASE_DIR, f"{name}.json"), 'r', encoding='utf-8') as reader:
+        return json.load(reader)
+
+
+def test_shared_session_index():
+    # tools constructed outside ToolExecutor see each other's logins when given the same session index
+    account_database = load_database("Account")
+    session_index = build_session_index(account_database)
+    login_tool = UserLogin(account_database, TIMESTAMP, session_index=session_index)
+    info_tool = GetAccountInformation(account_database, TIMESTAMP, session_index=session_index)
+    response = login_tool(username="justinkool", password="justforkicks123")
+    session_token = response["response"]["session_token"]
+    assert info_tool(session_token=session_token)["response"]["user"]["username"] == "justinkool"
+    LogoutUser(account_database, TIMESTAMP, session_index=session_index)(session_token=session_token)
+    assert info_tool(session_token=session_token)["exception"] == "Invalid session_token."
+
+
+def test_tools_release_databases():
+    # indexes of tools constructed directly live on the tools, nothing keeps their databases alive after them
+    class Database(dict):
+        pass
+
+    account_database = Database(load_database("Account"))
+    calendar_database = Database(load_database("Calendar"))
+    references = [weakref.ref(account_database), weakref.ref(calendar_database)]
+    tool = QueryCalendar(account_database, TIMESTAMP, calendar_database)
+    assert tool.session_index == build_session_index(account_database)
+    del tool, account_database, calendar_database
+    gc.collect()
+    assert all(reference() is None for reference in references)
+
+
+def login(tool_executor, username="justinkool", password="justforkicks123"):
+    tool_executor.execute_tool("UserLogin", {"username": username, "password": password})
+
+
+def test_query_calendar_index(tool_executor):
+    login(tool_executor)
+    rng = Random(0)
+    event_ids = list()
+    for _ in range(200):
+        action = rng.random()
+        if action < 0.6 or not event_ids:
+            start = datetime(2023, 9, 11) + timedelta(hours=rng.randint(0, 24 * 30))
+            end = start + timedelta(hours=rng.choice([0, 1, 2, 48]))
+            _, response = tool_executor.execute_tool("CreateEvent", {
+                "name": "event", "event_type": "event",
+                "start_time": start.strftime("%Y-%m-%d %H:%M:%S"), "end_time": end.strftime("%Y-%m-%d %H:%M:%S"),
+            })
+            event_ids.append(response["response"]["event_id"])
+        elif action < 0.8:
+            start = datetime(2023, 9, 11) + timedelta(hours=rng.randint(0, 24 * 30))
+            end = start + timedelta(hours=rng.randint(0, 5))
+            tool_executor.execute_tool("ModifyEvent", {
+                "event_id": rng.choice(event_ids),
+                "new_start_time": start.strftime("%Y-%m-%d %H:%M:%S"),
+                "new_end_time": end.strftime("%Y-%m-%d %H:%M:%S"),
+            })
+        else:
+            event_id = event_ids.pop(rng.randrange(len(event_ids)))
+            tool_executor.execute_tool("DeleteEvent", {"event_id": event_id})
+
+    calendar = tool_executor.databases["Calendar"]["justinkool"]
+    for _ in range(100):
+        start = datetime(2023, 9, 1) + timedelta(hours=rng.randint(0, 24 * 45))
+        end = start + timedelta(hours=rng.randint(0, 72))
+        _, response = tool_executor.execute_tool("QueryCalendar", {
+            "start_time": start.strftime("%Y-%m-%d %H:%M:%S"), "end_time": end.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        expected = list()
+        for event in calendar.values():
+            event_start = datetime.strptime(event["start_time"], "%Y-%m-%d %H:%M:%S")
+            event_end = datetime.strptime(event["end_time"], "%Y-%m-%d %H:%M:%S")
+            if start <= event_start <= end or start <= event_end <= end or (event_start <= start and event_end >= end):
+                expected.append(event)
+        assert response["response"]["events"] == expected
+
+
+def test_query_calendar_long_event(tool_executor):
+    login(tool_executor)
+
+    def create_event(start, end):
+        _, response = tool_executor.execute_tool("CreateEvent", {
+            "name": "event", "event_type": "event",
+            "start_time": start.strftime("%Y-%m-%d %H:%M:%S"), "end_time": end.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        return response["response"]["event_id"]
+
+    def query(start, end):
+        _, response = tool_executor.execute_tool("QueryCalendar", {
+            "start_time": start.strftime("%Y-%m-%d %H:%M:%S"), "end_time": end.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        return [event["event_id"] for event in response["response"]["events"]]
+
+    # one long event among many short ones
+    first_day = datetime(2023, 10, 1)
+    long_event_id = create_event(first_day, first_day + timedelta(days=60))
+    short_event_ids = [
+        create_event(first_day + timedelta(hours=2 * i), first_day + timedelta(hours=2 * i, minutes=30))
+        for i in range(500)
+    ]
+    start = first_day + timedelta(days=20, minutes=10)
+    assert query(start, start + timedelta(hours=3)) == [long_event_id] + short_event_ids[240:242]
+
+    # short events are searched separately, only as far back as the longest of them
+    user_events = tool_executor.indexes[tool_executor.apis["QueryCalendar"].index_class].users["justinkool"]
+    short_bucket = max(user_events.buckets, key=lambda bucket: len(user_events.buckets[bucket][1]))
+    assert len(user_events.buckets[short_bucket][1]) >= 500
+    assert timedelta(seconds=2 ** short_bucket) < timedelta(hours=1)
+
+    # removing the long event drops its bucket
+    tool_executor.execute_tool("DeleteEvent", {"event_id": long_event_id})
+    assert query(start, start + timedelta(hours=3)) == short_event_ids[240:242]
+    assert all(timedelta(seconds=2 ** bucket) < timedelta(days=1) for bucket in user_events.buckets)
+
+
+def test_shared_calendar_index():
+    # tools constructed outside ToolExecutor see each other's writes when given the same indexes
+    account_database = load_database("Account")
+    calendar_database = load_database("Calendar")
+    indexes = {
+        "session_index": build_session_index(account_database),
+        "api_index": CreateEvent.index_class(calendar_database),
+    }
+    response = UserLogin(account_database, TIMESTAMP, session_index=indexes["session_index"])(
+        username="justinkool", password="justforkicks123"
+    )
+    session_token = response["response"]["session_token"]
+    response = CreateEvent(account_database, TIMESTAMP, calendar_database, **indexes)(
+        session_token=session_token, name="standup", event_type="event",
+        start_time="2023-10-02 09:00:00", end_time="2023-10-02 09:30:00",
+    )
+    event_id = response["response"]["event_id"]
+    query_calendar = QueryCalendar(account_database, TIMESTAMP, calendar_database, **indexes)
+    response = query_calendar(session_token=session_token, start_time="2023-10-02 00:00:00",
+                              end_time="2023-10-02 23:59:59")
+    assert [event["event_id"] for event in response["response"]["events"]] == [event_id]
+
+    DeleteEvent(account_database, TIMESTAMP, calendar_database, **indexes)(
+        session_token=session_token, event_id=event_id
+    )
+    response = query_calendar(session_token=session_token, start_time="2023-10-02 00:00:00",
+                              end_time="2023-10-02 23:59:59")
+    assert response["response"]["events"] == list()
+
+    # without an api_index every tool indexes its own database
+    assert QueryCalendar(account_database, TIMESTAMP).index is not QueryCalendar(account_database, TIMESTAMP).index
+
+
+def test_find_alarms_index(tool_executor):
+    login(tool_executor)
+    rng = Random(0)
+    alarm_ids = list()
+    for _ in range(200):
+        if rng.random() < 0.7 or not alarm_ids:
+            time = f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.choice([0, 30]):02d}"
+            _, response = tool_executor.execute_tool("AddAlarm", {"time": time})
+            alarm_ids.append(response["response"]["alarm_id"])
+        else:
+            alarm_id = alarm_ids.pop(rng.randrange(len(alarm_ids)))
+            tool_executor.execute_tool("DeleteAlarm", {"alarm_id": alarm_id})
+
+    alarms = tool_executor.databases["Alarm"]["justinkool"]
+    for _ in range(100):
+        start = datetime(1900, 1, 1) + timedelta(minutes=rng.randint(0, 24 * 60 - 1))
+        end = start + timedelta(minutes=rng.randint(0, 120))
+        start_range = rng.choice([None, start.strftime("%H:%M:%S")])
+        end_range = rng.choice([None, min(end, datetime(1900, 1, 1, 23, 59, 59)).strftime("%H:%M:%S")])
+        parameters = {"start_range": start_range, "end_range": end_range}
+        _, response = tool_executor.execute_tool("FindAlarms", {k: v for k, v in parameters.items() if v is not None})
+        expected = [
+            alarm for alarm in alarms.values()
+            if (start_range is None or alarm["time"] >= start_range) and (end_range is None or alarm["time"] <= end_range)
+        ]
+        assert response["response"]["alarms"] == expected
+
+
+def test_search_index():
+    rng = Random(0)
+    words = ["meeting", "Lunch", "project", "aiden", "deadline", "re:", "hi", "a", "budget", "TPS report"]
+    senders = ["alice@fmail.com", "bob@fmail.com"]
+    emails = dict()
+    for i in range(300):
+        date = datetime(2023, 9, 1) + timedelta(hours=rng.randint(0, 24 * 10))
+        emails[f"email-{i}"] = {
+            "sender": rng.choice(senders),
+            "subject": " ".join(rng.choices(words, k=2)),
+            "body": " ".join(rng.choices(words, k=rng.randint(0, 6))),
+            "date": date.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+    email_index = EmailIndex({"user": emails})
+    now_timestamp = datetime(2023, 9, 8)
+    queries = [None, "meeting", "lunch project", "a", "hi aiden", "tps", "ting lun", "missing", "re: budget", "ai"]
+    for query in queries:
+        keywords = query.lower().split() if query else None
+        for match_type, sender, start_date, end_date in itertools.product(
+                ["any", "all"], [None] + senders, [None, datetime(2023, 9, 3)], [None, datetime(2023, 9, 5)]
+        ):
+            expected = list()
+            for key, email in emails.items():
+                email_date = datetime.strptime(email["date"], "%Y-%m-%d %H:%M:%S")
+                if now_timestamp < email_date or (sender is not None and sender != email["sender"]):
+                    continue
+                if (start_date is not None and start_date > email_date) or (end_date is not None and end_date < email_date):
+                    continue
+                if keywords is not None:
+                    keyword_matches = [
+                        keyword in email["body"].lower() or keyword in email["subject"].lower() for keyword in keywords
+                    ]
+                    if not (any(keyword_matches) if match_type == "any" else all(keyword_matches)):
+                        continue
+                expected.append(key)
+            expected.sort(key=lambda key: datetime.strptime(emails[key]["date"], "%Y-%m-%d %H:%M:%S"), reverse=True)
+            keys = email_index.search("user", now_timestamp, keywords, match_type, sender, start_date, end_date)
+            assert keys == expected[:5], (query, match_type, sender, start_date, end_date)
+    assert email_index.search("nobody", now_timestamp, ["meeting"]) == list()
+
+
+def test_retrieval_responses_are_frozen(tool_executor):
+    login(tool_executor)
+    _, response = tool_executor.execute_tool("AddReminder", {"task": "buy milk"})
+    reminder_id = response["response"]["reminder_id"]
+    _, response = tool_executor.execute_tool("GetReminders", {})
+    reminder = next(r for r in response["response"]["reminders"] if r["reminder_id"] == reminder_id)
+    assert reminder == {"reminder_id": reminder_id, "task": "buy milk", "due_date": None, "status": "pending"}
+    with pytest.raises(TypeError):
+        reminder["status"] = "complete"
+
+    tool_executor.execute_tool("CompleteReminder", {"reminder_id": reminder_id})
+    assert reminder["status"] == "pending"
+    assert tool_executor.databases["Reminder"]["justinkool"][reminder_id]["status"] == "complete"
+
+    _, response = tool_executor.execute_tool("QueryCalendar", {
+        "start_time": "2023-09-01 00:00:00", "end_time": "2023-10-01 00:00:00",
+    })
+    event = response["response"]["events"][0]
+    with pytest.raises(TypeError):
+        event["attendees"].append("intruder")
+    tool_executor.execute_tool("ModifyEvent", {"event_id": event["event_id"], "new_name": "renamed"})
+    assert event["name"] != "renamed"
+    assert tool_executor.databases["Calendar"]["justinkool"][event["event_id"]]["name"] == "renamed"
+
+
+def test_query_user_email_index(tool_executor):
+    def query_email(email):
+        _, response = tool_executor.execute_tool("QueryUser", {"email": email})
+        return [user["username"] for user in response["response"]["users"]]
+
+    def expected_usernames(email):
+        return [username for username, user in tool_executor.databases["Account"].items() if user["email"] == email]
+
+    email = tool_executor.databases["Account"]["justinkool"]["email"]
+
+    # register, update and delete other users sharing the email
+    tool_executor.execute_tool("RegisterUser", {"username": "clone1", "password": "pw", "email": email})
+    assert query_email(email) == expected_usernames(email) == ["justinkool", "clone1"]
+    tool_executor.execute_tool("LogoutUser", {})
+    tool_executor.execute_tool("RegisterUser", {"username": "clone2", "password": "pw", "email": "other@fmail.com"})
+    tool_executor.execute_tool("UpdateAccountInformation", {"password": "pw", "new_email": email})
+    assert query_email(email) == expected_usernames(email) == ["justinkool", "clone1", "clone2"]
+    assert query_email("other@fmail.com") == list()
+
+    tool_executor.execute_tool("LogoutUser", {})
+    login(tool_executor, "clone1", "pw")
+    tool_executor.execute_tool("DeleteAccount", {"password": "pw"})
+    login(tool_executor)
+    assert query_email(email) == expected_usernames(email) == ["justinkool", "clone2"]
+
+    # resetting restores initial index
+    tool_executor.reset_executor()
+    tool_executor.init_conversation_state({"timestamp": TIMESTAMP}, list(), dict())
+    login(tool_executor)
+    assert query_email(email) == ["justinkool"]
+
+
+def test_shared_account_index():
+    # tools constructed outside ToolExecutor see each other's email updates when given the same indexes
+    account_database = load_database("Account")
+    indexes = {
+        "session_index": build_session_index(account_database),
+        "api_index": QueryUser.index_class(account_database),
+    }
+    old_email = account_database["justinkool"]["email"]
+    response = UserLogin(account_database, TIMESTAMP, **indexes)(username="justinkool", password="justforkicks123")
+    session_token = response["response"]["session_token"]
+    query_user = QueryUser(account_database, TIMESTAMP, **indexes)
+    users = query_user(session_token=session_token, email=old_email)["response"]["users"]
+    assert [user["username"] for user in users] == ["justinkool"]
+
+    UpdateAccountInformation(account_database, TIMESTAMP, **indexes)(
+        session_token=session_token, password="justforkicks123", new_email="new@fmail.com"
+    )
+    assert query_user(session_token=session_token, email=old_email)["response"]["users"] == list()
+    users = query_user(session_token=session_token, email="new@fmail.com")["response"]["users"]
+    assert [(user["username"], user["email"]) for user in users] == [("justinkool", "new@fmail.com")]
+
+
+def test_weather_index(tool_executor):
+    weather = tool_executor.databases["Weather"]["london"]
+    _, response = tool_executor.execute_tool("CurrentWeather", {"location": "London"})
+    assert response["response"]["weather"] == weather["2023-09-10"]
+    _, response = tool_executor.execute_tool("ForecastWeather", {"location": " london"})
+    assert response["response"]["forecast"] == [weather[date] for date in ["2023-09-11", "2023-09-12", "2023-09-13"]]
+    _, response = tool_executor.execute_tool("HistoricWeather", {"location": "london", "month": "September"})
+    assert response["response"]["weather"] == tool_executor.databases["HistoricWeather"]["london"]["september"]
+
+    # indexes are shared across resets, missing days raise like a dict lookup would
+    index = tool_executor.indexes[tool_executor.apis["CurrentWeather"].index_class]
+    tool_executor.reset_executor()
+    assert tool_executor.indexes[tool_executor.apis["CurrentWeather"].index_class] is index
+    with pytest.raises(KeyError, match=r"datetime\.date\(2023, 9, 30\)"):
+        index.locations["london"][date(2023, 9, 30)]
@@ -0,0 +1,191 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from tooltalk.apis import utils
+from tooltalk.utils.cache_utils import EmbeddingCache
+
+
+class WordCountVectorizer:
+    """
+    Stands in for sent2vec Vectorizer, tokens are words and vectors count a few letters.
+    """
+    class Tokenizer:
+        @staticmethod
+        def encode(text, add_special_tokens=True):
+            return text.split()
+
+    def __init__(self):
+        self.vectorizer = self
+        self.tokenizer = self.Tokenizer()
+        self.vectors = list()
+        self.batches = list()
+
+    def run(self, sentences):
+        self.batches.append(sentences)
+        self.vectors.extend(np.array([text.count(c) + 1 for c in "aeiost"], dtype=np.float32) for text in sentences)
+
+
+@pytest.fixture
+def vectorizer(monkeypatch):
+    text_vectorizer = utils._TextVectorizer(batch_size=2, cache_size=4)
+    text_vectorizer.vectorizer = WordCountVectorizer()
+    monkeypatch.setattr(utils, "_vectorize_text", text_vectorizer)
+    monkeypatch.setattr(utils, "_semantic_scores", utils.ScoreCache())
+    return text_vectorizer
+
+
+def test_precompute_semantic_scores(vectorizer):
+    pairs = [("a b", "c d"), ("set a timer", "c d"), ("a b", "set the timer"), ("e f", "tests"), ("c d", "a b")]
+    utils.precompute_semantic_scores(pairs)
+
+    # texts are embedded once, in batches of equal token count
+    batches = vectorizer.vectorizer.batches
+    assert sorted(text for batch in batches for text in batch) == sorted({text for pair in pairs for text in pair})
+    assert all(len(batch) <= 2 and len({len(text.split()) for text in batch}) == 1 for batch in batches)
+
+    for prediction_text, ground_truth_text in pairs:
+        prediction_vec = vectorizer(prediction_text)
+        ground_truth_vec = vectorizer(ground_truth_text)
+        expected = np.dot(prediction_vec, ground_truth_vec) / (np.linalg.norm(prediction_vec) * np.linalg.norm(ground_truth_vec))
+        assert utils.semantic_str_compare(prediction_text, ground_truth_text) == pytest.approx(expected)
+        assert utils.semantic_str_compare(ground_truth_text, prediction_text) == pytest.approx(expected)
+    assert len(vectorizer.cache) == 4
+    assert utils.semantic_str_compare(None, "a b") == 0.0
+
+
+def test_embedding_cache_skips_model(vectorizer, tmp_path):
+    embedding_cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    vectorizer.embedding_cache = embedding_cache
+    texts = ["a b", "set a timer", "tests"]
+    expected = vectorizer.embed(texts)
+    assert len(embedding_cache) == 3
+
+    # fresh vectorizer, e.g. in a later run, reads vectors from disk without running the model
+    rerun_vectorizer = utils._TextVectorizer(embedding_cache=EmbeddingCache(str(tmp_path / "embeddings.sqlite")))
+    rerun_vectorizer.load_model = None
+    np.testing.assert_array_equal(rerun_vectorizer.embed(texts), expected)
+
+
+def test_ngram_backend(monkeypatch):
+    monkeypatch.setattr(utils, "_semantic_scores", utils.ScoreCache())
+    monkeypatch.setattr(utils, "_vectorize_text", None)
+    monkeypatch.setattr(utils, "_similarity_backend", "sent2vec")
+    utils.set_similarity_backend("ngram")
+    assert utils.semantic_str_compare("Team meeting", "team meeting with John") > utils.semantic_str_compare(
+        "Buy milk", "call mom"
+    )
+    with pytest.raises(ValueError):
+        utils.set_similarity_backend("missing")
+    utils.set_similarity_backend("sent2vec")
+    assert len(utils._semantic_scores) == 0
+
+
+# (prediction, ground truth) pairs of semantic parameters like in the dataset, from paraphrases to unrelated texts
+CALIBRATION_PAIRS = [
+    ("Buy milk", "Buy milk and eggs"),
+    ("Team meeting", "team meeting with John"),
+    ("Call mom", "Call my mother"),
+    ("Pick up the dry cleaning", "Pick up dry cleaning"),
+    ("Dentist appointment", "Appointment with the dentist"),
+    ("Running late, be there in 10", "I'm running late, I'll be there in 10 minutes"),
+    ("Project update", "Update on the project"),
+    ("Lunch with Alice", "Dinner with Bob"),
+    ("Buy milk", "call mom"),
+    ("Quarterly review", "Annual performance review"),
+    ("Conference Room B", "Conference room A"),
+    ("Send the report to Sarah", "Email Sarah the weekly report"),
+    ("Happy birthday!", "Congratulations on the new job"),
+    ("Renew passport", "Renew car registration"),
+]
+
+
+def test_calibrate_ngram_thresholds():
+    # reference scores of a backend agreeing exactly with some n-gram thresholds are matched perfectly
+    expected = {0.8: 0.3, 0.9: 0.6}
+    reference_scores = utils.get_similarity_scores(utils._NgramVectorizer(thresholds=expected), CALIBRATION_PAIRS)
+    ngram_thresholds = utils.calibrate_ngram_thresholds(CALIBRATION_PAIRS, reference_scores)
+    backend = utils._NgramVectorizer(thresholds=ngram_thresholds)
+    assert utils.get_threshold_agreement(CALIBRATION_PAIRS, reference_scores, backend) == {0.8: 1.0, 0.9: 1.0}
+    default_agreement = utils.get_threshold_agreement(CALIBRATION_PAIRS, reference_scores, utils._NgramVectorizer())
+    assert all(agreement < 1.0 for agreement in default_agreement.values())
+
+
+# pairs scored by sent2vec, written by src/scripts/calibrate_ngram_thresholds.py --scores_path
+SENT2VEC_SCORES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sent2vec_pair_scores.jsonl")
+
+
+def test_ngram_thresholds_are_calibrated():
+    if not os.path.exists(SENT2VEC_SCORES_PATH):
+        pytest.skip("no sent2vec scores of dataset pairs committed yet, NGRAM_THRESHOLDS are uncalibrated")
+    with open(SENT2VEC_SCORES_PATH, 'r', encoding='utf-8') as reader:
+        lines = [json.loads(line) for line in reader if line.strip()]
+    pairs = [(line["prediction"], line["ground_truth"]) for line in lines]
+    ngram_thresholds = utils.calibrate_ngram_thresholds(pairs, [line["score"] for line in lines])
+    assert ngram_thresholds == pytest.approx(utils.NGRAM_THRESHOLDS)
+
+
+def test_calibrate_ngram_thresholds_agreement(vectorizer):
+    # no n-gram cutoff agrees better with a reference backend measuring something else than the calibrated ones
+    thresholds = (0.95, 0.98)
+    reference_scores = utils.get_similarity_scores(vectorizer, CALIBRATION_PAIRS)
+    ngram_thresholds = utils.calibrate_ngram_thresholds(CALIBRATION_PAIRS, reference_scores, thresholds)
+    assert 0.0 < ngram_thresholds[0.95] <= ngram_thresholds[0.98] < 1.0
+    agreement = utils.get_threshold_agreement(
+        CALIBRATION_PAIRS, reference_scores, utils._NgramVectorizer(thresholds=ngram_thresholds), thresholds
+    )
+    for threshold in thresholds:
+        for cutoff in np.linspace(0.01, 0.99, 99):
+            backend = utils._NgramVectorizer(thresholds={threshold: cutoff})
+            other_agreement = utils.get_threshold_agreement(CALIBRATION_PAIRS, reference_scores, backend, [threshold])
+            assert agreement[threshold] >= other_agreement[threshold]
+
+
+def test_semantic_str_compare_shortcuts(vectorizer):
+    assert utils.semantic_str_compare("Set a timer", "Set a timer") == 1.0
+    assert utils.semantic_str_compare("Set a  timer ", "set a timer") == 1.0
+    utils.precompute_semantic_scores([("Set a timer", "set a timer")])
+    assert vectorizer.vectorizer.batches == []
+    assert len(utils._semantic_scores) == 0
+    assert utils.get_semantic_cache_stats()["shortcuts"] == 2
+
+
+def test_score_cache(vectorizer, monkeypatch):
+    monkeypatch.setattr(utils, "_semantic_scores", utils.ScoreCache(max_size=2))
+    score = utils.semantic_str_compare("a b", "c d")
+    # pair is unordered, both orders share one entry
+    assert utils.semantic_str_compare("c d", "a b") == score
+    assert len(utils._semantic_scores) == 1
+    assert utils.get_semantic_cache_stats()["hits"] == 1
+
+    utils.precompute_semantic_scores([("e f", "tests"), ("set a timer", "a b")])
+    assert len(utils._semantic_scores) == 2
+    assert ("a b", "c d") not in utils._semantic_scores
+    # evicted pairs are scored again on demand
+    assert utils.semantic_str_compare("a b", "c d") == score
+    stats = utils.get_semantic_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 2, 2)
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
+
+
+def test_import_apis_is_lazy():
+    # fresh interpreter, modules imported by other tests are already cached here
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import tooltalk.apis\n"
+        "print(time.perf_counter() - start)\n"
+        "print(','.join(m for m in ('numpy', 'sent2vec', 'torch', 'transformers') if m in sys.modules))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    seconds, heavy_modules = output.splitlines()
+    assert heavy_modules == ""
+    assert float(seconds) < 0.5
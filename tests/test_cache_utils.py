@@ -0,0 +1,76 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import multiprocessing
+import sqlite3
+
+import numpy as np
+
+from tooltalk.utils.cache_utils import EmbeddingCache
+
+
+def get_vector(text: str) -> np.ndarray:
+    return np.arange(4, dtype=np.float32) + len(text)
+
+
+def put_and_get(path: str, worker: int) -> bool:
+    embedding_cache = EmbeddingCache(path)
+    texts = [f"text {worker} {i}" for i in range(20)] + ["shared"]
+    embedding_cache.put_many({text: get_vector(text) for text in texts})
+    vectors = embedding_cache.get_many(texts)
+    return all(np.array_equal(vectors[text], get_vector(text)) for text in texts)
+
+
+def test_embedding_cache(tmp_path):
+    path = str(tmp_path / "cache" / "embeddings.sqlite")
+    # access times refreshed on every read, so eviction order is exact
+    embedding_cache = EmbeddingCache(path, namespace="model", max_entries=3, refresh_interval=0)
+    embedding_cache.put_many({text: get_vector(text) for text in ["a", "bb", "ccc"]})
+    vectors = embedding_cache.get_many(["a", "bb", "missing"])
+    assert set(vectors) == {"a", "bb"}
+    np.testing.assert_array_equal(vectors["bb"], get_vector("bb"))
+
+    # "ccc" was accessed least recently, so it is evicted first
+    embedding_cache.put_many({"dddd": get_vector("dddd")})
+    assert len(embedding_cache) == 3
+    assert set(embedding_cache.get_many(["a", "bb", "ccc", "dddd"])) == {"a", "bb", "dddd"}
+
+    # namespaces don't share vectors
+    assert EmbeddingCache(path, namespace="other").get_many(["a"]) == dict()
+
+
+def test_embedding_cache_processes(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    with multiprocessing.Pool(4) as pool:
+        assert all(pool.starmap(put_and_get, [(path, worker) for worker in range(8)]))
+    assert len(EmbeddingCache(path)) == 8 * 20 + 1
+
+
+def test_embedding_cache_reads_without_writing(tmp_path):
+    embedding_cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    embedding_cache.put_many({text: get_vector(text) for text in ["a", "bb"]})
+    connection = embedding_cache.get_connection()
+    changes = connection.total_changes
+    # recently accessed vectors are read without refreshing their access time
+    assert set(embedding_cache.get_many(["a", "bb"])) == {"a", "bb"}
+    assert connection.total_changes == changes
+
+
+def test_embedding_cache_counts_legacy_file(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    # caches written before entries were counted only have the embeddings table
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute(EmbeddingCache.schema[0])
+        connection.executemany("INSERT INTO embeddings VALUES (?, ?, ?, 0)", [
+            (EmbeddingCache(path).get_key(text), "<f4", get_vector(text).tobytes()) for text in ["a", "bb"]
+        ])
+    connection.close()
+
+    embedding_cache = EmbeddingCache(path, max_entries=2)
+    assert len(embedding_cache) == 2
+    embedding_cache.put_many({"a": get_vector("a"), "ccc": get_vector("ccc")})
+    # "bb" was accessed least recently
+    assert len(embedding_cache) == 2
+    assert set(embedding_cache.get_many(["a", "bb", "ccc"])) == {"a", "ccc"}
@@ -0,0 +1,61 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import copy
+import json
+
+from tooltalk.utils.database_utils import CopyOnWriteDict
+
+
+def get_base():
+    return {
+        "alice": {
+            "a1": {"name": "lunch", "attendees": ["alice", "bob"]},
+            "a2": {"name": "dinner", "attendees": None},
+        },
+        "bob": {},
+        "carol": {"c1": {"name": "breakfast", "attendees": ["carol"]}},
+    }
+
+
+def test_copy_on_write_preserves_base():
+    base = get_base()
+    expected_base = copy.deepcopy(base)
+    expected = copy.deepcopy(base)
+    view = CopyOnWriteDict(base)
+
+    for database in [view, expected]:
+        database["alice"]["a1"]["name"] = "brunch"
+        database["alice"]["a1"]["attendees"].append("carol")
+        del database["alice"]["a2"]
+        database["alice"]["a3"] = {"name": "coffee", "attendees": []}
+        database["bob"]["b1"] = {"name": "gym", "attendees": None}
+        del database["carol"]
+        database["dave"] = dict()
+        database["carol"] = {"c2": {"name": "tea", "attendees": None}}
+
+    assert base == expected_base
+    assert view == expected
+    assert list(view) == list(expected)
+    assert list(view["alice"]) == list(expected["alice"])
+    assert json.dumps(view.to_dict()) == json.dumps(expected)
+    assert copy.deepcopy(view) == expected
+
+    # fresh view starts from baseline again
+    assert CopyOnWriteDict(base) == expected_base
+
+
+def test_copy_is_independent():
+    base = get_base()
+    view = CopyOnWriteDict(base)
+    view["alice"]["a1"]["name"] = "brunch"
+    fork = view.copy()
+    fork["alice"]["a1"]["name"] = "supper"
+    del fork["bob"]
+    view["carol"]["c1"]["attendees"].append("alice")
+
+    assert view["alice"]["a1"]["name"] == "brunch"
+    assert "bob" in view
+    assert fork["carol"]["c1"]["attendees"] == ["carol"]
+    assert base == get_base()
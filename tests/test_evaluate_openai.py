@@ -0,0 +1,191 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import asyncio
+import copy
+import json
+import os
+
+import pytest
+
+from tooltalk.apis import ALL_APIS, utils
+from tooltalk.evaluation import evaluate_openai
+from tooltalk.evaluation.evaluate_openai import (
+    CacheModes, CachedOpenAIPredictor, OpenAIPredictor, compact_conversation_metadata, expand_conversation_metadata
+)
+from tooltalk.evaluation.openai_stub_server import OracleChatResponder
+from tooltalk.utils import file_utils
+from tooltalk.utils.file_utils import get_names_and_paths, iter_conversations
+from tooltalk.utils.manifest_utils import RunManifest
+from tooltalk.utils.store_utils import ContentStore, ResponseCache
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+DATASET_DIR = os.path.join(DATA_DIR, "tooltalk")
+
+
+def get_prediction(predictor: OpenAIPredictor, history: list) -> dict:
+    metadata = {"location": "Seattle", "timestamp": "2023-09-11 09:00:00", "username": "justinkool"}
+    openai_request = predictor.get_openai_request(metadata, history)
+    openai_response = {"choices": [{"message": {"role": "assistant", "content": f"reply {len(history)}"}}]}
+    return predictor.parse_openai_response(openai_request, openai_response)
+
+
+def test_compact_metadata(tmp_path):
+    predictor = OpenAIPredictor("gpt-4", ALL_APIS)
+    history = list()
+    turns = list()
+    for i in range(4):
+        history.append({"role": "user", "text": f"message {i}"})
+        prediction = get_prediction(predictor, history)
+        turns.append({"role": "assistant", "text": "reply", "predictions": [prediction]})
+        history.append({"role": "assistant", "text": prediction["text"]})
+    conversation = {"conversation": turns + [{"role": "user", "text": "bye"}]}
+    expected = copy.deepcopy(conversation)
+
+    store = ContentStore(str(tmp_path / "metadata.sqlite"))
+    compact = compact_conversation_metadata(conversation, store)
+    compact_request = compact["conversation"][0]["predictions"][0]["metadata"]["openai_request"]
+    assert set(compact_request) == {"model", "messages_key", "functions_key"}
+    # one node per message and one function list
+    assert len(store) == len(history) + 1
+
+    restored = expand_conversation_metadata(copy.deepcopy(compact), ContentStore(store.path))
+    assert restored == expected
+    # outputs with inline metadata are left as is
+    assert expand_conversation_metadata(copy.deepcopy(expected), store) == expected
+
+
+def test_cached_predictor(tmp_path, monkeypatch):
+    calls = list()
+
+    def chat_completion(**openai_request):
+        calls.append(openai_request)
+        content = f"reply to {openai_request['messages'][-1]['content']}"
+        return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+    monkeypatch.setattr(evaluate_openai, "openai_chat_completion", chat_completion)
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    metadata = {"location": "Seattle", "timestamp": "2023-09-11 09:00:00", "username": "justinkool"}
+    history = [{"role": "user", "text": "hello"}]
+
+    recorded = CachedOpenAIPredictor(OpenAIPredictor("gpt-4", ALL_APIS), cache, CacheModes.RECORD)
+    prediction = recorded.predict(metadata, history)
+    assert prediction["text"] == "reply to hello"
+    assert len(calls) == 1 and len(cache) == 1
+
+    replayed = CachedOpenAIPredictor(OpenAIPredictor("gpt-4", ALL_APIS), cache, CacheModes.REPLAY)
+    assert replayed.predict(metadata, history) == prediction
+    assert len(calls) == 1
+    # requests are keyed by all arguments, e.g. the model
+    with pytest.raises(KeyError):
+        CachedOpenAIPredictor(OpenAIPredictor("gpt-3.5-turbo", ALL_APIS), cache, CacheModes.REPLAY).predict(
+            metadata, history
+        )
+
+    record_missing = CachedOpenAIPredictor(OpenAIPredictor("gpt-4", ALL_APIS), cache, CacheModes.RECORD_MISSING)
+    assert record_missing.predict(metadata, history) == prediction
+    record_missing.predict(metadata, history + [{"role": "user", "text": "again"}])
+    assert len(calls) == 2 and len(cache) == 2
+
+
+@pytest.fixture
+def oracle_chat_completion(monkeypatch):
+    """
+    Answers chat completions with oracle predictions, except logins use a wrong password so they raise and calls
+    needing a login fail after. Forked workers inherit the patched function.
+    """
+    monkeypatch.setenv("OPENAI_KEY", "oracle")
+    responder = OracleChatResponder(conversation for _, conversation in iter_conversations(DATASET_DIR))
+
+    def chat_completion(**openai_request):
+        message = responder.get_message(openai_request["messages"])
+        function_call = message.get("function_call")
+        if function_call is not None and function_call["name"] == "UserLogin":
+            function_call["arguments"] = json.dumps({**json.loads(function_call["arguments"]), "password": "wrong"})
+        return {"choices": [{"message": message}]}
+
+    async def chat_completion_async(**openai_request):
+        # yield to the event loop like a request would, so conversations interleave
+        await asyncio.sleep(0)
+        return chat_completion(**openai_request)
+
+    monkeypatch.setattr(evaluate_openai, "openai_chat_completion", chat_completion)
+    monkeypatch.setattr(evaluate_openai, "openai_chat_completion_async", chat_completion_async)
+    yield
+    utils.set_similarity_backend("sent2vec")
+
+
+def run_evaluation(output_dir: str, *flags: str) -> tuple:
+    """
+    Evaluates dataset, returning bytes of every output file and manifest entries with their metrics.
+    """
+    evaluate_openai.main([
+        "--dataset", DATASET_DIR,
+        "--database", os.path.join(DATA_DIR, "databases"),
+        "--output_dir", output_dir,
+        "--similarity_backend", "ngram",
+        *flags,
+    ])
+    outputs = dict()
+    for file_name, file_path in get_names_and_paths(output_dir):
+        with open(file_path, 'rb') as reader:
+            outputs[file_name] = reader.read()
+    return outputs, RunManifest.from_output_dir(output_dir).load()
+
+
+def test_workers_match_serial(oracle_chat_completion, tmp_path):
+    expected_outputs, expected_entries = run_evaluation(str(tmp_path / "serial"))
+    assert len(expected_outputs) == len(list(iter_conversations(DATASET_DIR)))
+    assert any(b'"exception": "The password is incorrect."' in content for content in expected_outputs.values())
+
+    outputs, entries = run_evaluation(str(tmp_path / "workers"), "--workers", "3")
+    assert outputs == expected_outputs
+    assert entries == expected_entries
+
+
+@pytest.mark.parametrize("flags", [("--async_concurrency", "8"), ("--async_concurrency", "8", "--turn_workers", "4")])
+def test_async_concurrency_matches_serial(oracle_chat_completion, tmp_path, flags):
+    expected_outputs, expected_entries = run_evaluation(str(tmp_path / "serial"))
+    outputs, entries = run_evaluation(str(tmp_path / "async"), *flags)
+    assert outputs == expected_outputs
+    assert entries == expected_entries
+
+
+@pytest.mark.parametrize("interrupted_call", ["append", "replace"])
+def test_resume_interrupted_shard_commit(oracle_chat_completion, tmp_path, monkeypatch, interrupted_call):
+    flags = ("--output_format", "jsonl", "--shard_size", "20")
+    _, expected_entries = run_evaluation(str(tmp_path / "expected"), *flags)
+    expected_conversations = dict(iter_conversations(str(tmp_path / "expected")))
+
+    # process dies while committing the first shard, after logging part of it or before renaming it into place
+    append = RunManifest.append
+    appended = list()
+
+    def interrupted_append(self, *args, **kwargs):
+        appended.append(args)
+        if len(appended) == 2:
+            raise KeyboardInterrupt
+        return append(self, *args, **kwargs)
+
+    def interrupted_replace(*args):
+        raise KeyboardInterrupt
+
+    output_dir = str(tmp_path / "resumed")
+    with monkeypatch.context() as patch:
+        if interrupted_call == "append":
+            patch.setattr(RunManifest, "append", interrupted_append)
+        else:
+            patch.setattr(file_utils.os, "replace", interrupted_replace)
+        with pytest.raises(KeyboardInterrupt):
+            run_evaluation(output_dir, *flags)
+    assert len(RunManifest.from_output_dir(output_dir).load()) == (1 if interrupted_call == "append" else 20)
+
+    outputs, entries = run_evaluation(output_dir, *flags)
+    file_names = [file_name for file_name, _ in iter_conversations(output_dir)]
+    assert sorted(file_names) == sorted(set(file_names)) == sorted(expected_conversations)
+    assert dict(iter_conversations(output_dir)) == expected_conversations
+    assert {name: entry["metrics"] for name, entry in entries.items()} == {
+        name: entry["metrics"] for name, entry in expected_entries.items()
+    }
+    assert all(entry["shard"] in outputs for entry in entries.values())
@@ -0,0 +1,59 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import json
+import os
+
+import pytest
+
+from tooltalk.utils.file_utils import JSONL_OPENERS, ShardedJsonlWriter, iter_chunks, iter_conversations, open_jsonl
+
+
+def get_conversations(count: int) -> list:
+    return [{"name": f"conversation-{i}", "conversation": [{"role": "user", "text": "é" * i}]} for i in range(count)]
+
+
+@pytest.mark.parametrize("suffix", list(JSONL_OPENERS))
+def test_sharded_jsonl_round_trip(tmp_path, suffix):
+    conversations = get_conversations(5)
+    commits = list()
+    with ShardedJsonlWriter(str(tmp_path), 2, suffix, lambda *commit: commits.append(commit)) as writer:
+        for conversation in conversations:
+            writer.write(f"{conversation['name']}.json", json.dumps(conversation))
+        # shard in progress is hidden from readers
+        assert len(list(iter_conversations(str(tmp_path)))) == 4
+
+    assert [file_names for _, file_names in commits] == [
+        ["conversation-0.json", "conversation-1.json"],
+        ["conversation-2.json", "conversation-3.json"],
+        ["conversation-4.json"],
+    ]
+    assert sorted(os.listdir(tmp_path)) == sorted(shard_name for shard_name, _ in commits)
+    assert all(shard_name.endswith(suffix) for shard_name, _ in commits)
+    with open_jsonl(str(tmp_path / commits[0][0])) as reader:
+        assert json.loads(reader.readline()) == conversations[0]
+
+    read = sorted(iter_conversations(str(tmp_path)), key=lambda pair: pair[0])
+    assert read == [(f"{conversation['name']}.json", conversation) for conversation in conversations]
+
+
+def test_iter_conversations_mixed(tmp_path):
+    conversations = get_conversations(3)
+    with open(tmp_path / "conversation-0.json", "w", encoding="utf-8") as writer:
+        json.dump(conversations[0], writer, indent=4)
+    with ShardedJsonlWriter(str(tmp_path), suffix=".jsonl.gz") as writer:
+        for conversation in conversations[1:]:
+            writer.write(f"{conversation['name']}.json", json.dumps(conversation))
+
+    assert sorted(name for name, _ in iter_conversations(str(tmp_path))) == [
+        "conversation-0.json", "conversation-1.json", "conversation-2.json"
+    ]
+    assert list(iter_conversations(str(tmp_path / "conversation-0.json"))) == [
+        ("conversation-0.json", conversations[0])
+    ]
+
+
+def test_iter_chunks():
+    assert list(iter_chunks(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_chunks([], 2)) == []
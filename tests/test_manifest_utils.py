@@ -0,0 +1,49 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import json
+
+from tooltalk.utils.file_utils import get_names_and_paths
+from tooltalk.utils.manifest_utils import RunManifest, hash_bytes
+
+
+def test_run_manifest(tmp_path):
+    manifest = RunManifest.from_output_dir(str(tmp_path))
+    assert manifest.load() == dict()
+
+    first = json.dumps({"metrics": {"matches": 1}}).encode("utf-8")
+    manifest.append("a.json", first, {"matches": 1})
+    second = json.dumps({"metrics": {"matches": 2}}).encode("utf-8")
+    entry = manifest.append("a.json", second, {"matches": 2})
+    manifest.append("b.json", b"{}", None)
+    assert entry == {
+        "file_name": "a.json", "size": len(second), "sha256": hash_bytes(second), "metrics": {"matches": 2}
+    }
+
+    # interrupted append leaves a partial line behind
+    with open(manifest.path, "a", encoding="utf-8") as writer:
+        writer.write('{"file_name": "c.js')
+    entries = manifest.load()
+    assert list(entries) == ["a.json", "b.json"]
+    assert entries["a.json"] == entry
+
+    output_file_path = tmp_path / "a.json"
+    assert not manifest.is_current(entry)
+    output_file_path.write_bytes(second)
+    assert manifest.is_current(entry)
+    output_file_path.write_bytes(first + b" ")
+    assert not manifest.is_current(entry)
+
+    # conversations in shards are current as long as their shard exists
+    shard_entry = manifest.append("c.json", b"{}", None, shard="part-0.jsonl")
+    assert manifest.load()["c.json"]["shard"] == "part-0.jsonl"
+    assert not manifest.is_current(shard_entry)
+    (tmp_path / "part-0.jsonl").write_text("{}\n")
+    assert manifest.is_current(shard_entry)
+
+    # manifest is hidden from tools listing outputs
+    assert sorted(name for name, _ in get_names_and_paths(str(tmp_path))) == ["a.json", "part-0.jsonl"]
+
+    manifest.clear()
+    assert manifest.load() == dict()
@@ -0,0 +1,85 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import os
+
+import openai
+import pytest
+
+from tooltalk.apis import ALL_APIS
+from tooltalk.evaluation import evaluate_openai
+from tooltalk.evaluation.evaluate_openai import OpenAIPredictor
+from tooltalk.evaluation.openai_stub_server import StubConfig, StubOpenAIServer
+from tooltalk.utils.file_utils import iter_conversations
+from tooltalk.utils.openai_utils import retry_on_limit
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.abspath(os.path.join(this_dir, "..", "data"))
+dataset_path = os.path.join(data_dir, "easy")
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    monkeypatch.setenv("API_TALK_DEBUG", "1")
+    monkeypatch.setenv("OPENAI_KEY", "stub")
+    servers = list()
+
+    def serve_dataset(**config) -> StubOpenAIServer:
+        server = StubOpenAIServer.from_dataset(dataset_path, StubConfig(**config)).start()
+        servers.append(server)
+        monkeypatch.setattr(openai, "api_base", server.api_base)
+        monkeypatch.setattr(openai, "api_key", "stub")
+        return server
+
+    yield serve_dataset
+    for server in servers:
+        server.stop()
+
+
+def get_api_request() -> dict:
+    """
+    Returns chat completion arguments of first conversation in dataset answered with an api call.
+    """
+    conversation = next(
+        conversation for _, conversation in iter_conversations(dataset_path)
+        if "apis" in conversation["conversation"][1]
+    )
+    predictor = OpenAIPredictor("gpt-4", ALL_APIS)
+    history = [{"role": "user", "text": conversation["conversation"][0]["text"]}]
+    return predictor.get_openai_request(conversation["metadata"], history)
+
+
+def test_evaluate_against_stub(serve, tmp_path):
+    server = serve()
+    evaluate_openai.main([
+        "--dataset", dataset_path,
+        "--database", os.path.join(data_dir, "databases"),
+        "--output_dir", str(tmp_path / "outputs"),
+        "--similarity_backend", "ngram",
+        "--modes", "predict", "evaluate",
+    ])
+    outputs = [conversation for _, conversation in iter_conversations(str(tmp_path / "outputs"))]
+    assert len(outputs) == len(list(iter_conversations(dataset_path)))
+    assert all(conversation["metrics"]["success"] for conversation in outputs)
+
+    counts = server.stats.to_dict()["counts"]
+    assert counts["requests"] == counts["chat_completions"] > 0
+    assert "errors" not in counts and "rate_limited" not in counts
+
+
+def test_rate_limit_backoff(serve):
+    server = serve(rate_limit_rate=1.0)
+    create = retry_on_limit(openai.ChatCompletion.create, retries=3, wait=0)
+    with pytest.raises(openai.error.RateLimitError):
+        create(**get_api_request())
+    assert server.stats.to_dict()["counts"] == {"requests": 3, "rate_limited": 3}
+
+
+def test_malformed_arguments(serve):
+    server = serve(malformed_rate=1.0)
+    openai_request = get_api_request()
+    prediction = OpenAIPredictor.parse_openai_response(openai_request, openai.ChatCompletion.create(**openai_request))
+    assert prediction["role"] == "api"
+    assert prediction["request"]["parameters"] is None
+    assert server.stats.to_dict()["counts"]["malformed"] == 1
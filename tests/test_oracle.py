@@ -3,7 +3,6 @@ Copyright (c) Microsoft Corporation.
 Licensed under the MIT license.
 """
 import os
-import copy
 import json
 import logging
 import argparse
@@ -12,73 +11,23 @@ from typing import List
 import pytest
 from tqdm import tqdm
 
-from tooltalk.evaluation.tool_executor import ToolExecutor, BaseAPIPredictor
-from tooltalk.utils.file_utils import get_names_and_paths
+from tooltalk.evaluation.oracle_predictor import OraclePredictor
+from tooltalk.evaluation.tool_executor import ToolExecutor
+from tooltalk.utils.file_utils import JSONL_OPENERS, ShardedJsonlWriter, iter_conversations
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 os.environ["API_TALK_DEBUG"] = "1"
 
 
-class OraclePredictor(BaseAPIPredictor):
-    """
-    Stores entire conversation, then determines conversation state from conversation_history.
-    It then passes in the next, correct API call based off of ground truth.
-
-    aka it produces oracle predictions for testing purposes.
-    """
-
-    def __init__(self, conversation: dict):
-        self.conversation = conversation
-
-    def predict(self, metadata: dict, conversation_history: dict) -> dict:
-        assert metadata == self.conversation["metadata"]
-        turn_index = 0
-        api_index = 0
-        for turn in conversation_history:
-            # ignore api calls
-            if turn["role"] == "assistant" or turn["role"] == "user":
-                api_index = 0
-                turn_index += 1
-            elif turn["role"] == "api":
-                api_index += 1
-            else:
-                raise ValueError(f"Unknown role {turn['role']}")
-
-        if len(self.conversation["conversation"]) <= turn_index:
-            raise ValueError("Conversation history is longer than ground truth conversation")
-
-        turn = self.conversation["conversation"][turn_index]
-
-        if "apis" in turn:
-            if len(turn["apis"]) < api_index:
-                raise ValueError("Current api history is longer than ground truth api history")
-            elif len(turn["apis"]) == api_index:
-                return {
-                    "role": "assistant",
-                    "text": turn["text"]
-                }
-            else:
-                parameters = copy.deepcopy(turn["apis"][api_index]["request"]["parameters"])
-                if "session_token" in parameters:
-                    del parameters["session_token"]
-                return {
-                    "role": "api",
-                    "request": {
-                        "api_name": turn["apis"][api_index]["request"]["api_name"],
-                        "parameters": parameters
-                    }
-                }
-        else:
-            return {
-                "role": "assistant",
-                "text": turn["text"]
-            }
-
-
 def get_arg_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset_name", type=str)
+    parser.add_argument("--output_dir", type=str, default=None,
+                        help="Writes conversations with predictions and metrics here, then checks they read back")
+    parser.add_argument("--output_format", choices=["json"] + [suffix[1:] for suffix in JSONL_OPENERS],
+                        default="json", help="One JSON file per conversation or JSONL shards, optionally compressed")
+    parser.add_argument("--shard_size", type=int, default=1000, help="Number of conversations per JSONL shard")
 
     return parser
 
@@ -95,12 +44,16 @@ def main(flags: List[str] = None):
     test_dataset_path = os.path.join(data_dir, args.dataset_name)
     test_database_path = os.path.join(data_dir, "databases")
 
+    output_writer = None
+    outputs = dict()
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        if args.output_format != "json":
+            output_writer = ShardedJsonlWriter(args.output_dir, args.shard_size, f".{args.output_format}")
+
     tool_executor = ToolExecutor(init_database_dir=test_database_path)
-    for file_name, file_path in tqdm(get_names_and_paths(test_dataset_path)):
+    for file_name, conversation in tqdm(iter_conversations(test_dataset_path)):
         logger.info(f"Running conversation: {file_name}")
-        with open(file_path, 'r', encoding='utf-8') as reader:
-            conversation = json.load(reader)
-
         predictor_func = OraclePredictor(conversation)
         conversation_with_predictions = tool_executor.run_conversation(conversation, predictor_func)
         conversation_with_metrics = tool_executor.evaluate_predictions(conversation_with_predictions)
@@ -110,11 +63,40 @@ def main(flags: List[str] = None):
         assert metrics["success"]
         logger.info(f"Conversation: {file_name} passed!")
 
+        if args.output_dir is not None:
+            outputs[file_name] = conversation_with_metrics
+            if output_writer is not None:
+                output_writer.write(file_name, json.dumps(conversation_with_metrics))
+            else:
+                with open(os.path.join(args.output_dir, file_name), 'w', encoding='utf-8') as writer:
+                    json.dump(conversation_with_metrics, writer, indent=4)
+
+    if args.output_dir is not None:
+        if output_writer is not None:
+            output_writer.close()
+        assert dict(iter_conversations(args.output_dir)) == outputs
+
 
 @pytest.mark.parametrize("dataset_name", ["easy", "tooltalk"])
 def test_oracle(dataset_name):
     main(["--dataset_name", dataset_name])
 
 
+@pytest.mark.parametrize("output_format", ["json"] + [suffix[1:] for suffix in JSONL_OPENERS])
+def test_oracle_outputs(output_format, tmp_path):
+    main([
+        "--dataset_name", "easy",
+        "--output_dir", str(tmp_path),
+        "--output_format", output_format,
+        "--shard_size", "10",
+    ])
+    names = os.listdir(tmp_path)
+    if output_format == "json":
+        assert len(names) == 28
+    else:
+        # 28 conversations in shards of 10
+        assert len(names) == 3 and all(name.endswith(f".{output_format}") for name in names)
+
+
 if __name__ == '__main__':
     main()
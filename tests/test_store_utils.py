@@ -0,0 +1,43 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import pytest
+
+from tooltalk.utils.store_utils import ContentStore
+
+
+def test_content_store(tmp_path):
+    path = str(tmp_path / "store.sqlite")
+    store = ContentStore(path)
+    key = store.put({"b": [1, 2], "a": "text"})
+    # keys only depend on content
+    assert store.put({"a": "text", "b": [1, 2]}) == key
+    assert store.get(key) == {"a": "text", "b": [1, 2]}
+
+    # other processes only see flushed values
+    other_store = ContentStore(path)
+    assert key not in other_store
+    store.flush()
+    assert key in other_store
+    assert other_store.get(key) == {"a": "text", "b": [1, 2]}
+    with pytest.raises(KeyError):
+        other_store.get("missing")
+
+
+def test_content_store_lists(tmp_path):
+    store = ContentStore(str(tmp_path / "store.sqlite"))
+    history = [{"role": "system", "content": "hi"}, {"role": "user", "content": "set an alarm"}]
+    prefix_key = store.put_list(history)
+    store.flush()
+    count = len(store)
+
+    # appending items stores one node per new item, prefix is shared
+    key = store.put_list(history + [{"role": "assistant", "content": "done"}])
+    store.flush()
+    assert len(store) == count + 1
+    assert store.get_list(prefix_key) == history
+    assert store.get_list(key) == history + [{"role": "assistant", "content": "done"}]
+    assert store.put_list([]) is None
+    assert store.get_list(None) == []
+    store.close()
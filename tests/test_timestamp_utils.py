@@ -0,0 +1,28 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+from datetime import datetime
+
+import pytest
+
+from tooltalk.utils.timestamp_utils import DATE_FORMAT, TIME_FORMAT, TIMESTAMP_FORMAT, parse_datetime
+
+FORMATS = [TIMESTAMP_FORMAT, DATE_FORMAT, TIME_FORMAT]
+
+
+@pytest.mark.parametrize("value", [
+    "2023-09-10 09:00:00", "2023-09-10", "09:00:00", "2023-9-10 9:0:0", "2023-02-30 00:00:00", "2023-09-10 24:00:00",
+    "23:59:60", "2023-09-10  09:00:00", "2023-09-10 09:00:00 ", "0000-01-01", "tomorrow", "", None, 20230910,
+])
+def test_parse_datetime_matches_strptime(value):
+    for date_format in FORMATS:
+        try:
+            expected = datetime.strptime(value, date_format)
+        except (TypeError, ValueError) as e:
+            with pytest.raises(type(e)) as exc_info:
+                parse_datetime(value, date_format)
+            assert str(exc_info.value) == str(e)
+        else:
+            assert parse_datetime(value, date_format) == expected
+
@@ -0,0 +1,247 @@
+"""
+Copyright (c) Microsoft Corporation.
+Licensed under the MIT license.
+"""
+import asyncio
+import copy
+import json
+import os
+from datetime import datetime, timedelta
+from random import Random
+
+import pytest
+
+from tooltalk.apis import utils
+from tooltalk.evaluation.oracle_predictor import OraclePredictor
+from tooltalk.evaluation.tool_executor import ToolExecutor
+from tooltalk.utils.file_utils import iter_conversations
+from tooltalk.utils.timestamp_utils import DATE_FORMAT, TIME_FORMAT, TIMESTAMP_FORMAT
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+DATABASE_DIR = os.path.join(DATA_DIR, "databases")
+
+
+class WrongPasswordOraclePredictor(OraclePredictor):
+    """
+    Oracle predictions, except logins use a wrong password so they raise and calls needing a login fail after.
+    """
+    def predict(self, metadata: dict, conversation_history: dict) -> dict:
+        prediction = super().predict(metadata, conversation_history)
+        if prediction["role"] == "api" and prediction["request"]["api_name"] == "UserLogin":
+            prediction["request"]["parameters"]["password"] = "wrong"
+        return prediction
+
+
+@pytest.fixture
+def ngram_backend():
+    # scoring with sent2vec needs its model, any backend works for comparing execution paths
+    utils.set_similarity_backend("ngram")
+    yield
+    utils.set_similarity_backend("sent2vec")
+
+
+def load_conversations() -> list:
+    """
+    Multi turn conversations, including one whose ground truth login raises.
+    """
+    conversations = [conversation for _, conversation in iter_conversations(os.path.join(DATA_DIR, "tooltalk"))]
+    assert any(api["exception"] for conversation in conversations
+               for turn in conversation["conversation"] for api in turn.get("apis", list()))
+    return conversations
+
+
+def evaluate_run(tool_executor: ToolExecutor, conversation: dict) -> str:
+    return json.dumps(tool_executor.evaluate_predictions(conversation), indent=4)
+
+
+def get_api_call(rng: Random) -> dict:
+    api_name = rng.choice(["AddAlarm", "DeleteAlarm", "FindAlarms", "GetReminders"])
+    parameters = {"session_token": rng.choice(["a", "b"])}
+    response = {"status": "success"}
+    if api_name == "AddAlarm":
+        parameters["time"] = rng.choice(["07:00:00", "08:00:00"])
+        response = {"alarm_id": rng.choice(["1111-1111", "2222-2222"])}
+    elif api_name == "DeleteAlarm":
+        parameters["alarm_id"] = rng.choice(["1111-1111", "2222-2222"])
+    elif api_name == "FindAlarms":
+        response = {"alarms": [{"alarm_id": alarm_id} for alarm_id in rng.sample(["1111-1111", "2222-2222"], 1)]}
+    else:
+        response = {"reminders": list()}
+    # retrieval checks compare responses, so only actions fail
+    exception = rng.choice([None, None, "error"]) if api_name in {"AddAlarm", "DeleteAlarm"} else None
+    return {
+        "request": {"api_name": api_name, "parameters": parameters},
+        "response": None if exception else response,
+        "exception": exception,
+    }
+
+
+def scan_matches(tool_executor: ToolExecutor, predictions: list, ground_truths: list) -> list:
+    # reference matching, every prediction scans all remaining ground truths in order
+    remaining = list(range(len(ground_truths)))
+    matches = list()
+    for prediction in predictions:
+        for i in remaining:
+            if tool_executor.compare_api_calls(prediction, ground_truths[i]):
+                remaining.remove(i)
+                matches.append(i)
+                break
+        else:
+            matches.append(None)
+    return matches
+
+
+def test_evaluate_predictions_matches_scan():
+    tool_executor = ToolExecutor(init_database_dir=DATABASE_DIR)
+    rng = Random(0)
+    for _ in range(50):
+        ground_truths = [get_api_call(rng) for _ in range(rng.randint(1, 20))]
+        predictions = [copy.deepcopy(rng.choice(ground_truths)) for _ in range(rng.randint(0, 20))]
+        predictions += [get_api_call(rng) for _ in range(rng.randint(0, 5))]
+        rng.shuffle(predictions)
+        for prediction in predictions:
+            prediction["role"] = "api"
+        expected = scan_matches(tool_executor, predictions, ground_truths)
+
+        conversation = {"conversation": [
+            {"role": "User"},
+            {"role": "Assistant", "apis": ground_truths, "predictions": predictions},
+        ]}
+        metrics = tool_executor.evaluate_predictions(conversation)["metrics"]
+        assert [prediction["match"] for prediction in predictions] == [i is not None for i in expected]
+        assert [ground_truth["match"] for ground_truth in ground_truths] == \
+            [i in expected for i in range(len(ground_truths))]
+        assert metrics["matches"] == sum(i is not None for i in expected)
+
+
+def perturb_json(value, rng: Random):
+    """
+    Returns a copy of a json-like value with one randomly chosen leaf or list changed. Keys of dicts are kept,
+    like they would be in responses of executed calls.
+    """
+    if isinstance(value, dict) and value:
+        value = dict(value)
+        key = rng.choice(sorted(value))
+        value[key] = perturb_json(value[key], rng)
+        return value
+    elif isinstance(value, list) and value:
+        value = list(value)
+        i = rng.randrange(len(value))
+        choice = rng.random()
+        if choice < 0.3:
+            del value[i]
+        elif choice < 0.5:
+            value.append(copy.deepcopy(value[i]))
+        elif choice < 0.6:
+            rng.shuffle(value)
+        else:
+            value[i] = perturb_json(value[i], rng)
+        return value
+    elif isinstance(value, bool):
+        return not value
+    elif isinstance(value, (int, float)):
+        return value + rng.choice([-1, 1])
+    elif isinstance(value, str):
+        for date_format in (TIMESTAMP_FORMAT, DATE_FORMAT, TIME_FORMAT):
+            try:
+                timestamp = datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+            # malformed timestamps fail to execute, so they are shifted instead
+            return (timestamp + rng.choice([timedelta(hours=1), timedelta(days=-1)])).strftime(date_format)
+        return rng.choice([value + " perturbed", value.upper(), value[:len(value) // 2], ""])
+    return value
+
+
+def perturb_api_call(api_call: dict, rng: Random) -> dict:
+    """
+    Prediction like api_call, with one of its request parameter values, response or exception perturbed.
+    """
+    prediction = copy.deepcopy(api_call)
+    parameters = prediction["request"]["parameters"]
+    field = rng.choice(["parameters", "parameters", "response", "exception"])
+    if field == "parameters" and parameters:
+        # calls missing required parameters fail to execute, so only their values are perturbed
+        key = rng.choice(sorted(parameters))
+        parameters[key] = perturb_json(parameters[key], rng)
+    elif field == "response" and prediction["exception"] is None:
+        prediction["response"] = perturb_json(prediction["response"], rng)
+    elif prediction["exception"] is None:
+        # calls that raise have no response
+        prediction["exception"] = "perturbed"
+        prediction["response"] = None
+    else:
+        prediction["exception"] = perturb_json(prediction["exception"], rng)
+    return prediction
+
+
+def test_evaluate_predictions_matches_scan_on_dataset(ngram_backend):
+    # match_fields of every API must agree with its check_api_call_correctness, or bucketing drops matches
+    tool_executor = ToolExecutor(init_database_dir=DATABASE_DIR)
+    rng = Random(0)
+    conversations = list(iter_conversations(os.path.join(DATA_DIR, "easy"))) + \
+        list(iter_conversations(os.path.join(DATA_DIR, "tooltalk")))
+    api_names = set()
+    # perturbed predictions that still match the ground truth they were made from, and all perturbed predictions
+    tolerated_count = 0
+    perturbed_count = 0
+    for _, conversation in conversations:
+        ground_truths = [api for turn in conversation["conversation"] for api in turn.get("apis", list())]
+        api_names.update(ground_truth["request"]["api_name"] for ground_truth in ground_truths)
+        for _ in range(10):
+            predictions = [copy.deepcopy(ground_truth) for ground_truth in ground_truths]
+            for _ in range(3 * len(ground_truths)):
+                ground_truth = rng.choice(ground_truths)
+                prediction = perturb_api_call(ground_truth, rng)
+                tolerated_count += tool_executor.compare_api_calls(prediction, ground_truth)
+                perturbed_count += 1
+                predictions.append(prediction)
+            rng.shuffle(predictions)
+            for prediction in predictions:
+                prediction["role"] = "api"
+            expected = scan_matches(tool_executor, predictions, ground_truths)
+
+            evaluated = tool_executor.evaluate_predictions({"conversation": [
+                {"role": "User"},
+                {"role": "Assistant", "apis": copy.deepcopy(ground_truths), "predictions": predictions},
+            ]})
+            assert [prediction["match"] for prediction in predictions] == [i is not None for i in expected]
+            assert [ground_truth["match"] for ground_truth in evaluated["conversation"][1]["apis"]] == \
+                [i in expected for i in range(len(ground_truths))]
+    # every API is covered, and perturbed predictions both match and fail to
+    assert api_names == set(tool_executor.apis)
+    assert 0 < tolerated_count < perturbed_count
+
+
+@pytest.mark.parametrize("predictor_class", [OraclePredictor, WrongPasswordOraclePredictor])
+def test_parallel_turns_match_serial(ngram_backend, predictor_class):
+    tool_executor = ToolExecutor(init_database_dir=DATABASE_DIR)
+    failed_calls = 0
+    for conversation in load_conversations():
+        predictor = predictor_class(conversation)
+        expected = tool_executor.run_conversation(copy.deepcopy(conversation), predictor)
+        actual = tool_executor.run_conversation(copy.deepcopy(conversation), predictor, num_workers=4)
+        assert evaluate_run(tool_executor, actual) == evaluate_run(tool_executor, expected)
+        failed_calls += sum(prediction.get("exception") is not None
+                            for turn in expected["conversation"] for prediction in turn.get("predictions", list()))
+    # some predicted calls raise in every mode
+    assert failed_calls > 0
+
+
+@pytest.mark.parametrize("parallel_turns", [False, True])
+def test_async_conversation_matches_serial(ngram_backend, parallel_turns):
+    tool_executor = ToolExecutor(init_database_dir=DATABASE_DIR)
+    for predictor_class in (OraclePredictor, WrongPasswordOraclePredictor):
+        for conversation in load_conversations():
+            predictor = predictor_class(conversation)
+
+            async def predict(metadata: dict, conversation_history: list) -> dict:
+                # yield to the event loop like a request would, so parallel turns interleave
+                await asyncio.sleep(0)
+                return predictor(metadata, conversation_history)
+
+            expected = tool_executor.run_conversation(copy.deepcopy(conversation), predictor)
+            actual = asyncio.run(tool_executor.run_conversation_async(
+                copy.deepcopy(conversation), predict, parallel_turns=parallel_turns
+            ))
+            assert evaluate_run(tool_executor, actual) == evaluate_run(tool_executor, expected)